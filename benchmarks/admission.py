@@ -0,0 +1,168 @@
+"""
+File: admission.py
+
+This program shows what admission control does for the real client while another host floods the command port.
+It runs the communication process of the server like the server does, on TCP and on a Unix domain socket. Flooding
+processes send requests over TCP as fast as they can, and idle connections are opened which never send anything.
+Meanwhile the real client, on the Unix domain socket, checks the alarm state through the client's transport every
+CHECK_INTERVAL_SECONDS, like the daemon does, and so does a client on another host over TCP, which is retried like
+the transport does when it is turned away.
+
+It runs once with admission control turned off, by raising the limits out of reach, and once with the server's
+limits. All processes run on this host, so the flood is made to look like it comes from another host by only
+exempting the Unix domain socket from rate limiting, and the other client connects from REMOTE_CLIENT_ADDRESS, which
+the server sees as a host of its own.
+
+It runs against a fresh database in a temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/admission.py --flooders 4 --idle 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+sys.path.insert(0, os.path.abspath("client"))
+
+import server  # noqa: E402
+import transport  # noqa: E402
+from common import BIND_ADDRESS, flood, percentile, quiet, use_temporary_database  # noqa: E402
+
+UNIX_SOCKET_PATH = "server/wakeywakey.sock"
+FLOOD_COMMANDS = ["get_status", "get_user_preferences", "get_alarm_state", "set_wakeup_window 2"]
+CHECK_INTERVAL_SECONDS = 0.05
+REMOTE_CLIENT_ADDRESS = "127.0.0.2"
+
+
+def main():
+    """
+    Parses the arguments, runs the flood with and without admission control and prints a report.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures the real client's latency during a flood.")
+    parser.add_argument("--flooders", type=int, default=4, help="processes flooding the command port")
+    parser.add_argument("--idle", type=int, default=20, help="connections opened which never send anything")
+    parser.add_argument("--seconds", type=float, default=5, help="how long to flood")
+    arguments = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("This platform has no Unix domain sockets.")
+
+    print(f"{'Admission':<11}{'Client':<8}{'p50':>10}{'p99':>10}{'max':>10}{'Failed':>8}{'Flood served':>14}"
+          f"{'Accepted':>10}{'Rate limited':>14}{'Per client':>12}{'Over capacity':>15}")
+    limits = (server.RATE_LIMIT_PER_SECOND, server.RATE_LIMIT_BURST, server.MAX_CONNECTIONS_PER_CLIENT,
+              server.MAX_CONNECTIONS)
+    for admission, (rate, burst, max_per_client, max_connections) in [("off", (10 ** 9, 10 ** 9, 1000, 1000)),
+                                                                      ("on", limits)]:
+        # Work in a temporary directory with a fresh database
+        use_temporary_database()
+
+        # Set the limits before the communication process is started, and share the counters like initialize does
+        server.RATE_LIMIT_PER_SECOND, server.RATE_LIMIT_BURST = rate, burst
+        server.MAX_CONNECTIONS_PER_CLIENT, server.MAX_CONNECTIONS = max_per_client, max_connections
+        server.RATE_LIMIT_EXEMPT_HOSTS = ["local client"]
+        server.admission_counters = multiprocessing.Array("q", len(server.ADMISSION_COUNTERS))
+
+        # Start the communication process like the server does
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind((BIND_ADDRESS, 0))
+        port = s.getsockname()[1]
+        unix_socket = server.unix_server_socket(UNIX_SOCKET_PATH)
+        communication_process = multiprocessing.Process(target=quiet, args=(server.communication, s, unix_socket),
+                                                        daemon=True)
+        communication_process.start()
+        time.sleep(0.5)
+
+        # Open the idle connections, and start flooding
+        idle_connections = [socket.create_connection((BIND_ADDRESS, port)) for _ in range(arguments.idle)]
+        served = multiprocessing.Value("i", 0)
+        flooders = [multiprocessing.Process(target=flood, args=(port, FLOOD_COMMANDS, served), daemon=True)
+                    for _ in range(arguments.flooders)]
+        for flooder in flooders:
+            flooder.start()
+
+        # Check the alarm state like the real client does
+        transport.configure(transport.CONNECT_TIMEOUT_SECONDS, transport.READ_TIMEOUT_SECONDS, transport.RETRIES,
+                            UNIX_SOCKET_PATH)
+        latencies = {"local": [], "remote": []}
+        failed = {"local": 0, "remote": 0}
+        end = time.perf_counter() + arguments.seconds
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            try:
+                transport.request(BIND_ADDRESS, port, "get_alarm_state")
+                latencies["local"].append(time.perf_counter() - start)
+            except transport.ServerUnreachable:
+                failed["local"] += 1
+
+            start = time.perf_counter()
+            if remote_request(port, "get_alarm_state"):
+                latencies["remote"].append(time.perf_counter() - start)
+            else:
+                failed["remote"] += 1
+            time.sleep(CHECK_INTERVAL_SECONDS)
+
+        # Stop everything
+        for flooder in flooders:
+            flooder.terminate()
+            flooder.join()
+        for idle_connection in idle_connections:
+            idle_connection.close()
+        communication_process.terminate()
+        communication_process.join()
+
+        # Report
+        counters = dict(zip(server.ADMISSION_COUNTERS, server.admission_counters))
+        for client, client_latencies in latencies.items():
+            client_latencies.sort()
+            if client_latencies:
+                latency_columns = (f"{percentile(client_latencies, 50) * 1000:>8.1f}ms"
+                                   f"{percentile(client_latencies, 99) * 1000:>8.1f}ms"
+                                   f"{client_latencies[-1] * 1000:>8.1f}ms")
+            else:
+                latency_columns = f"{'-':>10}{'-':>10}{'-':>10}"
+            print(f"{admission:<11}{client:<8}{latency_columns}{failed[client]:>8}{served.value:>14}"
+                  f"{counters['accepted']:>10}{counters['rate_limited']:>14}{counters['over_client_capacity']:>12}"
+                  f"{counters['over_capacity']:>15}")
+
+
+
+
+def remote_request(port, message):
+    """
+    Sends a request like the client's transport does, but from REMOTE_CLIENT_ADDRESS, and tries it again after a
+    backoff when it fails or is turned away.
+    :param port: The port of the command port.
+    :type port: int
+    :param message: The request, which can be tried again.
+    :type message: str
+    :return: answered (bool)
+    """
+    for attempt in range(1, transport.RETRIES + 2):
+        try:
+            connection = socket.create_connection((BIND_ADDRESS, port), timeout=transport.CONNECT_TIMEOUT_SECONDS,
+                                                  source_address=(REMOTE_CLIENT_ADDRESS, 0))
+            connection.settimeout(transport.READ_TIMEOUT_SECONDS)
+            connection.sendall(bytes(message, "utf-8"))
+            reply = b""
+            chunk = connection.recv(4096)
+            while chunk:
+                reply += chunk
+                chunk = connection.recv(4096)
+            connection.close()
+            if reply != server.BUSY_REPLY:
+                return True
+        except OSError:
+            pass
+        time.sleep(transport.backoff_seconds(attempt))
+
+    return False
+
+
+
+if __name__ == '__main__':
+    main()
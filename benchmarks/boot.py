@@ -0,0 +1,141 @@
+"""
+File: boot.py
+
+This program measures how long the server takes from being started until it answers commands, and until it is ready.
+For every run it starts server/server.py in a fresh interpreter, with gpiozero on mock pins, and asks for the alarm
+state like a client does until it gets an answer. It reads the startup report the server prints, and shows how long
+every phase of the startup took.
+
+Every run is against a fresh database in its own temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/boot.py --runs 10
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPOSITORY_PATH, "server"))
+sys.path.insert(0, os.path.join(REPOSITORY_PATH, "client"))
+
+import server_setup  # noqa: E402
+import transport  # noqa: E402
+
+BIND_ADDRESS = "127.0.0.1"
+POLL_SECONDS = 0.002
+# gpiozero on mock pins which can play tones, so the server runs on any machine
+MOCK_GPIO_ENVIRONMENT = {"GPIOZERO_PIN_FACTORY": "mock", "GPIOZERO_MOCK_PIN_CLASS": "mockpwmpin"}
+STARTUP_REPORT_HEADER = "Startup:"
+READY_MILESTONE = "ready after"
+
+
+def main():
+    """
+    Parses the arguments, starts the server the given amount of times and prints the distributions.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures how long the server takes to answer and to be ready.")
+    parser.add_argument("--runs", type=int, default=5, help="how many times to start the server")
+    parser.add_argument("--no-http", action="store_true", help="start the server without the HTTP gateway")
+    arguments = parser.parse_args()
+
+    # Fail fast while the server isn't listening yet
+    transport.configure(1, 5, 0)
+
+    first_answers = []
+    phases = {}
+    for run in range(arguments.runs):
+        first_answer, run_phases = run_server(not arguments.no_http)
+        first_answers.append(first_answer)
+        for name, milliseconds in run_phases:
+            phases.setdefault(name, []).append(milliseconds)
+        print(f"Run {run + 1}: answering after {first_answer * 1000:.0f} ms, "
+              f"startup report total {sum(milliseconds for name, milliseconds in run_phases):.0f} ms")
+
+    print()
+    print(f"{'Phase':<28}{'min':>10}{'median':>10}{'max':>10}")
+    for name, values in phases.items():
+        print(f"{name:<28}{min(values):>7.1f} ms{statistics.median(values):>7.1f} ms{max(values):>7.1f} ms")
+    print(f"{'first answer (measured)':<28}{min(first_answers) * 1000:>7.1f} ms"
+          f"{statistics.median(first_answers) * 1000:>7.1f} ms{max(first_answers) * 1000:>7.1f} ms")
+
+
+def run_server(with_http):
+    """
+    Starts the server in a fresh interpreter, waits until it answers and until it is ready, and stops it.
+    :param with_http: Whether to start the HTTP gateway too.
+    :type with_http: bool
+    :return: first_answer (float), phases (list of tuples)
+    """
+    # Work in a temporary directory with a fresh database, the songs of the repository, on free ports
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    os.mkdir("server")
+    shutil.copytree(os.path.join(REPOSITORY_PATH, "server", "songs"), os.path.join("server", "songs"))
+    server_setup.create_database()
+    port = free_port()
+    db = sqlite3.connect(server_setup.DATABASE_PATH)
+    db.execute("UPDATE server_settings SET address = ?, port = ?, http_port = ?",
+               (BIND_ADDRESS, port, free_port() if with_http else None))
+    db.commit()
+    db.close()
+
+    # Start it, in its own process group, so that it can be stopped with its communication workers
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", os.path.join(REPOSITORY_PATH, "server", "server.py")],
+                               env=dict(os.environ, **MOCK_GPIO_ENVIRONMENT), stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, text=True, start_new_session=True)
+
+    # Ask for the alarm state until it answers
+    while True:
+        try:
+            transport.request(BIND_ADDRESS, port, "get_alarm_state")
+            break
+        except transport.ServerUnreachable:
+            if process.poll() is not None:
+                raise RuntimeError("The server stopped before it answered.")
+            time.sleep(POLL_SECONDS)
+    first_answer = time.perf_counter() - start
+
+    # Read the startup report, until the server is ready
+    phases = []
+    in_report = False
+    for line in process.stdout:
+        if line.strip() == STARTUP_REPORT_HEADER:
+            in_report = True
+        elif in_report:
+            fields = line.strip().split()
+            name = " ".join(fields[:fields.index("ms") - 1])
+            phases.append((name, float(fields[fields.index("ms") - 1])))
+            if READY_MILESTONE in line:
+                break
+
+    os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+    os.chdir(REPOSITORY_PATH)
+    shutil.rmtree(directory)
+
+    return first_answer, phases
+
+
+def free_port():
+    """
+    Returns a TCP port which nothing listens on.
+    :return: port (int)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((BIND_ADDRESS, 0))
+        return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+    main()
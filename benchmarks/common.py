@@ -0,0 +1,95 @@
+"""
+File: common.py
+
+This module holds what the benchmarks share: a fresh database in a temporary directory, running a part of the server
+with its output thrown away, flooding the command port, and percentiles.
+
+The benchmarks import it as a sibling, since the directory of the running benchmark comes first on the path.
+"""
+
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import server  # noqa: E402
+import server_setup  # noqa: E402
+
+BIND_ADDRESS = "127.0.0.1"
+
+
+def use_temporary_database():
+    """
+    Changes into a new temporary directory and creates a fresh server database there, so that the real database is
+    never touched.
+    :return: directory (str)
+    """
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    os.mkdir("server")
+    server_setup.create_database()
+
+    return directory
+
+
+def quiet(function, *args):
+    """
+    Runs a function with its output thrown away.
+    :param function: The function to run.
+    :type function: callable
+    :return: None
+    """
+    sys.stdout = open(os.devnull, "w")
+    function(*args)
+
+
+def flood(port, commands, served, seconds=None, errors=None):
+    """
+    Sends requests to the command port as fast as it answers them, for the given amount of seconds or forever.
+    :param port: The port of the command port.
+    :type port: int
+    :param commands: The commands to send, one picked at random for every request.
+    :type commands: list of str
+    :param served: Shared counter of requests which were served rather than turned away.
+    :type served: multiprocessing.Value
+    :param seconds: How long to send requests, or None to send them until the process is stopped.
+    :type seconds: float
+    :param errors: Shared counter of failed requests, or None to not count them.
+    :type errors: multiprocessing.Value
+    :return: None
+    """
+    end = None if seconds is None else time.perf_counter() + seconds
+    while end is None or time.perf_counter() < end:
+        try:
+            connection = socket.create_connection((BIND_ADDRESS, port), timeout=5)
+            connection.sendall(bytes(random.choice(commands), "utf-8"))
+            reply = b""
+            chunk = connection.recv(4096)
+            while chunk:
+                reply += chunk
+                chunk = connection.recv(4096)
+            connection.close()
+            if reply != server.BUSY_REPLY:
+                with served.get_lock():
+                    served.value += 1
+        except OSError:
+            if errors is not None:
+                with errors.get_lock():
+                    errors.value += 1
+            time.sleep(0.01)
+
+
+def percentile(sorted_values, percent):
+    """
+    Returns the given percentile of a sorted list.
+    :param sorted_values: The values, sorted from lowest to highest.
+    :type sorted_values: list
+    :param percent: Which percentile to return.
+    :type percent: int
+    :return: value (any)
+    """
+    return sorted_values[min(len(sorted_values) - 1, len(sorted_values) * percent // 100)]
@@ -0,0 +1,155 @@
+"""
+File: dashboards.py
+
+This program load tests the HTTP gateway with dashboards polling it. It runs the gateway like the server does, and
+several processes poll /status and /user_preferences over kept alive connections, sending the ETag of their last
+response in If-None-Match. Meanwhile the preferences are changed every so often, and after every change the gateway
+is asked for them at once, to check that the cache never serves them stale.
+
+It runs once without the response cache and once with it, against a fresh database in a temporary directory, so the
+real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/dashboards.py --clients 8 --seconds 5
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+sys.path.insert(0, os.path.abspath("common"))
+
+import http_gateway  # noqa: E402
+import server  # noqa: E402
+from common import BIND_ADDRESS, percentile, quiet, use_temporary_database  # noqa: E402
+
+PATHS = ["/status", "/user_preferences"]
+WRITE_INTERVAL_SECONDS = 0.5
+
+
+def main():
+    """
+    Parses the arguments, load tests the gateway with and without the cache, and prints a report.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Load tests the HTTP gateway with polling dashboards.")
+    parser.add_argument("--clients", type=int, default=8, help="processes polling at once")
+    parser.add_argument("--seconds", type=float, default=5, help="how long to poll")
+    arguments = parser.parse_args()
+
+    # Work in a temporary directory with a fresh database
+    use_temporary_database()
+
+    print(f"{arguments.clients} dashboards polling {', '.join(PATHS)} for {arguments.seconds:.0f} s, "
+          f"preferences changed every {WRITE_INTERVAL_SECONDS} s")
+    print(f"{'Cache':<10}{'Requests/s':>12}{'Not modified':>14}{'p50':>10}{'p99':>10}{'Stale reads':>13}")
+    for cache_seconds in [0, http_gateway.CACHE_SECONDS]:
+        http_gateway.CACHE_SECONDS = cache_seconds
+        results = load_test(arguments.clients, arguments.seconds)
+
+        latencies = sorted(latency for result in results["clients"] for latency in result["latencies"])
+        not_modified = sum(result["not_modified"] for result in results["clients"])
+        cache_name = f"{cache_seconds} s" if cache_seconds else "off"
+        print(f"{cache_name:<10}{len(latencies) / arguments.seconds:>12.0f}{not_modified / len(latencies):>14.0%}"
+              f"{percentile(latencies, 50) * 1000:>8.2f}ms{percentile(latencies, 99) * 1000:>8.2f}ms"
+              f"{results['stale_reads']:>7} of {results['writes']}")
+
+
+def load_test(clients, seconds):
+    """
+    Starts the gateway, polls it from several processes, and changes the preferences meanwhile.
+    :param clients: How many processes poll at once.
+    :type clients: int
+    :param seconds: How long to poll.
+    :type seconds: float
+    :return: results (dict)
+    """
+    # Share the generations with the gateway like initialize does
+    server.preferences_generation = multiprocessing.Value("q", 0)
+    server.write_generation = multiprocessing.Value("q", 0)
+
+    # Start the gateway like the server does
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((BIND_ADDRESS, 0))
+    port = s.getsockname()[1]
+    gateway_process = multiprocessing.Process(target=quiet, daemon=True, args=(
+        http_gateway.serve, s, server.http_routes(), server.get_user_id, server.get_write_generation))
+    gateway_process.start()
+    time.sleep(0.5)
+    s.close()
+
+    # Poll from several processes
+    result_queue = multiprocessing.Queue()
+    pollers = [multiprocessing.Process(target=poll, args=(port, seconds, result_queue)) for _ in range(clients)]
+    for poller in pollers:
+        poller.start()
+
+    # Change the preferences meanwhile, and read them back at once
+    writes = 0
+    stale_reads = 0
+    connection = http.client.HTTPConnection(BIND_ADDRESS, port)
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        time.sleep(WRITE_INTERVAL_SECONDS)
+        writes += 1
+        server.set_wakeup_window(writes % 60).result()
+
+        connection.request("GET", "/user_preferences")
+        if json.loads(connection.getresponse().read())["wakeup_window"] != writes % 60:
+            stale_reads += 1
+    connection.close()
+
+    results = {"clients": [result_queue.get() for _ in pollers], "writes": writes, "stale_reads": stale_reads}
+    for poller in pollers:
+        poller.join()
+    gateway_process.terminate()
+    gateway_process.join()
+
+    return results
+
+
+
+def poll(port, seconds, result_queue):
+    """
+    Polls the gateway like a dashboard, as fast as it answers, over one kept alive connection, revalidating with the
+    ETag of the last response of every path.
+    :param port: The port of the gateway.
+    :type port: int
+    :param seconds: How long to poll.
+    :type seconds: float
+    :param result_queue: Where to put the latencies and the amount of 304 responses.
+    :type result_queue: multiprocessing.Queue
+    :return: None
+    """
+    connection = http.client.HTTPConnection(BIND_ADDRESS, port)
+    etags = {}
+    latencies = []
+    not_modified = 0
+
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        path = PATHS[len(latencies) % len(PATHS)]
+        headers = {"If-None-Match": etags[path]} if path in etags else {}
+
+        start = time.perf_counter()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+
+        if response.status == 304:
+            not_modified += 1
+        etags[path] = response.getheader("ETag")
+
+    connection.close()
+    result_queue.put({"latencies": latencies, "not_modified": not_modified})
+
+
+
+if __name__ == '__main__':
+    main()
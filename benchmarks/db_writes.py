@@ -0,0 +1,147 @@
+"""
+File: db_writes.py
+
+This program measures how many settings writes per second the server can store, with and without group commit.
+It runs against a fresh database in a temporary directory, so the real database is never touched.
+
+Run it from the repository root: python benchmarks/db_writes.py [writes]
+"""
+
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import server  # noqa: E402
+import server_setup  # noqa: E402
+
+DEFAULT_WRITES = 200
+BIND_ADDRESS = "127.0.0.1"
+
+
+def main():
+    """
+    Creates a temporary database, then runs every benchmark and prints the writes per second of each.
+    :return: None
+    """
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_WRITES
+
+    # Work in a temporary directory with a fresh database
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("server")
+    server_setup.create_database()
+
+    benchmarks = [("One commit per write", benchmark_commit_per_write),
+                  ("Writer, waiting for each write", benchmark_writer_sequential),
+                  ("Writer, burst of writes", benchmark_writer_burst),
+                  ("Command port, burst of set commands", benchmark_command_port)]
+
+    print(f"{writes} writes each, group commit window {server.GROUP_COMMIT_WINDOW_SECONDS * 1000:.0f} ms")
+    for name, benchmark in benchmarks:
+        seconds = benchmark(writes)
+        print(f"{name:40}{writes / seconds:10.0f} writes/s\t{seconds * 1000:8.1f} ms total")
+
+
+def benchmark_commit_per_write(writes):
+    """
+    Writes the way the server did before the database writer: a new connection and a commit for every write.
+    :param writes: How many writes to do.
+    :type writes: int
+    :return: seconds (float)
+    """
+    start = time.perf_counter()
+    for i in range(writes):
+        db = sqlite3.connect(server.DATABASE_PATH)
+        db.execute("UPDATE user_preferences SET wakeup_window = ? WHERE id = ?", (i, 1))
+        db.commit()
+        db.close()
+
+    return time.perf_counter() - start
+
+
+def benchmark_writer_sequential(writes):
+    """
+    Writes through the database writer, but waits for every write to complete before sending the next.
+    :param writes: How many writes to do.
+    :type writes: int
+    :return: seconds (float)
+    """
+    start = time.perf_counter()
+    for i in range(writes):
+        server.set_wakeup_window(i).result()
+
+    return time.perf_counter() - start
+
+
+def benchmark_writer_burst(writes):
+    """
+    Writes through the database writer without waiting, then waits for the last write.
+    :param writes: How many writes to do.
+    :type writes: int
+    :return: seconds (float)
+    """
+    start = time.perf_counter()
+    futures = [server.set_wakeup_window(i) for i in range(writes)]
+    futures[-1].result()
+
+    return time.perf_counter() - start
+
+
+def benchmark_command_port(writes):
+    """
+    Sends a burst of set commands to the command port, then waits until the last one can be read back.
+    :param writes: How many set commands to send.
+    :type writes: int
+    :return: seconds (float)
+    """
+    # Serve the command port from a thread
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((BIND_ADDRESS, 0))
+    port = s.getsockname()[1]
+    s.listen(5)
+    threading.Thread(target=server.communication, args=(s,), daemon=True).start()
+
+    # Silence the verbose output of the server while sending
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.perf_counter()
+        for i in range(writes):
+            send_command(port, f"set_wakeup_window {i}")
+        user_preferences = send_command(port, "get_user_preferences")
+        seconds = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    # The read must see the last write
+    if f"'wakeup_window': {writes - 1}" not in user_preferences:
+        raise RuntimeError("The last write was not visible to the next read.")
+
+    return seconds
+
+
+def send_command(port, command):
+    """
+    Sends a command to the command port and returns the reply, if any.
+    :param port: The port of the command port.
+    :type port: int
+    :param command: The command to send.
+    :type command: str
+    :return: reply (str)
+    """
+    connection = socket.create_connection((BIND_ADDRESS, port))
+    connection.send(bytes(command, "utf-8"))
+    reply = connection.recv(1024).decode("utf-8")
+    connection.close()
+
+    return reply
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+File: fire_jitter.py
+
+This program measures how late the alarm goes off while the command port is flooded with requests.
+It runs the communication process of the server like the server does, floods it from several client processes, and
+runs alarm_mode with a mock buzzer on alarms scheduled a few seconds ahead. For every alarm it measures the fire lag,
+from the scheduled time until alarm_state is stored as 1 and until the buzzer plays its first note, and the
+dismissal to silence latency, from the client sending set_alarm_state 0 until alarm_mode stops the buzzer for good.
+
+alarm_mode is called directly with the exact countdown, so the whole second resolution of the main loop's
+seconds_until_wakeup_time comes on top of these numbers.
+
+It runs against a fresh database in a temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/fire_jitter.py --trials 10 --clients 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import server  # noqa: E402
+import songs  # noqa: E402
+from common import BIND_ADDRESS, flood, quiet, use_temporary_database  # noqa: E402
+
+FLOOD_COMMANDS = ["get_alarm_state", "get_user_preferences", "get_user_preferences_if_changed 0",
+                  "set_wakeup_window 2"]
+
+
+class MockBuzzer:
+    """
+    Stands in for gpiozero.TonalBuzzer, and remembers when it played and stopped.
+    """
+
+    def __init__(self):
+        self.plays = []
+        self.stops = []
+
+    def play(self, note):
+        self.plays.append(time.time())
+
+    def stop(self):
+        self.stops.append(time.time())
+
+
+def main():
+    """
+    Parses the arguments, runs the trials and prints the distributions.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures alarm fire lag while the command port is flooded.")
+    parser.add_argument("--trials", type=int, default=5, help="how many alarms to measure")
+    parser.add_argument("--clients", type=int, default=4, help="how many processes flood the command port")
+    parser.add_argument("--lead", type=float, default=3, help="seconds between scheduling and firing an alarm")
+    arguments = parser.parse_args()
+
+    # Work in a temporary directory with a fresh database, but play the songs of the repository
+    songs.SONGS_DIRECTORY = os.path.abspath(songs.SONGS_DIRECTORY)
+    use_temporary_database()
+
+    # Start the communication process like the server does
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((BIND_ADDRESS, 0))
+    port = s.getsockname()[1]
+    s.listen(5)
+    communication_process = multiprocessing.Process(target=quiet, args=(server.communication, s), daemon=True)
+    communication_process.start()
+
+    # Start flooding it
+    served = multiprocessing.Value("i", 0)
+    flood_processes = [multiprocessing.Process(target=flood, args=(port, FLOOD_COMMANDS, served), daemon=True)
+                       for _ in range(arguments.clients)]
+    for flood_process in flood_processes:
+        flood_process.start()
+
+    # Remember when alarm_state 1 is stored
+    alarm_state_stored = []
+    set_alarm_state = server.set_alarm_state
+
+    def timed_set_alarm_state(new_alarm_state):
+        future = set_alarm_state(new_alarm_state)
+        if new_alarm_state == 1:
+            future.add_done_callback(lambda done: alarm_state_stored.append(time.time()))
+        return future
+
+    server.set_alarm_state = timed_set_alarm_state
+
+    # Run the trials
+    fire_lags = []
+    buzzer_lags = []
+    silence_latencies = []
+    stdout = sys.stdout
+    flood_start = time.time()
+    served_at_start = served.value
+    for trial in range(arguments.trials):
+        buzzer = MockBuzzer()
+        alarm_state_stored.clear()
+        scheduled_time = time.time() + arguments.lead
+
+        # Sound the alarm, and dismiss it a little while after it goes off
+        sys.stdout = open(os.devnull, "w")
+        dismissed = []
+        dismisser = threading.Thread(target=dismiss, args=(port, buzzer, dismissed), daemon=True)
+        dismisser.start()
+        server.alarm_mode(scheduled_time - time.time(), buzzer)
+        dismisser.join()
+        sys.stdout.close()
+        sys.stdout = stdout
+
+        # Measure
+        fire_lags.append(alarm_state_stored[0] - scheduled_time)
+        buzzer_lags.append(buzzer.plays[0] - scheduled_time)
+        silence_latencies.append(buzzer.stops[-1] - dismissed[0])
+        print(f"Trial {trial + 1}: fire lag {fire_lags[-1] * 1000:.1f} ms, first note {buzzer_lags[-1] * 1000:.1f} ms, "
+              f"silence after {silence_latencies[-1] * 1000:.1f} ms")
+
+    served_per_second = (served.value - served_at_start) / (time.time() - flood_start)
+
+    # Report
+    print(f"\n{arguments.trials} alarms, {arguments.clients} flooding clients served at {served_per_second:.0f} "
+          f"requests/s")
+    report("Scheduled until alarm_state 1", fire_lags)
+    report("Scheduled until first note", buzzer_lags)
+    report("Dismissal until silence", silence_latencies)
+
+
+
+
+def dismiss(port, buzzer, dismissed):
+    """
+    Waits for the buzzer to start, then passes the awake test a random moment later, like the client does.
+    :param port: The port of the command port.
+    :type port: int
+    :param buzzer: The buzzer of the alarm.
+    :type buzzer: MockBuzzer
+    :param dismissed: Gets the time the dismissal was sent appended to it.
+    :type dismissed: list
+    :return: None
+    """
+    while len(buzzer.plays) == 0:
+        time.sleep(0.01)
+    time.sleep(random.uniform(1, 2))
+
+    dismissed.append(time.time())
+    connection = socket.create_connection((BIND_ADDRESS, port))
+    connection.send(bytes("set_alarm_state 0 0", "utf-8"))
+    connection.close()
+
+
+def report(name, values):
+    """
+    Prints the distribution of the given latencies.
+    :param name: What was measured.
+    :type name: str
+    :param values: The latencies in seconds.
+    :type values: list of float
+    :return: None
+    """
+    values = sorted(values)
+    print(f"{name:32}min {values[0] * 1000:8.1f} ms   p50 {values[len(values) // 2] * 1000:8.1f} ms   "
+          f"p95 {values[min(len(values) - 1, len(values) * 95 // 100)] * 1000:8.1f} ms   "
+          f"max {values[-1] * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+File: fleet.py
+
+This program measures how long fleet mode takes to query many servers, compared with querying them one after another.
+It starts the given amount of fake servers on this machine, which answer get_status like the server does, each after
+a random delay. One of them is slow, and one never answers, so it has to time out after every attempt.
+
+Run it from the repository root, for example: python benchmarks/fleet.py --hosts 100 --slow 1.5 --timeout 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath("client"))
+
+import fleet  # noqa: E402
+import transport  # noqa: E402
+
+BIND_ADDRESS = "127.0.0.1"
+STATUS = {"alarm_state": 0, "preferences_revision": 3,
+          "user_preferences": {"wakeup_time_hour": 6, "wakeup_time_minute": 30, "utc_offset": 2, "wakeup_window": 2,
+                               "active_state": 1, "time_zone": "Europe/Oslo", "recurrence": "weekdays",
+                               "skip_dates": None},
+          "seconds_until_wakeup_time": 30000}
+
+
+def main():
+    """
+    Parses the arguments, starts the fake servers, queries them both ways and prints the times.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures fleet mode against querying servers one by one.")
+    parser.add_argument("--hosts", type=int, default=100, help="how many fake servers to query")
+    parser.add_argument("--delay", type=float, default=0.05, help="highest normal answer delay in seconds")
+    parser.add_argument("--slow", type=float, default=1, help="answer delay of the slow server in seconds")
+    parser.add_argument("--timeout", type=float, default=2, help="seconds each server gets to answer")
+    parser.add_argument("--retries", type=int, default=0, help="how many times a failed request is tried again")
+    arguments = parser.parse_args()
+
+    transport.configure(transport.CONNECT_TIMEOUT_SECONDS, arguments.timeout, arguments.retries)
+
+    # Start the fake servers, where the first is slow and the second never answers
+    delays = [arguments.slow, None] + [random.uniform(0, arguments.delay) for _ in range(arguments.hosts - 2)]
+    servers = start_fake_servers(delays)
+
+    # Query them all at once
+    start = time.perf_counter()
+    results = fleet.run_command(servers, "get_status", arguments.timeout)
+    fleet_seconds = time.perf_counter() - start
+
+    # Query them one after another
+    start = time.perf_counter()
+    for server in servers:
+        fleet.run_command([server], "get_status", arguments.timeout)
+    sequential_seconds = time.perf_counter() - start
+
+    answered = [seconds for server, reply, error, seconds in results if error is None]
+    print(f"{arguments.hosts} servers, slowest answering after {arguments.slow} s, one timing out after "
+          f"{arguments.timeout} s in each of {arguments.retries + 1} attempts")
+    print(f"Fleet mode:\t\t{fleet_seconds:.2f} s, {len(answered)} answered, "
+          f"{fleet.count_failures(results, 'get_status')} failed")
+    print(f"One after another:\t{sequential_seconds:.2f} s")
+    print(f"Slowest single server:\t{max(arguments.slow, arguments.timeout * (arguments.retries + 1)):.2f} s "
+          f"(without backoff)")
+
+
+def start_fake_servers(delays):
+    """
+    Starts one fake server per delay in a background thread.
+    :param delays: How many seconds each server waits before answering, or None to never answer.
+    :type delays: list
+    :return: servers (list of tuple)
+    """
+    loop = asyncio.new_event_loop()
+    servers = []
+    started = threading.Event()
+
+    async def start_all():
+        for delay in delays:
+            fake_server = await asyncio.start_server(lambda reader, writer, delay=delay: answer(reader, writer, delay),
+                                                     BIND_ADDRESS, 0, backlog=len(delays))
+            servers.append(fake_server.sockets[0].getsockname()[:2])
+        started.set()
+
+    def run():
+        loop.run_until_complete(start_all())
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    started.wait()
+
+    return servers
+
+
+async def answer(reader, writer, delay):
+    """
+    Answers a request like the server does, after the given delay.
+    :param reader: The reader of the connection.
+    :type reader: asyncio.StreamReader
+    :param writer: The writer of the connection.
+    :type writer: asyncio.StreamWriter
+    :param delay: How many seconds to wait before answering, or None to never answer.
+    :type delay: float
+    :return: None
+    """
+    await reader.read(1024)
+    if delay is None:
+        await asyncio.sleep(3600)
+    await asyncio.sleep(delay)
+
+    writer.write(bytes(str(STATUS), "utf-8"))
+    await writer.drain()
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
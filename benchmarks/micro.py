@@ -0,0 +1,204 @@
+"""
+File: micro.py
+
+This program times the small functions which run constantly or in tight loops, each with fixed inputs, and compares
+them with a stored baseline. It exits with 1 if any of them got slower than the baseline by more than the threshold,
+so that performance work on the server and client can be measured, and regressions are caught.
+
+Every function is called in a loop long enough to take about REPEAT_SECONDS, and the fastest of REPEATS loops counts,
+since anything slower was slowed down by something else running. The loops of all functions take turns, so that a
+while in which the machine is busy slows down one loop of each rather than every loop of one. The baseline only means
+something on the machine it was saved on, so save a new one before comparing on another machine.
+
+seconds_until_wakeup_time reads the user preferences from the database the first time and from the cache of the
+process afterwards, so it runs against a fresh database in a temporary directory, on the simulated clock, so the real
+database is never touched.
+
+Run it from the repository root, for example:
+python benchmarks/micro.py --save
+python benchmarks/micro.py --threshold 0.3
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath("server"))
+sys.path.insert(0, os.path.abspath("client"))
+sys.path.insert(0, os.path.abspath("common"))
+
+import challenge  # noqa: E402
+import client  # noqa: E402
+import clock  # noqa: E402
+import server  # noqa: E402
+import server_setup  # noqa: E402
+
+BASELINE_PATH = os.path.abspath("benchmarks/micro_baseline.json")
+# Leaves room for the noise of one run to the next, which is as high as 40 percent on a busy virtual machine
+DEFAULT_THRESHOLD = 0.5
+REPEATS = 15
+REPEAT_SECONDS = 0.1
+# Monday 2026-01-05 22:00 UTC
+START_TIME = 1767650400
+CHALLENGE_SEED = 1234
+WINDOW_HEIGHT = 600
+WINDOW_WIDTH = 800
+
+
+def main():
+    """
+    Parses the arguments, times every function, and saves the baseline or compares with it.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Times the small hot functions and compares them with a baseline.")
+    parser.add_argument("--save", action="store_true", help="save the times as the new baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="how much slower than the baseline a function may get, 0.25 being 25 percent")
+    parser.add_argument("--only", nargs="+", help="only time the functions with these names")
+    arguments = parser.parse_args()
+
+    # Work in a temporary directory with a fresh database, on the simulated clock
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("server")
+    server_setup.create_database()
+    clock.use_simulated_clock(START_TIME)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    # Time every function, where the output of the functions themselves is thrown away
+    functions = {name: prepare() for name, prepare in BENCHMARKS if not arguments.only or name in arguments.only}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        results = time_functions(functions)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    print(f"{'Function':<50}{'Time':>12}{'Baseline':>12}{'Change':>9}")
+    for name in results:
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            print(f"{name:<50}{format_time(results[name]):>12}{format_time(baseline[name]):>12}{change:>+8.0%}")
+        else:
+            print(f"{name:<50}{format_time(results[name]):>12}{'-':>12}{'-':>9}")
+
+    if arguments.save:
+        baseline.update(results)
+        with open(BASELINE_PATH, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Saved the baseline to {BASELINE_PATH}")
+        return
+
+    # Fail on any regression past the threshold
+    regressions = [name for name in results
+                   if name in baseline and results[name] > baseline[name] * (1 + arguments.threshold)]
+    if len(regressions) > 0:
+        print(f"Slower than the baseline by more than {arguments.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def time_functions(functions):
+    """
+    Returns how long one call of each function takes, from the fastest of REPEATS loops of about REPEAT_SECONDS each.
+    :param functions: The functions to time, without arguments, by name.
+    :type functions: dict
+    :return: seconds (dict)
+    """
+    # Find a loop length for every function which takes about REPEAT_SECONDS
+    loops = {}
+    for name, function in functions.items():
+        timer = timeit.Timer(function)
+        number, seconds = timer.autorange()
+        loops[name] = (timer, max(1, int(number * REPEAT_SECONDS / seconds)))
+
+    # Let the loops take turns
+    results = {name: float("inf") for name in functions}
+    for _ in range(REPEATS):
+        for name, (timer, number) in loops.items():
+            results[name] = min(results[name], timer.timeit(number) / number)
+
+    return results
+
+
+def format_time(seconds):
+    """
+    Returns a time in the unit which suits it best.
+    :param seconds: The time.
+    :type seconds: float
+    :return: formatted (str)
+    """
+    if seconds < 1e-6:
+        return f"{seconds * 1e9:.0f} ns"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.2f} us"
+
+    return f"{seconds * 1e3:.2f} ms"
+
+
+def set_preferences(time_zone, recurrence, skip_dates):
+    """
+    Changes the user preferences seconds_until_wakeup_time reads, and waits until they are stored.
+    :param time_zone: The IANA time zone, or None to use the UTC offset.
+    :type time_zone: str
+    :param recurrence: The recurrence rule.
+    :type recurrence: str
+    :param skip_dates: The dates to skip, or None.
+    :type skip_dates: str
+    :return: None
+    """
+    server.set_wakeup_hour(6)
+    server.set_wakeup_minute(30)
+    server.set_utc_offset(2)
+    server.set_time_zone(time_zone)
+    server.set_recurrence(recurrence)
+    server.set_skip_dates(skip_dates)
+    server.db_wait_for_writes()
+
+
+def prepare_seconds_until_wakeup_time():
+    set_preferences(None, "once", None)
+    return server.seconds_until_wakeup_time
+
+
+def prepare_seconds_until_wakeup_time_scheduled():
+    set_preferences("Europe/Oslo", "weekdays", "2026-01-06,2026-01-07")
+    return server.seconds_until_wakeup_time
+
+
+def prepare_get_pixel_color():
+    # A pixel which touches no line, so every line of the path is checked
+    drawn_challenge = challenge.generate_challenge(CHALLENGE_SEED, WINDOW_HEIGHT, WINDOW_WIDTH)
+    return lambda: challenge.get_pixel_color(drawn_challenge, WINDOW_WIDTH - 1, WINDOW_HEIGHT - 1)
+
+
+def prepare_determine_direction():
+    source, destination, previous_direction = np.array([40, 60]), np.array([700, 520]), np.array([1, 0])
+    return lambda: challenge.determine_direction(source, destination, previous_direction)
+
+
+# Every function to time, with a function which prepares its inputs and returns it ready to be called
+BENCHMARKS = [
+    ("convert_to_seconds", lambda: lambda: server.convert_to_seconds(3, 14, 27, 55)),
+    ("seconds_to_days", lambda: lambda: server.seconds_to_days(987654)),
+    ("readable_time", lambda: lambda: server.readable_time(987654)),
+    ("seconds_until_wakeup_time", prepare_seconds_until_wakeup_time),
+    ("seconds_until_wakeup_time (time zone, weekdays)", prepare_seconds_until_wakeup_time_scheduled),
+    ("determine_direction", prepare_determine_direction),
+    ("get_pixel_color", prepare_get_pixel_color),
+    ("is_clean_input (int)", lambda: lambda: client.is_clean_input("int", "1234")),
+    ("is_clean_input (word)", lambda: lambda: client.is_clean_input("word", "Europe/Oslo")),
+]
+
+
+if __name__ == '__main__':
+    main()
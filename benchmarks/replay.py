@@ -0,0 +1,284 @@
+"""
+File: replay.py
+
+This program replays a mouse pointer trace through the awake test, without a GUI and faster than real time.
+The trace is fed through challenge.test_step, which is the same hit testing and goal detection that run_test uses.
+It reports how long every sample took to process, and checks that every run detects the same walls and goal.
+
+The trace is either recorded (a file made by trajectory.encode_trace, or a row of the wake_traces table on the
+server), or synthetic, made by walking along the path of the challenge.
+A recorded trace holds the seed and window size of its challenge, which are used unless --seed or --window are given.
+Traces recorded before the seed was stored in them need --seed.
+
+Run it from the repository root, for example:
+python benchmarks/replay.py --seed 42
+python benchmarks/replay.py --seed 42 --wall-hits 3 --runs 20
+python benchmarks/replay.py --database server/db --trace-id 7
+"""
+
+import argparse
+import configparser
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("client"))
+sys.path.insert(0, os.path.abspath("common"))
+
+import trajectory  # noqa: E402
+from challenge import LINE_THICKNESS, DIRECTION_EAST, DIRECTION_WEST, generate_challenge, get_pixel_color, \
+    rectangles_overlap, test_step  # noqa: E402
+from common import percentile  # noqa: E402
+
+SETTINGS_PATH = "client/settings.ini"
+SAMPLE_INTERVAL_SECONDS = 0.1
+STEP_PIXELS = 3
+DEFAULT_RUNS = 10
+
+
+def main():
+    """
+    Parses the arguments, replays the trace and prints a report. Exits with 1 if the runs disagree.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Replays a pointer trace through the awake test.")
+    parser.add_argument("--seed", type=int, help="seed of the challenge, defaults to that of a recorded trace")
+    parser.add_argument("--window", help="window size as WIDTHxHEIGHT, defaults to that of a recorded trace or "
+                                         "else settings.ini")
+    parser.add_argument("--trace", help="file holding a trace made by trajectory.encode_trace")
+    parser.add_argument("--database", help="server database to read a recorded trace from")
+    parser.add_argument("--trace-id", type=int, help="id of the trace in the wake_traces table")
+    parser.add_argument("--wall-hits", type=int, default=0, help="wall hits of a synthetic trace")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="how many times to replay the trace")
+    arguments = parser.parse_args()
+
+    # Get a recorded trace
+    trace = None
+    if arguments.trace is not None:
+        with open(arguments.trace, "rb") as trace_file:
+            trace = trajectory.decode_trace(trace_file.read())
+    elif arguments.database is not None and arguments.trace_id is not None:
+        trace = load_recorded_trace(arguments.database, arguments.trace_id)
+    recorded = trace is not None
+
+    # Create the challenge, the one the trace was recorded on unless told otherwise
+    seed = arguments.seed
+    if seed is None and recorded:
+        seed = trace["seed"]
+    if seed is None:
+        parser.error("--seed is required, unless the recorded trace holds the seed of its challenge")
+    if arguments.window is None and recorded and trace["window_size"] is not None:
+        window_height, window_width = trace["window_size"]
+    else:
+        window_height, window_width = window_size(arguments.window)
+    challenge = generate_challenge(seed, window_height, window_width)
+
+    # Or make a synthetic trace
+    if not recorded:
+        trace = synthetic_trace(challenge, arguments.wall_hits, random.Random(seed))
+
+    timestamps, x, y, recorded_events = trajectory.trace_samples(trace)
+    print(f"Challenge {seed} ({window_width}x{window_height}), {len(challenge[3])} lines, "
+          f"{'recorded' if recorded else 'synthetic'} trace of {len(x)} samples")
+
+    # Replay it
+    results = []
+    latencies = []
+    replay_seconds = []
+    for _ in range(arguments.runs):
+        start = time.perf_counter()
+        events, run_latencies = replay(challenge, x, y)
+        replay_seconds.append(time.perf_counter() - start)
+        results.append(events)
+        latencies += run_latencies
+
+    # Report the latency of each sample
+    latencies.sort()
+    print(f"Per sample latency:\tp50 {percentile(latencies, 50) / 1000:.1f} us, "
+          f"p95 {percentile(latencies, 95) / 1000:.1f} us, p99 {percentile(latencies, 99) / 1000:.1f} us, "
+          f"max {latencies[-1] / 1000:.1f} us")
+    real_seconds = len(results[0]) * SAMPLE_INTERVAL_SECONDS
+    print(f"Replay time:\t\tmedian {statistics.median(replay_seconds) * 1000:.2f} ms for "
+          f"{real_seconds:.1f} s of pointer movement "
+          f"({real_seconds / statistics.median(replay_seconds):.0f}x real time)")
+
+    # Report the outcome
+    events = results[0]
+    wall_hits = events.count(trajectory.EVENT_WALL)
+    reached_goal = len(events) > 0 and events[-1] == trajectory.EVENT_GOAL
+    print(f"Outcome:\t\t{'reached the goal' if reached_goal else 'never reached the goal'} after {len(events)} "
+          f"samples and {wall_hits} wall hits")
+
+    # Check that every run detected the same
+    consistent = True
+    if any(run_events != events for run_events in results):
+        print("FAILED: The runs did not detect the same walls and goal.")
+        consistent = False
+    if recorded:
+        mismatches = sum(1 for i, event in enumerate(events) if event != recorded_events[i])
+        if mismatches > 0:
+            print(f"FAILED: {mismatches} samples were detected differently than when the trace was recorded.")
+            consistent = False
+    elif not reached_goal or wall_hits != arguments.wall_hits:
+        print(f"FAILED: Expected to reach the goal after {arguments.wall_hits} wall hits.")
+        consistent = False
+
+    if consistent:
+        print(f"OK: All {arguments.runs} runs detected the same walls and goal.")
+    else:
+        sys.exit(1)
+
+
+def window_size(window):
+    """
+    Parses the window size argument, or reads it from settings.ini.
+    :param window: The window size as WIDTHxHEIGHT, or None.
+    :type window: str
+    :return: window_height (int), window_width (int)
+    """
+    if window is not None:
+        window_width, window_height = window.lower().split("x")
+        return int(window_height), int(window_width)
+
+    config = configparser.ConfigParser()
+    config.read(SETTINGS_PATH)
+
+    return int(config['CLIENT']['Window height']), int(config['CLIENT']['Window width'])
+
+
+def load_recorded_trace(database_path, trace_id):
+    """
+    Reads a trace uploaded by the client from the wake_traces table of the server database.
+    :param database_path: Where the server database is.
+    :type database_path: str
+    :param trace_id: The id of the trace.
+    :type trace_id: int
+    :return: trace (dict)
+    """
+    db = sqlite3.connect(database_path)
+    row = db.execute("SELECT trace FROM wake_traces WHERE id = ?", (trace_id,)).fetchone()
+    db.close()
+
+    if row is None:
+        sys.exit(f"There is no trace with id {trace_id}.")
+
+    return trajectory.decode_trace(row[0])
+
+
+def replay(challenge, x, y):
+    """
+    Feeds the samples through the test like run_test does, until the goal is reached.
+    The trace already holds the pointer being moved back to start after each wall hit.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :param x: The x coordinate of every sample.
+    :type x: array.array
+    :param y: The y coordinate of every sample.
+    :type y: array.array
+    :return: events (list of int), latencies (list of int) in nanoseconds
+    """
+    events = []
+    latencies = []
+
+    for i in range(len(x)):
+        start = time.perf_counter_ns()
+        event = test_step(challenge, x[i], y[i])
+        latencies.append(time.perf_counter_ns() - start)
+
+        events.append(event)
+        if event == trajectory.EVENT_GOAL:
+            break
+
+    return events, latencies
+
+
+def synthetic_trace(challenge, wall_hits, rng):
+    """
+    Makes a trace which walks along the middle of the path from start to goal. Before each of the given amount of
+    wall hits, the walk leaves the path at a random point and starts over from the start, like after a real wall hit.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :param wall_hits: How many times the trace should touch a wall.
+    :type wall_hits: int
+    :param rng: The random number generator which picks where the walls are hit.
+    :type rng: random.Random
+    :return: trace (dict)
+    """
+    seed, start_block, end_block, lines = challenge
+    goal = ((end_block[0] + end_block[2]) // 2, (end_block[1] + end_block[3]) // 2)
+    walk = path_walk(challenge) + [goal]
+
+    # Stop walking once the goal is reached
+    walk = walk[:next(i for i, point in enumerate(walk) if rectangles_overlap(point + point, end_block)) + 1]
+
+    # Walk partway, touch a wall, and start over for every wall hit
+    points = []
+    for _ in range(wall_hits):
+        partway = walk[:rng.randint(1, len(walk) - 1)]
+        wall = find_wall(challenge, partway[-1])
+        if wall is not None:
+            points += partway + [wall]
+    points += walk
+
+    trace = trajectory.create_trace(start_block[:2], goal, len(points))
+    for i, (x, y) in enumerate(points):
+        trajectory.record_sample(trace, i * SAMPLE_INTERVAL_SECONDS, x, y, trajectory.EVENT_MOVE)
+
+    return trace
+
+
+def path_walk(challenge):
+    """
+    Returns points along the middle of the path, STEP_PIXELS apart, from the start to the end of the last line.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :return: points (list of tuple)
+    """
+    seed, start_block, end_block, lines = challenge
+    middle = LINE_THICKNESS // 2
+    current = start_block[:2]
+    points = [(current[0] + middle, current[1] + middle)]
+
+    for direction, x0, y0, x1, y1 in lines:
+        # The line was drawn from the current point to its other end, then made thicker
+        if direction == DIRECTION_EAST or direction == DIRECTION_WEST:
+            ends = [(x0, current[1]), (x1 - LINE_THICKNESS, current[1])]
+        else:
+            ends = [(current[0], y0), (current[0], y1 - LINE_THICKNESS)]
+        other_end = max(ends, key=lambda end: abs(end[0] - current[0]) + abs(end[1] - current[1]))
+
+        # Walk to the other end
+        length = abs(other_end[0] - current[0]) + abs(other_end[1] - current[1])
+        for step in range(STEP_PIXELS, length + 1, STEP_PIXELS):
+            fraction = step / length
+            points.append((round(current[0] + (other_end[0] - current[0]) * fraction) + middle,
+                           round(current[1] + (other_end[1] - current[1]) * fraction) + middle))
+        current = other_end
+
+    return points
+
+
+def find_wall(challenge, point):
+    """
+    Finds a white pixel close to the given point.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :param point: Where to start looking.
+    :type point: tuple
+    :return: wall (tuple), or None if there is no wall nearby
+    """
+    for distance in range(LINE_THICKNESS, LINE_THICKNESS * 10):
+        for dx, dy in [(0, -distance), (0, distance), (-distance, 0), (distance, 0)]:
+            candidate = (point[0] + dx, point[1] + dy)
+            if get_pixel_color(challenge, *candidate) == "WHITE":
+                return candidate
+
+    return None
+
+
+
+if __name__ == '__main__':
+    main()
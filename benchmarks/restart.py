@@ -0,0 +1,274 @@
+"""
+File: restart.py
+
+This program measures how fast the server goes on with an alarm after it is killed in the middle of one.
+For every trial it starts the server like main does, with a mock buzzer, on an alarm scheduled a few seconds ahead,
+and kills it together with its communication workers, either while it is counting down or once the alarm rings.
+Then it starts the server again in a fresh interpreter, and measures:
+- how long after the restart the server is counting down again, and how late the alarm still goes off
+- how long after the restart the buzzer is ringing again, for an alarm killed while ringing
+- how long after the restart the buzzer is ringing, for an alarm killed while counting down and restarted only after
+  it should have gone off
+Before every restart it adds two more users, whose alarms are not in flight: one going off daily, which the restart
+has to keep active, and one set to go off once a day ago, which it has to turn off since it missed its time.
+A client polls the alarm state before every kill, so the restarted server has to bind its port while the
+connections of the killed one are still closing.
+
+Every trial runs against a fresh database in its own temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/restart.py --trials 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+import types
+
+# The restarted server is a fresh interpreter which imports this file from the directory of its trial
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPOSITORY_PATH, "server"))
+sys.path.insert(0, os.path.join(REPOSITORY_PATH, "client"))
+
+import server  # noqa: E402
+import server_setup  # noqa: E402
+import songs  # noqa: E402
+import transport  # noqa: E402
+
+BIND_ADDRESS = "127.0.0.1"
+# Events of the restarted server, in seconds since the epoch
+RESUMED = 0
+FIRST_NOTE = 1
+SCENARIOS = ["countdown", "ringing", "overdue"]
+# How long after the scheduled time the overdue scenario restarts the server
+OVERDUE_SECONDS = 1
+# How long to wait for the restarted server to ring, since a crashed one can linger on its communication workers
+RING_TIMEOUT_SECONDS = 10
+# Users added before every restart, by name, with their recurrence and how long ago their preferences changed
+BYSTANDERS = {"recurring": ("daily", 0), "missed": ("once", 2 * 86400)}
+
+
+class RecordingBuzzer:
+    """
+    Stands in for gpiozero.TonalBuzzer, and remembers when it first played.
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def play(self, note):
+        if self.events[FIRST_NOTE] == 0:
+            self.events[FIRST_NOTE] = time.time()
+
+    def stop(self):
+        pass
+
+
+def main():
+    """
+    Parses the arguments, runs the trials of every scenario and prints the distributions.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures how fast the server goes on with an alarm after a crash.")
+    parser.add_argument("--trials", type=int, default=5, help="how many restarts to measure per scenario")
+    parser.add_argument("--lead", type=float, default=4, help="seconds between starting and firing an alarm")
+    arguments = parser.parse_args()
+
+    results = {"Restart until counting down": [], "Alarm fire lag after restart": [], "Restart until ringing": [],
+               "Overdue restart until ringing": []}
+    active_after_restart = {name: 0 for name in BYSTANDERS}
+    for scenario in SCENARIOS:
+        for trial in range(arguments.trials):
+            restarted, scheduled_time, events, active_states = run_trial(scenario, arguments.lead)
+            for name in BYSTANDERS:
+                active_after_restart[name] += active_states[name]
+
+            if scenario == "countdown":
+                results["Restart until counting down"].append(events[RESUMED] - restarted)
+                results["Alarm fire lag after restart"].append(events[FIRST_NOTE] - scheduled_time)
+                print(f"Countdown trial {trial + 1}: counting down {(events[RESUMED] - restarted) * 1000:.0f} ms "
+                      f"after the restart, fire lag {(events[FIRST_NOTE] - scheduled_time) * 1000:.0f} ms")
+            elif scenario == "ringing":
+                results["Restart until ringing"].append(events[FIRST_NOTE] - restarted)
+                print(f"Ringing trial {trial + 1}: ringing {(events[FIRST_NOTE] - restarted) * 1000:.0f} ms "
+                      f"after the restart")
+            else:
+                results["Overdue restart until ringing"].append(events[FIRST_NOTE] - restarted)
+                print(f"Overdue trial {trial + 1}: ringing {(events[FIRST_NOTE] - restarted) * 1000:.0f} ms "
+                      f"after the restart, {OVERDUE_SECONDS} s past the alarm")
+
+    print()
+    for name, values in results.items():
+        values.sort()
+        print(f"{name:<32}min {values[0] * 1000:8.0f} ms   p50 {values[len(values) // 2] * 1000:8.0f} ms   "
+              f"max {values[-1] * 1000:8.0f} ms")
+    restarts = len(SCENARIOS) * arguments.trials
+    print(f"Daily alarms still active after the restart: {active_after_restart['recurring']} of {restarts}")
+    print(f"Missed one-off alarms still active after the restart: {active_after_restart['missed']} of {restarts}")
+
+
+def run_trial(scenario, lead):
+    """
+    Starts the server on an alarm, kills it while counting down or ringing, adds the bystanders, and restarts it. In
+    the overdue scenario, it is killed while counting down and restarted only once the alarm should have gone off.
+    :param scenario: Either countdown, ringing or overdue.
+    :type scenario: str
+    :param lead: Seconds between starting the server and firing the alarm.
+    :type lead: float
+    :return: restarted (float), scheduled_time (float), events (multiprocessing.Array), active_states (dict)
+    """
+    # Work in a temporary directory with a fresh database, on a free port
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("server")
+    server_setup.create_database()
+    port = free_port()
+    db = sqlite3.connect(server.DATABASE_PATH)
+    db.execute("UPDATE server_settings SET address = ?, port = ?, http_port = NULL", (BIND_ADDRESS, port))
+    db.commit()
+    db.close()
+
+    # Start the server on an alarm, and wait until it counts down or rings
+    scheduled_time = time.time() + lead
+    first_run = multiprocessing.Process(target=run_until_killed, args=(scheduled_time,))
+    first_run.start()
+    if scenario != "ringing":
+        time.sleep(lead / 2)
+    while get_alarm_state(port) != (1 if scenario == "ringing" else 0):
+        time.sleep(0.05)
+
+    # Kill it with its communication workers, like a crash or a power cut would
+    os.killpg(first_run.pid, signal.SIGKILL)
+    first_run.join()
+    if scenario == "overdue":
+        time.sleep(max(scheduled_time + OVERDUE_SECONDS - time.time(), 0))
+    add_bystanders()
+
+    # Restart it in a fresh interpreter
+    spawn = multiprocessing.get_context("spawn")
+    events = spawn.Array("d", 2, lock=False)
+    restarted = time.time()
+    second_run = spawn.Process(target=restart, args=(events,))
+    second_run.start()
+
+    # Wait until it rings, then dismiss the alarm
+    while events[FIRST_NOTE] == 0 and second_run.is_alive() and time.time() - restarted < lead + RING_TIMEOUT_SECONDS:
+        time.sleep(0.01)
+    if events[FIRST_NOTE] != 0:
+        transport.request(BIND_ADDRESS, port, "set_alarm_state 0")
+
+    # Its process group is already gone if it crashed
+    try:
+        os.killpg(second_run.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    second_run.join()
+    if events[FIRST_NOTE] == 0:
+        raise RuntimeError(f"The restarted server never rang, in the {scenario} scenario.")
+
+    # See which alarms of the bystanders the restart kept
+    db = sqlite3.connect(server.DATABASE_PATH)
+    active_states = dict(db.execute("SELECT name, active_state FROM users JOIN user_preferences "
+                                    "ON users.id = user_preferences.user_id"))
+    db.close()
+
+    return restarted, scheduled_time, events, active_states
+
+
+def add_bystanders():
+    """
+    Adds the users of BYSTANDERS with active alarms, half a day away, to the database of the killed server.
+    :return: None
+    """
+    wakeup_time_hour = (time.gmtime().tm_hour + 12) % 24
+    db = sqlite3.connect(server.DATABASE_PATH)
+    for name, (recurrence, changed_seconds_ago) in BYSTANDERS.items():
+        user_id = db.execute("INSERT INTO users(name) VALUES(?)", (name,)).lastrowid
+        db.execute("INSERT INTO user_preferences(user_id, wakeup_time_hour, wakeup_time_minute, utc_offset, "
+                   "wakeup_window, active_state, recurrence, preferences_changed_time) VALUES(?, ?, 0, 0, 2, 1, ?, ?)",
+                   (user_id, wakeup_time_hour, recurrence, time.time() - changed_seconds_ago))
+    db.commit()
+    db.close()
+
+
+def run_until_killed(scheduled_time):
+    """
+    Runs the server like main does, with a mock buzzer, on an alarm scheduled at the given time, until it is killed.
+    :param scheduled_time: When the alarm goes off, in seconds since the epoch.
+    :type scheduled_time: float
+    :return: None
+    """
+    # Its own process group, so that it can be killed with its communication workers
+    os.setpgrp()
+    sys.stdout = open(os.devnull, "w")
+    use_mock_buzzer(multiprocessing.Array("d", 2, lock=False))
+
+    buzzer, in_flight_alarm = server.initialize()
+    server.alarm_mode(scheduled_time - time.time(), buzzer)
+    server.main_loop(buzzer)
+
+
+def restart(events):
+    """
+    Starts the server with main, with a mock buzzer, and records when it goes on with the alarm.
+    :param events: Where to record the events of the restarted server.
+    :type events: multiprocessing.Array
+    :return: None
+    """
+    # Its own process group, so that it can be killed with its communication workers, which it forks like the server
+    os.setpgrp()
+    multiprocessing.set_start_method("fork", force=True)
+    sys.stdout = open(os.devnull, "w")
+    use_mock_buzzer(events)
+
+    resume_alarm = server.resume_alarm
+
+    def recorded_resume_alarm(in_flight_alarm, buzzer):
+        events[RESUMED] = time.time()
+        resume_alarm(in_flight_alarm, buzzer)
+
+    server.resume_alarm = recorded_resume_alarm
+    server.main()
+
+
+def use_mock_buzzer(events):
+    """
+    Makes the server use a mock buzzer, and play the songs of the repository.
+    :param events: Where the buzzer records when it first played.
+    :type events: multiprocessing.Array
+    :return: None
+    """
+    # The server imports gpiozero only when it sets up the buzzer, which then finds this one
+    sys.modules["gpiozero"] = types.SimpleNamespace(TonalBuzzer=lambda pin: RecordingBuzzer(events))
+    songs.SONGS_DIRECTORY = os.path.join(REPOSITORY_PATH, "server", "songs")
+
+
+def get_alarm_state(port):
+    """
+    Asks the server for the alarm state like a client does, or returns None while it isn't listening yet.
+    :param port: The port of the server.
+    :type port: int
+    :return: alarm_state (int), or None
+    """
+    try:
+        return int(transport.request(BIND_ADDRESS, port, "get_alarm_state"))
+    except (transport.ServerUnreachable, ValueError):
+        return None
+
+
+def free_port():
+    """
+    Returns a TCP port which nothing listens on.
+    :return: port (int)
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((BIND_ADDRESS, 0))
+        return s.getsockname()[1]
+
+
+if __name__ == '__main__':
+    main()
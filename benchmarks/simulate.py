@@ -0,0 +1,226 @@
+"""
+File: simulate.py
+
+This program runs the server main loop on the simulated clock, so that days of alarms are simulated in seconds.
+A simulated user turns the alarm on every evening and passes the awake test a while after the alarm goes off.
+With a recurrence rule other than once, the user only turns the alarm on the first evening, and it stays on.
+A second user can be added, whose alarm goes off the given amount of minutes after that of the first, so that one
+alarm goes off while the other is counting down or ringing. Both have to go off every day.
+For every simulated day, it reports how many times the main loop slept (ticks), how many database calls were made,
+and how many alarms went off.
+
+It runs against a fresh database in a temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example:
+python benchmarks/simulate.py --days 7
+python benchmarks/simulate.py --days 14 --recurrence weekdays --skip-dates 2026-01-07
+python benchmarks/simulate.py --second-user 1 --dismiss-after 90
+python benchmarks/simulate.py --second-user 1 --second-window 5
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import arrow  # noqa: E402
+import clock  # noqa: E402
+import server  # noqa: E402
+import server_setup  # noqa: E402
+import songs  # noqa: E402
+
+START_DATE = "2026-01-05"
+ACTIVATE_HOUR = 22
+SECOND_USER_NAME = "second"
+
+# Counters of the running simulation
+counters = {"db_calls": 0, "wakeups": 0}
+fire_lags = []
+
+
+class SimulationFinished(Exception):
+    """
+    Raised by the simulated clock once the simulation has run for the requested amount of days.
+    """
+
+
+class MockBuzzer:
+    """
+    Stands in for gpiozero.TonalBuzzer, and counts the notes it is asked to play.
+    """
+
+    def __init__(self):
+        self.notes = 0
+
+    def play(self, note):
+        self.notes += 1
+
+    def stop(self):
+        pass
+
+
+def main():
+    """
+    Parses the arguments, runs the simulation and prints a report.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Simulates days of alarms on the simulated clock.")
+    parser.add_argument("--days", type=int, default=7, help="how many days to simulate")
+    parser.add_argument("--hour", type=int, default=6, help="wakeup hour")
+    parser.add_argument("--minute", type=int, default=30, help="wakeup minute")
+    parser.add_argument("--window", type=int, default=2, help="wakeup window in minutes")
+    parser.add_argument("--utc-offset", type=int, default=2, help="UTC offset in hours")
+    parser.add_argument("--recurrence", default="once", help="recurrence rule, like daily, weekdays or mon,wed,fri")
+    parser.add_argument("--skip-dates", help="dates to skip, like 2026-01-07,2026-01-08")
+    parser.add_argument("--song", default=songs.DEFAULT_SONG, help="song the alarm plays, from server/songs")
+    parser.add_argument("--dismiss-after", type=float, default=45, help="seconds until the user passes the test")
+    parser.add_argument("--second-user", type=int, help="add a user whose alarm goes off this many minutes later")
+    parser.add_argument("--second-window", type=int, help="wakeup window of the second user, by default --window")
+    arguments = parser.parse_args()
+
+    # Work in a temporary directory with a fresh database, but play the songs of the repository
+    songs.SONGS_DIRECTORY = os.path.abspath(songs.SONGS_DIRECTORY)
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("server")
+    server_setup.create_database()
+    server.set_wakeup_hour(arguments.hour)
+    server.set_wakeup_minute(arguments.minute)
+    server.set_wakeup_window(arguments.window)
+    server.set_utc_offset(arguments.utc_offset)
+    server.set_recurrence(arguments.recurrence)
+    server.set_skip_dates(arguments.skip_dates)
+    server.set_song(arguments.song)
+    if arguments.second_user is not None:
+        add_second_user(arguments)
+
+    # Count what the server does
+    count_calls("db_calls", ["db_get", "db_write", "load_settings"])
+    record_wake_event_fired = server.record_wake_event_fired
+
+    def fired(scheduled_time, fired_time, event_date, user_id):
+        counters["wakeups"] += 1
+        fire_lags.append(fired_time - scheduled_time)
+        clock.call_at(fired_time + arguments.dismiss_after, lambda: dismiss(user_id))
+        return record_wake_event_fired(scheduled_time, fired_time, event_date, user_id)
+
+    server.record_wake_event_fired = fired
+
+    # Schedule the simulated user, and a snapshot of the counters at the end of every day
+    start = arrow.get(START_DATE).shift(hours=-arguments.utc_offset)
+    clock.use_simulated_clock(start.timestamp())
+    days = []
+    for day in range(arguments.days):
+        day_start = start.shift(days=day)
+        if day == 0 or arguments.recurrence == "once":
+            clock.call_at(day_start.shift(hours=ACTIVATE_HOUR).timestamp(), activate)
+        clock.call_at(day_start.shift(days=1).timestamp(), lambda day=day_start: days.append(snapshot(day)))
+    clock.call_at(start.shift(days=arguments.days).timestamp(), finish)
+
+    # Run the main loop until the last day is over
+    buzzer = MockBuzzer()
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    real_start = time.perf_counter()
+    try:
+        server.main_loop(buzzer)
+    except SimulationFinished:
+        pass
+    finally:
+        real_seconds = time.perf_counter() - real_start
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    # Report
+    print(f"Simulated {arguments.days} days in {real_seconds:.2f} s, alarm at "
+          f"{arguments.hour:02}:{arguments.minute:02} (UTC{arguments.utc_offset:+}), {arguments.recurrence}")
+    if arguments.second_user is not None:
+        print(f"Second user {arguments.second_user:+} minutes, with a wakeup window of "
+              f"{arguments.second_window or arguments.window} minutes, so 2 wakeups a day are expected")
+    print(f"{'Day':<12}{'Ticks':>8}{'DB calls':>10}{'Wakeups':>9}")
+    previous = {"ticks": 0, "db_calls": 0, "wakeups": 0}
+    for day, totals in days:
+        print(f"{day.shift(hours=arguments.utc_offset).format('YYYY-MM-DD'):<12}"
+              f"{totals['ticks'] - previous['ticks']:>8}{totals['db_calls'] - previous['db_calls']:>10}"
+              f"{totals['wakeups'] - previous['wakeups']:>9}")
+        previous = totals
+    if len(fire_lags) > 0:
+        print(f"Fire lag: max {max(fire_lags):.2f} s, buzzer played {buzzer.notes} notes")
+
+
+def count_calls(counter, function_names):
+    """
+    Wraps server functions so that every call to them increases the given counter.
+    :param counter: Which counter to increase.
+    :type counter: str
+    :param function_names: The names of the server functions to wrap.
+    :type function_names: list of str
+    :return: None
+    """
+    for function_name in function_names:
+        function = getattr(server, function_name)
+
+        def counted(*args, function=function, **kwargs):
+            counters[counter] += 1
+            return function(*args, **kwargs)
+
+        setattr(server, function_name, counted)
+
+
+def add_second_user(arguments):
+    """
+    Adds the second user, with the preferences of the first but for the wakeup time and window.
+    :param arguments: The parsed arguments.
+    :type arguments: argparse.Namespace
+    :return: None
+    """
+    server.add_user(SECOND_USER_NAME).result()
+    wakeup_minutes = (arguments.hour * 60 + arguments.minute + arguments.second_user) % (24 * 60)
+    changes = {"wakeup_time_hour": wakeup_minutes // 60, "wakeup_time_minute": wakeup_minutes % 60,
+               "wakeup_window": arguments.second_window or arguments.window, "utc_offset": arguments.utc_offset,
+               "recurrence": arguments.recurrence, "skip_dates": arguments.skip_dates, "song": arguments.song}
+    server.set_user_preferences(changes, server.get_user_id(SECOND_USER_NAME))
+
+
+def activate():
+    """
+    The simulated users turn their alarms on for the next morning.
+    :return: None
+    """
+    for user_id in server.get_users().values():
+        server.set_active_state(1, user_id)
+
+
+def dismiss(user_id):
+    """
+    The simulated user passes the awake test, which turns the alarm off like the client does.
+    :param user_id: Whose alarm it is.
+    :type user_id: int
+    :return: None
+    """
+    server.set_alarm_state(0)
+    server.record_wake_event_dismissed(clock.now(), 0, user_id)
+
+
+def snapshot(day):
+    """
+    Returns the counters at the end of the given day.
+    :param day: The start of the day.
+    :type day: arrow.Arrow
+    :return: day (arrow.Arrow), totals (dict)
+    """
+    return day, {"ticks": clock.sleeps, "db_calls": counters["db_calls"], "wakeups": counters["wakeups"]}
+
+
+def finish():
+    """
+    Ends the simulation.
+    :return: None
+    """
+    raise SimulationFinished()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+File: startup.py
+
+This program measures how long the client takes to start in each of its modes.
+It runs a fresh interpreter with -X importtime for every run, and reports the import cost per mode, the most expensive
+top level imports, and the wall time of the start.
+
+Management mode is measured through its real entry path: client/client.py is started without arguments, in a temporary
+directory with an empty challenge pool, against a stand-in server on this host which answers that the alarm is off.
+The wall time is how long until the menu asks for input, and the imports include those of the background thread which
+refills the challenge pool, which is waited for before the client is stopped.
+The awake test is measured by importing what it needs, since it opens a window.
+
+Run it from the repository root: python benchmarks/startup.py [runs]
+"""
+
+import os
+import shutil
+import socket
+import subprocess
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+CLIENT_PATH = "client"
+DEFAULT_RUNS = 5
+TOP_IMPORTS = 5
+MODES = {
+    "awake test": "import client, gui",
+}
+BIND_ADDRESS = "127.0.0.1"
+MENU_PROMPT = b"Input the number of the setting"
+POLL_SECONDS = 0.005
+TIMEOUT_SECONDS = 30
+# What the stand-in server answers, like a server whose alarm is off
+USER_PREFERENCES = {"wakeup_time_hour": 16, "wakeup_time_minute": 0, "utc_offset": 2, "wakeup_window": 2,
+                    "active_state": 0, "time_zone": None, "recurrence": "once", "skip_dates": None, "song": "lostwoods"}
+REPLIES = {"get_alarm_state": b"0",
+           "get_user_preferences_if_changed": bytes(str((1, USER_PREFERENCES)), "utf-8")}
+SETTINGS = """[SERVER]
+Address = {address}
+Port = {port}
+
+[CLIENT]
+Window height = 800
+Window width = 600
+"""
+
+
+def main():
+    """
+    Benchmarks every mode and prints a report.
+    :return: None
+    """
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RUNS
+
+    print("Mode: management (client/client.py)")
+    try:
+        import_times, wall_times, refill_times, imports = benchmark_management(runs)
+    except RuntimeError as error:
+        print(f"\tFailed: {error}\n")
+    else:
+        print(f"\tRefill done:\tmedian {statistics.median(refill_times) * 1000:.1f} ms, "
+              f"min {min(refill_times) * 1000:.1f} ms")
+        print_report(import_times, wall_times, imports)
+
+    for mode, statement in MODES.items():
+        print(f"Mode: {mode} ({statement})")
+
+        try:
+            import_times, wall_times, imports = benchmark_mode(statement, runs)
+        except RuntimeError as error:
+            print(f"\tFailed: {error}\n")
+            continue
+
+        print_report(import_times, wall_times, imports)
+
+
+def print_report(import_times, wall_times, imports):
+    """
+    Prints the import cost, the wall time and the most expensive top level imports of a mode.
+    :param import_times: The import cost of every run, in microseconds.
+    :type import_times: list of int
+    :param wall_times: The wall time of every run, in seconds.
+    :type wall_times: list of float
+    :param imports: The fastest cumulative time of every top level import, in microseconds.
+    :type imports: dict
+    :return: None
+    """
+    print(f"\tImport time:\tmedian {statistics.median(import_times) / 1000:.1f} ms, "
+          f"min {min(import_times) / 1000:.1f} ms")
+    print(f"\tWall time:\tmedian {statistics.median(wall_times) * 1000:.1f} ms, "
+          f"min {min(wall_times) * 1000:.1f} ms")
+    print("\tMost expensive imports:")
+    for package, cumulative in sorted(imports.items(), key=lambda item: item[1], reverse=True)[:TOP_IMPORTS]:
+        print(f"\t\t{cumulative / 1000:8.1f} ms\t{package}")
+    print()
+
+
+def benchmark_mode(statement, runs):
+    """
+    Runs the given statement in a fresh interpreter the given amount of times.
+    :param statement: The python statement that imports what the mode needs.
+    :type statement: str
+    :param runs: How many times to start the interpreter.
+    :type runs: int
+    :return: import_times (list of int), wall_times (list of float), imports (dict)
+    """
+    import_times = []
+    wall_times = []
+    imports = {}
+
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c",
+                                  f"import sys; sys.path.insert(0, '{CLIENT_PATH}'); {statement}"],
+                                 capture_output=True, text=True)
+        wall_times.append(time.perf_counter() - start)
+
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().split("\n")[-1])
+
+        add_imports(imports, import_times, process.stderr)
+
+    return import_times, wall_times, imports
+
+
+def benchmark_management(runs):
+    """
+    Starts client/client.py in management mode the given amount of times, and measures how long until the menu asks
+    for input, and until the challenge pool is refilled.
+    :param runs: How many times to start the client.
+    :type runs: int
+    :return: import_times (list of int), wall_times (list of float), refill_times (list of float), imports (dict)
+    """
+    import_times = []
+    wall_times = []
+    refill_times = []
+    imports = {}
+
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind((BIND_ADDRESS, 0))
+    server_socket.listen()
+    threading.Thread(target=serve, args=(server_socket,), daemon=True).start()
+
+    client_path = os.path.abspath(os.path.join(CLIENT_PATH, "client.py"))
+    for _ in range(runs):
+        # Work in a temporary directory with an empty challenge pool, and settings naming the stand-in server
+        directory = tempfile.mkdtemp()
+        os.mkdir(os.path.join(directory, CLIENT_PATH))
+        with open(os.path.join(directory, CLIENT_PATH, "settings.ini"), "w") as settings_file:
+            settings_file.write(SETTINGS.format(address=BIND_ADDRESS, port=server_socket.getsockname()[1]))
+        pool_directory = os.path.join(directory, CLIENT_PATH, "challenge_pool")
+
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable, "-u", "-X", "importtime", client_path], cwd=directory,
+                                   stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # Read stderr meanwhile, so that the client never blocks on a full pipe
+        stderr = []
+        stderr_reader = threading.Thread(target=lambda: stderr.append(process.stderr.read()), daemon=True)
+        stderr_reader.start()
+
+        try:
+            # Wait until the menu asks for input
+            output = b""
+            while MENU_PROMPT not in output:
+                chunk = os.read(process.stdout.fileno(), 4096)
+                if not chunk:
+                    raise RuntimeError("The client stopped before it showed the menu.")
+                output += chunk
+            wall_times.append(time.perf_counter() - start)
+
+            # Wait until the background thread has refilled the challenge pool
+            while not (os.path.isdir(pool_directory) and any(name.endswith(".bin")
+                                                             for name in os.listdir(pool_directory))):
+                if time.perf_counter() - start > TIMEOUT_SECONDS:
+                    raise RuntimeError("The client did not refill the challenge pool.")
+                time.sleep(POLL_SECONDS)
+            refill_times.append(time.perf_counter() - start)
+        finally:
+            # Closing stdin ends the menu
+            process.stdin.close()
+            process.wait()
+            stderr_reader.join()
+            shutil.rmtree(directory)
+
+        add_imports(imports, import_times, stderr[0].decode("utf-8"))
+
+    server_socket.close()
+
+    return import_times, wall_times, refill_times, imports
+
+
+def serve(server_socket):
+    """
+    Answers the requests of the client like a server whose alarm is off, until the socket is closed.
+    :param server_socket: The listening socket.
+    :type server_socket: socket.socket
+    :return: None
+    """
+    while True:
+        try:
+            connection, address = server_socket.accept()
+        except OSError:
+            return
+
+        with connection:
+            command = connection.recv(4096).decode("utf-8").split(" ")[0]
+            connection.sendall(REPLIES.get(command, b""))
+
+
+def add_imports(imports, import_times, output):
+    """
+    Adds the import cost of one run, and keeps the fastest cumulative time seen for each top level import.
+    :param imports: The fastest cumulative time of every top level import so far.
+    :type imports: dict
+    :param import_times: The import cost of every run so far.
+    :type import_times: list of int
+    :param output: What the interpreter wrote to stderr with -X importtime.
+    :type output: str
+    :return: None
+    """
+    top_level_imports = parse_importtime(output)
+    import_times.append(sum(top_level_imports.values()))
+
+    for package, cumulative in top_level_imports.items():
+        imports[package] = min(imports.get(package, cumulative), cumulative)
+
+
+def parse_importtime(output):
+    """
+    Parses the output of -X importtime and returns the cumulative time of every top level import.
+    Nested imports are indented in the output, and are already counted by the import that caused them.
+    :param output: What the interpreter wrote to stderr.
+    :type output: str
+    :return: top_level_imports (dict)
+    """
+    top_level_imports = {}
+
+    for line in output.split("\n"):
+        if not line.startswith("import time:"):
+            continue
+
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+
+        package = fields[2].rstrip()
+        if package.startswith("  "):
+            continue
+
+        top_level_imports[package.strip()] = int(fields[1])
+
+    return top_level_imports
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""
+File: time_zones.py
+
+This program checks the cached transition tables of the server's time_zones module against zoneinfo, and compares
+how fast they are.
+For every zone, it checks the UTC offset every few hours over several years, and the next alarm time for wakeup times
+from every hour of the day on every day of those years, which includes the wakeup times skipped or repeated by
+daylight saving time changes. Then it times offset lookups and next alarm times done both ways.
+
+It needs zoneinfo, which comes with Python 3.9 and newer.
+
+Run it from the repository root, for example: python benchmarks/time_zones.py --years 5
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import time_zones  # noqa: E402
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    sys.exit("This check needs zoneinfo, which comes with Python 3.9 and newer.")
+
+DEFAULT_ZONES = ["Europe/Oslo", "America/New_York", "America/St_Johns", "Australia/Lord_Howe", "Asia/Kolkata",
+                 "Pacific/Chatham", "UTC"]
+OFFSET_CHECK_INTERVAL_SECONDS = 3 * 3600
+WAKEUP_MINUTES = [0, 30, 59]
+TIMED_LOOKUPS = 100000
+
+
+def main():
+    """
+    Parses the arguments, checks every zone and prints a report. Exits with 1 if anything differs from zoneinfo.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Checks the time zone transition tables against zoneinfo.")
+    parser.add_argument("--zones", nargs="+", default=DEFAULT_ZONES, help="IANA time zone names to check")
+    parser.add_argument("--first-year", type=int, default=datetime.date.today().year, help="first year to check")
+    parser.add_argument("--years", type=int, default=5, help="how many years to check")
+    arguments = parser.parse_args()
+
+    start = datetime.datetime(arguments.first_year, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    end = datetime.datetime(arguments.first_year + arguments.years, 1, 1, tzinfo=datetime.timezone.utc).timestamp()
+    rng = random.Random(0)
+
+    print(f"{'Zone':<22}{'Build':>10}{'Changes':>9}{'Offsets':>9}{'Alarms':>9}{'Wrong':>7}"
+          f"{'Table lookup':>14}{'zoneinfo':>11}{'Table alarm':>13}{'zoneinfo':>11}")
+    failures = 0
+    for zone in arguments.zones:
+        tzinfo = ZoneInfo(zone)
+
+        # Build the table, which is what the server does once
+        time_zones.transition_tables.pop(zone, None)
+        build_start = time.perf_counter()
+        time_zones.utc_offset_at(zone, start)
+        build_seconds = time.perf_counter() - build_start
+        changes = len(time_zones.transition_tables[zone][2]) - 1
+
+        # Check the offsets
+        offsets_checked = 0
+        wrong = 0
+        for timestamp in range(int(start), int(end), OFFSET_CHECK_INTERVAL_SECONDS):
+            offsets_checked += 1
+            if time_zones.utc_offset_at(zone, timestamp) != reference_utc_offset(tzinfo, timestamp):
+                wrong += 1
+
+        # Check the next alarm times, from the start of every local day
+        alarms_checked = 0
+        for day_start in range(int(start), int(end), time_zones.SECONDS_IN_A_DAY):
+            now = day_start + rng.randrange(time_zones.SECONDS_IN_A_DAY)
+            for hour in range(24):
+                for minute in WAKEUP_MINUTES:
+                    alarms_checked += 1
+                    if time_zones.next_fire_time(zone, hour, minute, now) != \
+                            reference_next_fire_time(tzinfo, hour, minute, now):
+                        wrong += 1
+                        if wrong <= 3:
+                            print(f"{zone}: {hour:02}:{minute:02} from {now} is "
+                                  f"{time_zones.next_fire_time(zone, hour, minute, now)}, zoneinfo says "
+                                  f"{reference_next_fire_time(tzinfo, hour, minute, now)}")
+        failures += wrong
+
+        # Time both ways
+        timestamps = [rng.uniform(start, end) for _ in range(TIMED_LOOKUPS)]
+        table_lookup = time_per_call(lambda timestamp: time_zones.utc_offset_at(zone, timestamp), timestamps)
+        zoneinfo_lookup = time_per_call(lambda timestamp: reference_utc_offset(tzinfo, timestamp), timestamps)
+        table_alarm = time_per_call(lambda timestamp: time_zones.next_fire_time(zone, 6, 30, timestamp), timestamps)
+        zoneinfo_alarm = time_per_call(lambda timestamp: reference_next_fire_time(tzinfo, 6, 30, timestamp),
+                                       timestamps)
+
+        print(f"{zone:<22}{build_seconds * 1000:>8.1f}ms{changes:>9}{offsets_checked:>9}{alarms_checked:>9}"
+              f"{wrong:>7}{table_lookup:>12.0f}ns{zoneinfo_lookup:>9.0f}ns{table_alarm:>11.0f}ns"
+              f"{zoneinfo_alarm:>9.0f}ns")
+
+    if failures > 0:
+        print(f"FAILED: {failures} results differ from zoneinfo.")
+        sys.exit(1)
+
+    print(f"OK: Every result matches zoneinfo from {arguments.first_year} through "
+          f"{arguments.first_year + arguments.years - 1}.")
+
+
+def reference_utc_offset(tzinfo, timestamp):
+    """
+    Returns the UTC offset at the given moment according to zoneinfo.
+    :param tzinfo: The time zone.
+    :type tzinfo: zoneinfo.ZoneInfo
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: float
+    :return: offset (int) in seconds
+    """
+    return int(datetime.datetime.fromtimestamp(timestamp, tzinfo).utcoffset().total_seconds())
+
+
+def reference_next_fire_time(tzinfo, hour, minute, now):
+    """
+    Returns the next time the local wall clock shows hour:minute according to zoneinfo, which resolves repeated and
+    skipped wall clock times with fold=0.
+    :param tzinfo: The time zone.
+    :type tzinfo: zoneinfo.ZoneInfo
+    :param hour: The local hour.
+    :type hour: int
+    :param minute: The local minute.
+    :type minute: int
+    :param now: The current time, in seconds since the epoch.
+    :type now: float
+    :return: timestamp (int)
+    """
+    today = datetime.datetime.fromtimestamp(now, tzinfo).date()
+    fire_time = datetime.datetime.combine(today, datetime.time(hour, minute), tzinfo).timestamp()
+    if fire_time < int(now):
+        tomorrow = today + datetime.timedelta(days=1)
+        fire_time = datetime.datetime.combine(tomorrow, datetime.time(hour, minute), tzinfo).timestamp()
+
+    return int(fire_time)
+
+
+def time_per_call(function, arguments):
+    """
+    Calls the function once for every argument, and returns the average time per call.
+    :param function: What to time.
+    :type function: callable
+    :param arguments: The argument of every call.
+    :type arguments: list
+    :return: nanoseconds (float)
+    """
+    start = time.perf_counter_ns()
+    for argument in arguments:
+        function(argument)
+
+    return (time.perf_counter_ns() - start) / len(arguments)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+File: transports.py
+
+This program compares the TCP and the Unix domain socket transports between a client and a server on the same host.
+It runs the communication process of the server like the server does, listening on both, and sends requests to it
+through the client's transport, first one at a time to measure the round trip latency, then from several processes
+at once to measure the throughput.
+
+It runs against a fresh database in a temporary directory, so the real database is never touched.
+
+Run it from the repository root, for example: python benchmarks/transports.py --requests 2000 --clients 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+sys.path.insert(0, os.path.abspath("client"))
+
+import server  # noqa: E402
+import transport  # noqa: E402
+from common import BIND_ADDRESS, percentile, quiet, use_temporary_database  # noqa: E402
+
+UNIX_SOCKET_PATH = "server/wakeywakey.sock"
+COMMAND = "get_alarm_state"
+
+
+def main():
+    """
+    Parses the arguments, measures both transports and prints a report.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Compares the TCP and Unix domain socket transports.")
+    parser.add_argument("--requests", type=int, default=2000, help="requests sent one at a time per transport")
+    parser.add_argument("--clients", type=int, default=4, help="processes sending requests for the throughput")
+    parser.add_argument("--seconds", type=float, default=3, help="how long to measure the throughput")
+    arguments = parser.parse_args()
+
+    if not hasattr(socket, "AF_UNIX"):
+        sys.exit("This platform has no Unix domain sockets.")
+
+    # Work in a temporary directory with a fresh database
+    use_temporary_database()
+
+    # Start the communication process like the server does, on both sockets
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind((BIND_ADDRESS, 0))
+    port = s.getsockname()[1]
+    unix_socket = server.unix_server_socket(UNIX_SOCKET_PATH)
+    communication_process = multiprocessing.Process(target=quiet, args=(server.communication, s, unix_socket),
+                                                    daemon=True)
+    communication_process.start()
+    time.sleep(0.5)
+
+    print(f"{'Transport':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'Requests/s':>12}")
+    for transport_name, unix_socket_path in [("tcp", None), ("unix", UNIX_SOCKET_PATH)]:
+        # Round trip latency, one request at a time
+        transport.configure(transport.CONNECT_TIMEOUT_SECONDS, transport.READ_TIMEOUT_SECONDS, transport.RETRIES,
+                            unix_socket_path)
+        latencies = []
+        for _ in range(arguments.requests):
+            start = time.perf_counter()
+            transport.request(BIND_ADDRESS, port, COMMAND)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+
+        # Throughput, from several processes at once
+        served = multiprocessing.Value("i", 0)
+        clients = [multiprocessing.Process(target=send_requests,
+                                           args=(port, unix_socket_path, arguments.seconds, served))
+                   for _ in range(arguments.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        print(f"{transport_name:<12}{percentile(latencies, 50) * 1000:>8.3f}ms"
+              f"{percentile(latencies, 95) * 1000:>8.3f}ms{percentile(latencies, 99) * 1000:>8.3f}ms"
+              f"{served.value / arguments.seconds:>12.0f}")
+
+
+
+def send_requests(port, unix_socket_path, seconds, served):
+    """
+    Sends requests through the client's transport as fast as they are answered, for the given amount of seconds.
+    :param port: The TCP port of the server.
+    :type port: int
+    :param unix_socket_path: The Unix domain socket of the server, or None to use TCP.
+    :type unix_socket_path: str
+    :param seconds: How long to send requests.
+    :type seconds: float
+    :param served: Shared counter of answered requests.
+    :type served: multiprocessing.Value
+    :return: None
+    """
+    transport.configure(transport.CONNECT_TIMEOUT_SECONDS, transport.READ_TIMEOUT_SECONDS, transport.RETRIES,
+                        unix_socket_path)
+
+    count = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        transport.request(BIND_ADDRESS, port, COMMAND)
+        count += 1
+
+    with served.get_lock():
+        served.value += count
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+File: workers.py
+
+This program measures how the throughput of the command port scales with the amount of communication workers.
+For every worker count, it starts that many communication processes like the server does, each with its own socket on
+the same port through SO_REUSEPORT, and floods them from several client processes with a mix of reading and writing
+commands.
+
+The workers can only run side by side on as many CPU cores as the machine has, and the client processes compete with
+them for the same cores, so the scaling levels off well before the worker count does.
+
+It runs against a fresh database in a temporary directory for every worker count, so the real database is never
+touched.
+
+Run it from the repository root, for example: python benchmarks/workers.py --workers 1 2 4 --clients 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath("server"))
+
+import server  # noqa: E402
+from common import BIND_ADDRESS, flood, quiet, use_temporary_database  # noqa: E402
+
+COMMANDS = ["get_alarm_state", "get_status", "get_user_preferences", "get_user_preferences_if_changed 0",
+            "set_wakeup_window 2"]
+
+
+def main():
+    """
+    Parses the arguments, floods the command port for every worker count and prints the throughput.
+    :return: None
+    """
+    parser = argparse.ArgumentParser(description="Measures command port throughput for several worker counts.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="worker counts to measure")
+    parser.add_argument("--clients", type=int, default=8, help="processes flooding the command port")
+    parser.add_argument("--seconds", type=float, default=5, help="how long to flood each worker count")
+    arguments = parser.parse_args()
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("This platform has no SO_REUSEPORT.")
+
+    print(f"{os.cpu_count()} CPU cores, {arguments.clients} flooding clients")
+    print(f"{'Workers':>8}{'Requests/s':>12}{'Speedup':>9}{'Errors':>8}")
+    baseline = None
+    for communication_workers in arguments.workers:
+        # Work in a temporary directory with a fresh database
+        use_temporary_database()
+
+        # Start the workers like the server does, all on the same port
+        first_socket = server.reuse_port_socket(BIND_ADDRESS, 0)
+        port = first_socket.getsockname()[1]
+        worker_sockets = [first_socket] + [server.reuse_port_socket(BIND_ADDRESS, port)
+                                           for _ in range(communication_workers - 1)]
+        workers = [multiprocessing.Process(target=quiet, args=(server.communication, worker_socket), daemon=True)
+                   for worker_socket in worker_sockets]
+        for worker in workers:
+            worker.start()
+        for worker_socket in worker_sockets:
+            worker_socket.close()
+        time.sleep(0.5)
+
+        # Flood them
+        served = multiprocessing.Value("i", 0)
+        errors = multiprocessing.Value("i", 0)
+        clients = [multiprocessing.Process(target=flood, args=(port, COMMANDS, served, arguments.seconds, errors))
+                   for _ in range(arguments.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+
+        requests_per_second = served.value / arguments.seconds
+        if baseline is None:
+            baseline = requests_per_second
+        print(f"{communication_workers:>8}{requests_per_second:>12.0f}{requests_per_second / baseline:>8.2f}x"
+              f"{errors.value:>8}")
+
+
+
+
+if __name__ == '__main__':
+    main()
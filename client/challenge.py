@@ -0,0 +1,512 @@
+"""
+File: challenge.py
+
+This module generates the awake test challenges without needing a GUI, so that they can be reproduced from a seed
+and stored in a pool on disk ahead of time. It also decides what a mouse pointer position means for the test, so that
+the GUI and the replay harness share the same logic.
+"""
+
+import contextlib
+import glob
+import os
+import random
+import struct
+import threading
+import numpy as np
+from trajectory import EVENT_MOVE, EVENT_WALL, EVENT_GOAL
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no fcntl, so there the pool is only locked against the other threads of this process
+    fcntl = None
+
+MIN_LINE_LENGTH = 5
+LINE_THICKNESS = 8
+BORDER_MARGIN = 10
+MIN_WINDOW_SIZE = 36
+MAX_LINES = 1000
+CHALLENGE_POOL_PATH = "client/challenge_pool"
+CHALLENGE_POOL_SIZE = 5
+POOL_MAGIC = b"WWCP"
+POOL_VERSION = 1
+POOL_HEADER_FORMAT = "<4sBHH"
+RECORD_HEADER_FORMAT = "<IhhhhhhH"
+LINE_FORMAT = "<Bhhhh"
+DIRECTION_EAST = 0
+DIRECTION_WEST = 1
+DIRECTION_SOUTH = 2
+DIRECTION_NORTH = 3
+
+# Held while a thread of this process reads, changes and writes a pool
+pool_lock = threading.Lock()
+
+
+"""
+########################################################################################################################
+                                                        GENERATION
+########################################################################################################################
+"""
+
+
+def generate_challenge(seed, window_height, window_width):
+    """
+    Generates a challenge from the given seed. The same seed and window size always gives the same challenge.
+    A challenge is a tuple of the seed, the start block, the end block and the lines of the path between them.
+    All the blocks and lines are rectangles in the format (x0, y0, x1, y1), where x0 <= x1 and y0 <= y1.
+    :param seed: The seed for the random number generator.
+    :type seed: int
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: seed (int), start_block (tuple), end_block (tuple), lines (list of tuple)
+    """
+    rng = random.Random(seed)
+
+    # Same minimum window size as the GUI
+    window_height = max(window_height, MIN_WINDOW_SIZE)
+    window_width = max(window_width, MIN_WINDOW_SIZE)
+
+    size = np.array([window_width - 3 - BORDER_MARGIN, window_height - 3 - BORDER_MARGIN])
+
+    # Choose which side the mouse pointer shall start on (Left: 1, Top: 2)
+    start_side = rng.randint(1, 2)
+
+    # Create start and end
+    if start_side == 1:
+        # If starting side is left
+        start = np.array([BORDER_MARGIN, rng.randint(BORDER_MARGIN, size[1])])
+        end = np.array([size[0], rng.randint(BORDER_MARGIN, size[1])])
+        end_block = normalize_rectangle(end[0], end[1], end[0] - LINE_THICKNESS * 2, end[1] + LINE_THICKNESS * 2)
+    else:
+        # If starting side is top
+        start = np.array([rng.randint(BORDER_MARGIN, size[0]), BORDER_MARGIN])
+        end = np.array([rng.randint(BORDER_MARGIN, size[0]), size[1]])
+        end_block = normalize_rectangle(end[0], end[1], end[0] + LINE_THICKNESS * 2, end[1] - LINE_THICKNESS * 2)
+    start_block = normalize_rectangle(start[0], start[1], start[0] + LINE_THICKNESS * 2,
+                                      start[1] + LINE_THICKNESS * 2)
+
+    # Draw lines until one of them touches the goal
+    lines = []
+    line_end = start
+    previous_direction = np.array([0, 0])
+    path_complete = False
+    while not path_complete:
+        # Some seeds never find the goal, in which case the next seed is tried instead
+        if len(lines) >= MAX_LINES:
+            return generate_challenge(seed + 1, window_height, window_width)
+
+        line_start = line_end
+        line_end, previous_direction, path_complete = next_line(rng, line_start, end, size, end_block,
+                                                                previous_direction)
+        line = normalize_rectangle(line_start[0], line_start[1], line_end[0], line_end[1])
+
+        # Increase the thickness of the line
+        line = (line[0], line[1], line[2] + LINE_THICKNESS, line[3] + LINE_THICKNESS)
+        lines.append((direction_code(previous_direction),) + line)
+
+    return seed, start_block, end_block, lines
+
+
+def next_line(rng, start, end, size, end_block, previous_direction):
+    """
+    Finds the next line in such a way as to make a connection between start and end.
+    :param rng: The random number generator of the challenge.
+    :type rng: random.Random
+    :param start: Where the line will have to start.
+    :type start: np.array
+    :param end: Where the new line will try to get closer to.
+    :type end: np.array
+    :param size: The width and height of the game area.
+    :type size: np.array
+    :param end_block: The area in which any pixel marks the goal.
+    :type end_block: tuple
+    :param previous_direction: The direction in which the previous line was headed.
+    :type previous_direction: np.array
+    :return: line_end (np.array), direction (np.array), covers_goal (boolean)
+    """
+    # Get direction
+    direction = determine_direction(start, end, previous_direction)
+
+    # Get line length
+    max_direction_length = np.multiply(size, direction)
+    max_direction_length = max_direction_length[max_direction_length != 0]
+    max_direction_length = abs(int(max_direction_length[0]))
+    random_line_length = rng.randint(MIN_LINE_LENGTH, max_direction_length)
+
+    # Calculate line end
+    line_end = np.add(start, np.multiply(direction, random_line_length))
+    if line_end[0] > size[0] or line_end[0] < BORDER_MARGIN:
+        line_end[0] = size[0]
+    if line_end[1] > size[1] or line_end[1] < BORDER_MARGIN:
+        line_end[1] = size[1]
+
+    # Check if the new line overlaps the goal
+    covers_goal = rectangles_overlap(normalize_rectangle(start[0], start[1], line_end[0], line_end[1]), end_block)
+
+    return line_end, direction, covers_goal
+
+
+def determine_direction(source, destination, previous_direction):
+    """
+    Determines the cardinal direction that gives the shortest path between point a (source) and b (destination)
+    :param source: Point A
+    :type source: np.array
+    :param destination: Point B
+    :type destination: np.array
+    :param previous_direction: The direction which was last used.
+    :type previous_direction: np.array
+    :return: np.array
+    """
+    # Find vector from source to destination
+    direct_path = np.subtract(destination, source)
+
+    # Return most impacting direction as a scalar vector
+    if abs(direct_path[0]) >= abs(direct_path[1]):
+        if direct_path[0] >= 0:
+            direction = np.array([1, 0])
+        else:
+            direction = np.array([-1, 0])
+    else:
+        if direct_path[1] >= 0:
+            direction = np.array([0, 1])
+        else:
+            direction = np.array([0, -1])
+
+    # Get the opposite direction of the previous one
+    opposite_of_previous_direction = previous_direction
+    opposite_of_previous_direction = opposite_of_previous_direction[opposite_of_previous_direction != 0] * -1
+
+    # If the proposed new direction is perpendicular to the previous one, go south
+    if np.array_equal(direction, previous_direction) or np.array_equal(direction, opposite_of_previous_direction):
+        x = direction[0]
+        y = direction[1]
+        direction = np.array([y, x])
+
+    return direction
+
+
+def direction_code(direction):
+    """
+    Turns a direction vector into one of the DIRECTION constants.
+    :param direction: A scalar vector pointing in one of the cardinal directions.
+    :type direction: np.array
+    :return: code (int)
+    """
+    if direction[0] == 1:
+        return DIRECTION_EAST
+    elif direction[0] == -1:
+        return DIRECTION_WEST
+    elif direction[1] == 1:
+        return DIRECTION_SOUTH
+    else:
+        return DIRECTION_NORTH
+
+
+def normalize_rectangle(x0, y0, x1, y1):
+    """
+    Orders the corners of a rectangle the same way tkinter does, so that x0 <= x1 and y0 <= y1.
+    :return: rectangle (tuple of int)
+    """
+    return int(min(x0, x1)), int(min(y0, y1)), int(max(x0, x1)), int(max(y0, y1))
+
+
+def rectangles_overlap(a, b):
+    """
+    Tests if two normalized rectangles overlap, edges included, like tkinter.Canvas.find_overlapping.
+    :param a: The first rectangle.
+    :type a: tuple
+    :param b: The second rectangle.
+    :type b: tuple
+    :return: overlaps (bool)
+    """
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+"""
+########################################################################################################################
+                                                        HIT TESTING
+########################################################################################################################
+"""
+
+
+def test_step(challenge, x, y):
+    """
+    Decides what the mouse pointer at the given coordinates means for the awake test. This is the logic of the test
+    itself, shared by the GUI and the replay harness.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :param x: The x coordinate of the mouse pointer within the canvas.
+    :type x: int
+    :param y: The y coordinate of the mouse pointer within the canvas.
+    :type y: int
+    :return: event (int), one of EVENT_MOVE, EVENT_WALL and EVENT_GOAL
+    """
+    current_pixel_color = get_pixel_color(challenge, x, y)
+
+    if current_pixel_color == "WHITE":
+        # Touching wall
+        return EVENT_WALL
+    elif current_pixel_color == "RED":
+        # Reached goal
+        return EVENT_GOAL
+    else:
+        return EVENT_MOVE
+
+
+def get_pixel_color(challenge, x, y):
+    """
+    Gets the color the given pixel has when the challenge is drawn, without needing the canvas.
+    :param challenge: The challenge, as made by generate_challenge.
+    :type challenge: tuple
+    :param x: The x coordinate of the pixel to check.
+    :type x: int
+    :param y: The y coordinate of the pixel to check.
+    :type y: int
+    :return: string
+    """
+    seed, start_block, end_block, lines = challenge
+    point = (x, y, x, y)
+
+    # Returns a color in the following priority: Red, Green, Black, White
+    if rectangles_overlap(point, end_block):
+        return "RED"
+    elif rectangles_overlap(point, start_block):
+        return "GREEN"
+    for line in lines:
+        if rectangles_overlap(point, line[1:]):
+            return "BLACK"
+
+    return "WHITE"
+
+
+"""
+########################################################################################################################
+                                                        POOL
+########################################################################################################################
+"""
+
+
+def pool_file_path(window_height, window_width):
+    """
+    Returns the path of the pool file for the given window size.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: path (str)
+    """
+    return os.path.join(CHALLENGE_POOL_PATH, f"{window_width}x{window_height}.bin")
+
+
+def encode_challenges(challenges, window_height, window_width):
+    """
+    Packs challenges into the binary pool format. The file starts with a header holding the window size, followed by
+    one record per challenge. Each record holds the seed, the start and end blocks, and its lines.
+    :param challenges: The challenges to pack.
+    :type challenges: list of tuple
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: data (bytes)
+    """
+    data = bytearray(struct.pack(POOL_HEADER_FORMAT, POOL_MAGIC, POOL_VERSION, window_width, window_height))
+    for seed, start_block, end_block, lines in challenges:
+        data += struct.pack(RECORD_HEADER_FORMAT, seed & 0xFFFFFFFF, *start_block[:2], *end_block, len(lines))
+        for line in lines:
+            data += struct.pack(LINE_FORMAT, *line)
+
+    return bytes(data)
+
+
+def decode_challenges(data, window_height, window_width):
+    """
+    Unpacks challenges from the binary pool format. Data of the wrong version or window size gives no challenges.
+    :param data: The packed challenges.
+    :type data: bytes
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: challenges (list of tuple)
+    """
+    challenges = []
+    header_size = struct.calcsize(POOL_HEADER_FORMAT)
+    record_header_size = struct.calcsize(RECORD_HEADER_FORMAT)
+    line_size = struct.calcsize(LINE_FORMAT)
+
+    # Check that the data belongs to this pool
+    if len(data) < header_size:
+        return challenges
+    if struct.unpack_from(POOL_HEADER_FORMAT, data) != (POOL_MAGIC, POOL_VERSION, window_width, window_height):
+        return challenges
+
+    offset = header_size
+    while offset + record_header_size <= len(data):
+        seed, start_x, start_y, end_x0, end_y0, end_x1, end_y1, line_count = struct.unpack_from(RECORD_HEADER_FORMAT,
+                                                                                                data, offset)
+        offset += record_header_size
+
+        # A truncated record means the file was cut off while being written
+        if offset + line_count * line_size > len(data):
+            break
+        lines = [line for line in struct.iter_unpack(LINE_FORMAT, data[offset:offset + line_count * line_size])]
+        offset += line_count * line_size
+
+        start_block = (start_x, start_y, start_x + LINE_THICKNESS * 2, start_y + LINE_THICKNESS * 2)
+        challenges.append((seed, start_block, (end_x0, end_y0, end_x1, end_y1), lines))
+
+    return challenges
+
+
+def load_pool(window_height, window_width):
+    """
+    Loads every challenge stored in the pool for the given window size.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: challenges (list of tuple)
+    """
+    try:
+        with open(pool_file_path(window_height, window_width), "rb") as pool_file:
+            data = pool_file.read()
+    except FileNotFoundError:
+        return []
+
+    return decode_challenges(data, window_height, window_width)
+
+
+@contextlib.contextmanager
+def lock_pool(window_height, window_width):
+    """
+    Locks the pool for the given window size, so that only one thread or process at a time reads, changes and writes
+    it. Without the lock, a refill could write back a challenge that was taken since it loaded the pool.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: None
+    """
+    os.makedirs(CHALLENGE_POOL_PATH, exist_ok=True)
+    with pool_lock, open(pool_file_path(window_height, window_width) + ".lock", "a") as lock_file:
+        # The lock is released when the file is closed
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def save_pool(challenges, window_height, window_width):
+    """
+    Replaces the pool for the given window size with the given challenges. The pool has to be locked.
+    The file is written next to the old one and then renamed, so that a reader never sees half a pool. Since only the
+    holder of the lock writes it, the temporary file is the same every time, and one left behind by a crash is
+    overwritten by the next save.
+    :param challenges: The challenges to store.
+    :type challenges: list of tuple
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: None
+    """
+    path = pool_file_path(window_height, window_width)
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as pool_file:
+        pool_file.write(encode_challenges(challenges, window_height, window_width))
+    os.replace(temporary_path, path)
+
+
+def remove_stale_temporary_files(window_height, window_width):
+    """
+    Removes the temporary files which older versions named after the process and thread writing the pool, and which
+    were left behind when the client was stopped while writing. The pool has to be locked.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: None
+    """
+    for stale_path in glob.glob(glob.escape(pool_file_path(window_height, window_width)) + ".*.*"):
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+def take_challenge(window_height, window_width):
+    """
+    Takes the first challenge out of the pool, then refills the pool in the background.
+    If the pool is empty, a challenge is generated on the spot from a random seed.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: challenge (tuple)
+    """
+    with lock_pool(window_height, window_width):
+        challenges = load_pool(window_height, window_width)
+        challenge = None
+        if len(challenges) > 0:
+            challenge = challenges.pop(0)
+            save_pool(challenges, window_height, window_width)
+
+    if challenge is None:
+        challenge = generate_challenge(new_seed(), window_height, window_width)
+
+    # Refill the pool while the user solves this challenge
+    refill_pool_in_background(window_height, window_width)
+
+    return challenge
+
+
+def refill_pool(window_height, window_width, pool_size=CHALLENGE_POOL_SIZE):
+    """
+    Generates new challenges until the pool for the given window size holds pool_size challenges.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :param pool_size: How many challenges the pool should hold.
+    :type pool_size: int
+    :return: None
+    """
+    challenges = load_pool(window_height, window_width)
+    if len(challenges) >= pool_size:
+        return
+
+    # Generate without holding the lock, so that taking a challenge meanwhile does not wait for it
+    new_challenges = [generate_challenge(new_seed(), window_height, window_width)
+                      for _ in range(pool_size - len(challenges))]
+
+    # Top up the pool as it is now, since challenges may have been taken or added while generating
+    with lock_pool(window_height, window_width):
+        remove_stale_temporary_files(window_height, window_width)
+        challenges = load_pool(window_height, window_width)
+        if len(challenges) < pool_size:
+            save_pool(challenges + new_challenges[:pool_size - len(challenges)], window_height, window_width)
+
+
+def refill_pool_in_background(window_height, window_width):
+    """
+    Refills the pool for the given window size in a daemon thread.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: thread (threading.Thread)
+    """
+    thread = threading.Thread(target=refill_pool, args=(window_height, window_width), daemon=True)
+    thread.start()
+
+    return thread
+
+
+def new_seed():
+    """
+    Returns a new random seed which fits in the pool format.
+    :return: seed (int)
+    """
+    return random.SystemRandom().randint(0, 0xFFFFFFFF - MAX_LINES)
@@ -2,51 +2,116 @@
 File: client.py
 
 This program lets you change settings as well as shut the alarm off once it's started.
+The awake test lives in gui.py, which is only imported when it is needed, so that management mode starts quickly.
+
+Settings can also be changed from scripts, without any prompts, for example:
+python client/client.py set --hour 6 --minute 45 --window 10
+python client/client.py status --json
+The same can be done on many servers at once, listed under [FLEET] in settings.ini, for example:
+python client/client.py fleet set --active 1
+python client/client.py fleet status --timeout 2
+
+Every request has connect and read timeouts and a few retries, set under [CLIENT] in settings.ini. With --timings, the
+connect time and round trip time of every request are printed to stderr.
+
+With --profile, or WAKEYWAKEY_PROFILE set to a directory, the awake test is profiled, see common/profiling.py.
+Profiling of the server can be turned on and off while it runs, for example:
+python client/client.py profile on
 """
 
+import argparse
 import configparser
-import socket
+import json
 import ast
 import platform
 import os
 import time
-import tkinter
-import random
-import numpy as np
-import pyautogui
+import threading
 import sys
+import transport
+
+# Shared with the server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import profiling  # noqa: E402
 
 SETTINGS_PATH = "client/settings.ini"
-MIN_LINE_LENGTH = 5
-LINE_THICKNESS = 8
-BORDER_MARGIN = 10
-WINDOW_TITLE_MARGIN = 33
+PROFILE_DIRECTORY = "client/profiles"
+DAEMON_POLL_SECONDS = 1
+COMMAND_LINE_COMMANDS = ["set", "status", "fleet", "profile", "user"]
 
 
 def main():
+    """
+    Runs the client, and reports a server which can't be reached instead of crashing.
+    :return: None
+    """
+    # Measure every request
+    if "--timings" in sys.argv[1:]:
+        sys.argv.remove("--timings")
+        transport.enable_timings()
+
+    # Profile the awake test if asked to
+    profiling.enable_from_command_line(PROFILE_DIRECTORY)
+
+    try:
+        run()
+    except transport.ServerUnreachable as error:
+        print(f"Could not reach the server: {error}", file=sys.stderr)
+        sys.exit(1)
+    except transport.UnknownUser as error:
+        print(f"Unknown user: {error}", file=sys.stderr)
+        sys.exit(1)
+
+
+def run():
     """
     After initialization, the program branches into two cases; One in which the alarm is on and you'll be able to
     turn it off by succeeding the awake test. And another in which the alarm is off and you'll be able to change
     settings, such as wakeup time, UTC offset, and more.
+    When started with --daemon, the program instead stays resident and waits for the alarm to go off.
+    When started with the set or status command, the program does just that and exits.
     :return: None
     """
+    # Command line mode
+    if len(sys.argv) > 1 and sys.argv[1] in COMMAND_LINE_COMMANDS:
+        server_address, server_port, window_height, window_width = load_settings()
+        exit_code = command_line(server_address, server_port, sys.argv[1:])
+
+        sys.exit(exit_code)
+
+    # Daemon mode
+    if "--daemon" in sys.argv[1:]:
+        server_address, server_port, window_height, window_width = load_settings()
+        daemon(server_address, server_port, window_height, window_width)
+
+        sys.exit()
+
     # Initialization
     server_address, server_port, window_height, window_width, alarm_state = initialize()
 
     # If the alarm is on
     if alarm_state == 1:
 
+        # Only now load the awake test and its heavy dependencies
+        import gui
+
         # Test if the user is awake
-        awake_test(window_height, window_width)
+        failed_attempts, trace = gui.awake_test(window_height, window_width)
 
         # After having completed the awoke_test properly, stop the alarm
-        set_alarm_state(server_address, server_port, 0)
+        set_alarm_state(server_address, server_port, 0, failed_attempts)
+
+        # Then send how the user moved the mouse pointer during the test
+        upload_trace(server_address, server_port, trace)
 
         sys.exit()
 
     # If the server is not in alarm mode
     elif alarm_state == 0:
 
+        # Have challenges ready for when the alarm goes off
+        refill_challenge_pool(window_height, window_width)
+
         # Go into management mode
         management(server_address, server_port)
 
@@ -55,422 +120,455 @@ def main():
 
 """
 ########################################################################################################################
-                                                        INITIALIZATION
+                                                        COMMAND LINE
 ########################################################################################################################
 """
 
 
-def initialize():
+def command_line(server_address, server_port, arguments):
     """
-    Loads settings from settings.ini and gets the current state of the alarm.
-    :return: server_address (str), server_port(int), window_height (int), window_width (int), alarm_state (int)
+    Runs one command from the command line, which sends a single request to the server.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param arguments: The command line arguments, starting with the command.
+    :type arguments: list of str
+    :return: exit_code (int)
     """
-    # Load settings from settings.ini
-    server_address, server_port, window_height, window_width = load_settings()
+    parser = argparse.ArgumentParser(prog="client.py", description="Changes or shows the alarm settings.")
+    commands = parser.add_subparsers(dest="command")
 
-    # Get server state
-    alarm_state = get_alarm_state(server_address, server_port)
+    set_parser = commands.add_parser("set", help="change several settings in one request")
+    add_set_arguments(set_parser)
+    set_parser.add_argument("--user", help="whose settings to change, instead of the user in settings.ini")
 
-    return server_address, server_port, window_height, window_width, alarm_state
+    status_parser = commands.add_parser("status", help="show the alarm state and settings")
+    status_parser.add_argument("--json", action="store_true", help="print the status as JSON")
+    status_parser.add_argument("--user", help="whose settings to show, instead of the user in settings.ini")
 
+    fleet_parser = commands.add_parser("fleet", help="run set or status on many servers at once")
+    fleet_parser.add_argument("fleet_command", choices=["set", "status"])
+    fleet_parser.add_argument("--servers", help="servers as address:port separated by commas, instead of [FLEET]")
+    fleet_parser.add_argument("--timeout", type=float, help="seconds each server gets to answer each attempt")
+    fleet_parser.add_argument("--user", help="whose settings to change or show on every server, instead of the user "
+                                             "in settings.ini")
+    add_set_arguments(fleet_parser)
 
-def load_settings():
-    """
-    Loads settings.ini and returns its information.
-    :return: server_address (str), server_port (str), window_height (int), window_width (int)
-    """
-    # Load settings.ini
-    config = configparser.ConfigParser()
-    config.read(SETTINGS_PATH)
-    config.sections()
-    server_address = config['SERVER']['Address']
-    server_port = config['SERVER']['Port']
-    window_height = int(config['CLIENT']['Window height'])
-    window_width = int(config['CLIENT']['Window width'])
+    profile_parser = commands.add_parser("profile", help="turn profiling of the server on or off while it runs")
+    profile_parser.add_argument("switch", choices=["on", "off"])
 
-    return server_address, server_port, window_height, window_width
+    user_parser = commands.add_parser("user", help="add a user, or list the users of the server")
+    user_parser.add_argument("user_command", choices=["add", "list"])
+    user_parser.add_argument("name", nargs="?", help="name of the user to add")
 
+    arguments = parser.parse_args(arguments)
 
-"""
-########################################################################################################################
-                                                        AWAKE TEST
-########################################################################################################################
-"""
+    # Make the request for another user than the one in settings.ini
+    if getattr(arguments, "user", None) is not None:
+        transport.set_user(arguments.user)
+
+    if arguments.command == "fleet":
+        return fleet_command_line(arguments, fleet_parser)
+
+    # Users belong to the whole server, and the user in settings.ini may not have been added yet
+    if arguments.command == "user":
+        transport.set_user(None)
+        return user_command_line(server_address, server_port, arguments, user_parser)
+
+    if arguments.command == "set":
+        changes = changes_from_arguments(arguments)
+        if len(changes) == 0:
+            set_parser.error("nothing to set")
+
+        error = set_user_preferences(server_address, server_port, changes)
+        if error is not None:
+            print(f"The server refused the change: {error}", file=sys.stderr)
+            return 1
+
+    elif arguments.command == "profile":
+        set_server_profiling(server_address, server_port, arguments.switch == "on")
+
+    else:
+        status = load_status(server_address, server_port)
+        if arguments.json:
+            print(json.dumps(status, indent=2))
+        else:
+            display_status(status)
+
+    return 0
 
 
-def awake_test(window_height, window_width):
+def add_set_arguments(parser):
     """
-    Gives the user challenges until one is overcome, in which case we assume the user is awake enough to not fall back
-    to sleep.
-    :param window_height: How many pixels high the GUI should be.
-    :type window_height: int
-    :param window_width: How many pixels wide the GUI should be.
-    :type window_width: int
+    Adds the arguments of the settings which can be changed from the command line.
+    :param parser: The parser of the command.
+    :type parser: argparse.ArgumentParser
     :return: None
     """
-    # Create GUI
-    window, canvas = create_awake_test_gui(window_height, window_width)
+    parser.add_argument("--active", type=int, choices=[0, 1], help="turn the alarm on (1) or off (0)")
+    parser.add_argument("--hour", type=int, help="wakeup hour")
+    parser.add_argument("--minute", type=int, help="wakeup minute")
+    parser.add_argument("--window", type=int, help="wakeup window in minutes")
+    parser.add_argument("--utc-offset", type=int, help="hours ahead of UTC")
+    parser.add_argument("--time-zone", help="IANA time zone like Europe/Oslo, or none")
+    parser.add_argument("--recurrence", help="once, daily, weekdays, weekends or days like mon,wed,fri")
+    parser.add_argument("--skip-dates", help="dates to skip like 2026-12-24,2026-12-25, or none")
+    parser.add_argument("--song", help="name of the song the alarm plays")
+
+
+def changes_from_arguments(arguments):
+    """
+    Maps the given setting arguments to the user_preferences columns.
+    :param arguments: The parsed command line arguments.
+    :type arguments: argparse.Namespace
+    :return: changes (dict)
+    """
+    changes = {"active_state": arguments.active, "wakeup_time_hour": arguments.hour,
+               "wakeup_time_minute": arguments.minute, "wakeup_window": arguments.window,
+               "utc_offset": arguments.utc_offset, "time_zone": arguments.time_zone,
+               "recurrence": arguments.recurrence, "skip_dates": arguments.skip_dates, "song": arguments.song}
 
-    # Create test
-    start, east_lines, west_lines, south_lines, north_lines = create_test(canvas)
+    return {column: value for column, value in changes.items() if value is not None}
 
-    # Run tests
-    awake = tkinter.BooleanVar(canvas, False, "awake")
-    while not awake.get():
-        awake.set(run_test(canvas, start))
 
-    print("Congratulations. You passed the test!")
+def fleet_command_line(arguments, fleet_parser):
+    """
+    Runs set or status on every server of the fleet concurrently, and shows the results in one table.
+    :param arguments: The parsed command line arguments.
+    :type arguments: argparse.Namespace
+    :param fleet_parser: The parser of the fleet command, for reporting bad arguments.
+    :type fleet_parser: argparse.ArgumentParser
+    :return: exit_code (int)
+    """
+    # Only now load asyncio, which management mode doesn't need
+    import fleet
 
+    servers = fleet.load_servers(SETTINGS_PATH, arguments.servers)
 
-def create_awake_test_gui(window_height, window_width):
+    if arguments.fleet_command == "set":
+        changes = changes_from_arguments(arguments)
+        if len(changes) == 0:
+            fleet_parser.error("nothing to set")
+        command = "set_user_preferences " + " ".join(f"{column}={value}" for column, value in changes.items())
+    else:
+        command = "get_status"
+
+    # Send the command to every server at once
+    start = time.perf_counter()
+    results = fleet.run_command(servers, command, arguments.timeout)
+    seconds = time.perf_counter() - start
+
+    if arguments.fleet_command == "set":
+        fleet.display_set_results(results)
+    else:
+        fleet.display_status_results(results)
+
+    failures = fleet.count_failures(results, command)
+    print(f"{len(servers) - failures} of {len(servers)} servers ok in {seconds:.2f} s")
+
+    return 1 if failures > 0 else 0
+
+
+def user_command_line(server_address, server_port, arguments, user_parser):
     """
-    Creates the GUI
-    :param window_height: How many pixels high the GUI should be.
-    :type window_height: int
-    :param window_width: How many pixels wide the GUI should be.
-    :type window_width: int
-    :return: window (tkinter.Tk), canvas (tkinter.Canvas)
+    Adds a user to the server, or lists its users.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param arguments: The parsed command line arguments.
+    :type arguments: argparse.Namespace
+    :param user_parser: The parser of the user command, for reporting bad arguments.
+    :type user_parser: argparse.ArgumentParser
+    :return: exit_code (int)
     """
-    # Sets minimum window height
-    if window_height < 36:
-        window_height = 36
-    # Sets minimum window width
-    if window_width < 36:
-        window_width = 36
+    if arguments.user_command == "list":
+        for name in load_users(server_address, server_port):
+            print(name)
+        return 0
 
-    # Creating the main window
-    window = tkinter.Tk()
-    window.geometry(str(window_width) + "x" + str(window_height) + "+0+0")
-    window.minsize(height=window_height, width=window_width)
-    window.title("Wakey Wakey - Awake test")
+    if arguments.name is None:
+        user_parser.error("the name of the user to add is missing")
 
-    # The canvas that the cells are drawn onto
-    canvas = tkinter.Canvas(window, height=window_height, width=window_width, bg="white")
+    error = add_user(server_address, server_port, arguments.name)
+    if error is not None:
+        print(f"The server refused the user: {error}", file=sys.stderr)
+        return 1
 
-    canvas.grid(row=0, column=0)
-    canvas.update()
+    return 0
 
-    return window, canvas
 
+def add_user(server_address, server_port, name):
+    """
+    Adds a user to the server, who starts with the preferences of a new user, and waits until they are stored.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param name: The name of the new user.
+    :type name: str
+    :return: error (str), or None if the server added the user
+    """
+    # Request adding the user
+    command = "add_user " + name
+
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    response = msg.decode("utf-8")
 
-def create_test(canvas):
+    if response == "ok":
+        return None
+
+    return response.partition(" ")[2]
+
+
+def load_users(server_address, server_port):
     """
-    Fills the canvas with a graphical test, and a success condition.
-    :param canvas: The GUI in which the test is drawn onto.
-    :type canvas: tkinter.Canvas
-    :return: east_lines (list of tkinter.Canvas.create_rectangle), west_lines (list of tkinter.Canvas.create_rectangle),
-    south_lines (list of tkinter.Canvas.create_rectangle), north_lines (list of tkinter.Canvas.create_rectangle)
+    Gets the names of the users of the server.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :return: users (list of str)
     """
-    # Choose which side the mouse pointer shall start on (Left: 1, Top: 2)
-    start_side = random.randint(1, 2)
+    # Request the users
+    command = "get_users"
 
-    size = np.array([canvas.winfo_width() - 3 - BORDER_MARGIN, canvas.winfo_height() - 3 - BORDER_MARGIN])
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    users = ast.literal_eval(msg.decode("utf-8"))
 
-    # Create start and end
-    if start_side == 1:
-        # If starting side is left
-        start = np.array([BORDER_MARGIN, random.randint(BORDER_MARGIN, size[1])])
-        canvas.create_rectangle(start[0], start[1], start[0] + LINE_THICKNESS * 2, start[1] + LINE_THICKNESS * 2,
-                                fill="green", outline="green")
+    return users
 
-        end = np.array([size[0], random.randint(BORDER_MARGIN, size[1])])
-        end_block = canvas.create_rectangle(end[0], end[1], end[0] - LINE_THICKNESS * 2, end[1] + LINE_THICKNESS * 2,
-                                            fill="red", outline="red")
 
-    else:
-        # If starting side is top
-        start = np.array([random.randint(BORDER_MARGIN, size[0]), BORDER_MARGIN])
-        canvas.create_rectangle(start[0], start[1], start[0] + LINE_THICKNESS * 2, start[1] + LINE_THICKNESS * 2,
-                                fill="green", outline="green")
-
-        end = np.array([random.randint(BORDER_MARGIN, size[0]), size[1]])
-        end_block = canvas.create_rectangle(end[0], end[1], end[0] + LINE_THICKNESS * 2, end[1] - LINE_THICKNESS * 2,
-                                            fill="red", outline="red")
-
-    # Instantiate list for referencing lines by their direction
-    east_lines = []
-    west_lines = []
-    south_lines = []
-    north_lines = []
-
-    # Create start line
-    line_end, previous_direction, path_complete = draw_line(start, end, size, canvas, end_block,
-                                                            [0, 0], east_lines, west_lines, south_lines, north_lines)
-    canvas.update()
-
-    # While the previous line doesn't touch the goal
-    while not path_complete:
-        # Draw a new line
-        line_end, previous_direction, path_complete = draw_line(line_end, end, size, canvas, end_block,
-                                                                previous_direction, east_lines, west_lines,
-                                                                south_lines, north_lines)
-        canvas.update()
-
-    # After the path is complete, increase the thickness of all the lines
-    east_lines, west_lines, south_lines, north_lines = increase_line_thickness(canvas, east_lines, west_lines,
-                                                                               south_lines, north_lines,
-                                                                               LINE_THICKNESS)
-
-    return start, east_lines, west_lines, south_lines, north_lines
-
-
-def draw_line(start, end, size, canvas, end_block, previous_direction,
-              east_lines, west_lines, south_lines, north_lines):
-    """
-    Draws a line in such a way as to make a connection between start and end.
-    :param start: Where the line will have to start.
-    :type start: np.array
-    :param end: Where the new line will try to get closer to.
-    :type end: np.array
-    :param size: The width and height of the game area.
-    :type size: np.array
-    :param canvas: The GUI in which the challenge happens.
-    :type canvas: tkinter.TK
-    :param end_block: The area in which any pixel marks the goal, and the end of any new line.
-    :type end_block: tkinter.Canvas.create_rectangle
-    :param previous_direction: The direction in which the previous line was headed.
-    :type previous_direction: np.array
-    :param east_lines: An array containing a reference to all the lines going east.
-    :type east_lines: list
-    :param west_lines: An array containing a reference to all the lines going west.
-    :type west_lines: list
-    :param south_lines: An array containing a reference to all the lines going south.
-    :type south_lines: list
-    :param north_lines: An array containing a reference to all the lines going north.
-    :type north_lines: list
-    :return: line_end (np.array), direction (np.array), covers_goal (boolean)
-    """
-    # Get direction
-    direction = determine_direction(start, end, previous_direction)
-
-    # Get line length
-    max_direction_length = np.multiply(size, direction)
-    max_direction_length = max_direction_length[max_direction_length != 0]
-    max_direction_length = abs(int(max_direction_length[0]))
-    random_line_length = random.randint(MIN_LINE_LENGTH, max_direction_length)
-
-    # Calculate line end
-    line_end = np.add(start, np.multiply(direction, random_line_length))
-    if line_end[0] > size[0] or line_end[0] < BORDER_MARGIN:
-        line_end[0] = size[0]
-    if line_end[1] > size[1] or line_end[1] < BORDER_MARGIN:
-        line_end[1] = size[1]
-
-    # Draw line in the determined direction
-    if direction[0] == 1:
-        east_lines.append(canvas.create_rectangle(start[0], start[1], line_end[0], line_end[1],
-                                                  fill="black"))
-    elif direction[0] == -1:
-        west_lines.append(canvas.create_rectangle(start[0], start[1], line_end[0], line_end[1],
-                                                  fill="black"))
-    elif direction[1] == 1:
-        south_lines.append(canvas.create_rectangle(start[0], start[1], line_end[0], line_end[1],
-                                                   fill="black"))
-    elif direction[1] == -1:
-        north_lines.append(canvas.create_rectangle(start[0], start[1], line_end[0], line_end[1],
-                                                   fill="black"))
-
-    # Check if the new line overlaps the goal
-    if end_block in canvas.find_overlapping(start[0], start[1], line_end[0], line_end[1]):
-        covers_goal = True
-    else:
-        covers_goal = False
+def set_user_preferences(server_address, server_port, changes):
+    """
+    Sends every change to the server in one request, and waits until they are stored.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param changes: The new value of every user preference to change.
+    :type changes: dict
+    :return: error (str), or None if the server stored the changes
+    """
+    # Request changing the user preferences
+    command = "set_user_preferences " + " ".join(f"{column}={value}" for column, value in changes.items())
+
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    response = msg.decode("utf-8")
+
+    if response == "ok":
+        return None
 
-    return line_end, direction, covers_goal
+    return response.partition(" ")[2]
 
 
-def determine_direction(source, destination, previous_direction):
+def set_server_profiling(server_address, server_port, enabled):
     """
-    Determines the cardinal direction that gives the shortest path between point a (source) and b (destination)
-    :param source: Point A
-    :type source: np.array
-    :param destination: Point B
-    :type destination: np.array
-    :param previous_direction: The direction which was last used.
-    :type previous_direction: np.array
-    :return: np.array
+    Turns profiling on or off in every process of the server, and waits until the server confirms it.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param enabled: Whether to turn profiling on.
+    :type enabled: bool
+    :return: None
     """
-    # Find vector from source to destination
-    direct_path = np.subtract(destination, source)
+    transport.request(server_address, server_port, f"set_profiling {int(enabled)}")
 
-    # Return most impacting direction as a scalar vector
-    if abs(direct_path[0]) >= abs(direct_path[1]):
-        if direct_path[0] >= 0:
-            direction = np.array([1, 0])
-        else:
-            direction = np.array([-1, 0])
-    else:
-        if direct_path[1] >= 0:
-            direction = np.array([0, 1])
-        else:
-            direction = np.array([0, -1])
 
-    # Get the opposite direction of the previous one
-    opposite_of_previous_direction = previous_direction
-    opposite_of_previous_direction = opposite_of_previous_direction[opposite_of_previous_direction != 0] * -1
+def load_status(server_address, server_port):
+    """
+    Gets the alarm state, the revision of the user preferences, the user preferences and the time until wakeup
+    from the server.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :return: status (dict)
+    """
+    # Request the status
+    command = "get_status"
 
-    # If the proposed new direction is perpendicular to the previous one, go south
-    if np.array_equal(direction, previous_direction) or np.array_equal(direction, opposite_of_previous_direction):
-        x = direction[0]
-        y = direction[1]
-        direction = np.array([y, x])
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    status = msg.decode("utf-8")
+
+    # Convert to dictionary
+    status = ast.literal_eval(status)
 
-    return direction
+    return status
 
 
-def increase_line_thickness(canvas, east_lines, west_lines, south_lines, north_lines, increase_factor):
+def display_status(status):
     """
-    Increases the thickness of all drawn lines.
-    :param canvas: The GUI in which the challenge happens.
-    :type canvas: tkinter.TK
-    :param east_lines: An array containing a reference to all the lines going east.
-    :type east_lines: list
-    :param west_lines: An array containing a reference to all the lines going west.
-    :type west_lines: list
-    :param south_lines: An array containing a reference to all the lines going south.
-    :type south_lines: list
-    :param north_lines: An array containing a reference to all the lines going north.
-    :type north_lines: list
-    :param increase_factor: How many pixels to increase the line thickness by.
-    :type increase_factor: int
-    :return: new_east_lines (list), new_west_lines (list), new_south_lines (list), new_north_lines (list)
+    Shows the status in a readable format, one setting per line.
+    :param status: The status, as sent by the server.
+    :type status: dict
+    :return: None
     """
-    # Instantiate the lists which will contain references to the new, thicker, lines.
-    new_east_lines = []
-    new_west_lines = []
-    new_south_lines = []
-    new_north_lines = []
+    print(f"{'alarm_state':<28}{status['alarm_state']}")
+    for column, value in status["user_preferences"].items():
+        print(f"{column:<28}{value}")
+    if status["seconds_until_wakeup_time"] is not None:
+        print(f"{'seconds_until_wakeup_time':<28}{status['seconds_until_wakeup_time']}")
+    for reason, count in status.get("admission_counters", {}).items():
+        print(f"{'connections_' + reason:<28}{count}")
+    if "profiling" in status:
+        print(f"{'profiling':<28}{int(status['profiling'])}")
 
-    # Go through each line going in this direction, draw a new line which is thicker, then delete the old one
-    for line in east_lines:
-        x0, y0, x1, y1 = canvas.coords(line)
-        y1 += increase_factor
-        x1 += increase_factor
 
-        canvas.delete(line)
-        new_east_lines.append(canvas.create_rectangle(x0, y0, x1, y1, fill="black"))
+"""
+########################################################################################################################
+                                                        INITIALIZATION
+########################################################################################################################
+"""
 
-    # Clear the old list of the thinner lines going in this direction
-    east_lines.clear()
 
-    # Go through each line going in this direction, draw a new line which is thicker, then delete the old one
-    for line in west_lines:
-        x0, y0, x1, y1 = canvas.coords(line)
-        y1 += increase_factor
-        x1 += increase_factor
+def initialize():
+    """
+    Loads settings from settings.ini and gets the current state of the alarm.
+    :return: server_address (str), server_port(int), window_height (int), window_width (int), alarm_state (int)
+    """
+    # Load settings from settings.ini
+    server_address, server_port, window_height, window_width = load_settings()
 
-        canvas.delete(line)
-        new_west_lines.append(canvas.create_rectangle(x0, y0, x1, y1, fill="black"))
+    # Get server state
+    alarm_state = get_alarm_state(server_address, server_port)
 
-    # Clear the old list of the thinner lines going in this direction
-    west_lines.clear()
+    return server_address, server_port, window_height, window_width, alarm_state
 
-    # Go through each line going in this direction, draw a new line which is thicker, then delete the old one
-    for line in south_lines:
-        x0, y0, x1, y1 = canvas.coords(line)
-        y1 += increase_factor
-        x1 += increase_factor
 
-        canvas.delete(line)
-        new_south_lines.append(canvas.create_rectangle(x0, y0, x1, y1, fill="black"))
+def load_settings():
+    """
+    Loads settings.ini and returns its information.
+    :return: server_address (str), server_port (str), window_height (int), window_width (int)
+    """
+    # Load settings.ini
+    config = configparser.ConfigParser()
+    config.read(SETTINGS_PATH)
+    config.sections()
+    server_address = config['SERVER']['Address']
+    server_port = config['SERVER']['Port']
+    window_height = int(config['CLIENT']['Window height'])
+    window_width = int(config['CLIENT']['Window width'])
 
-    # Clear the old list of the thinner lines going in this direction
-    south_lines.clear()
+    # Timeouts and retries of every request
+    transport.configure(config['CLIENT'].getfloat('Connect timeout', transport.CONNECT_TIMEOUT_SECONDS),
+                        config['CLIENT'].getfloat('Read timeout', transport.READ_TIMEOUT_SECONDS),
+                        config['CLIENT'].getint('Retries', transport.RETRIES),
+                        config['SERVER'].get('Socket'))
 
-    # Go through each line going in this direction, draw a new line which is thicker, then delete the old one
-    for line in north_lines:
-        x0, y0, x1, y1 = canvas.coords(line)
-        y1 += increase_factor
-        x1 += increase_factor
+    # Whose alarm this client manages, where no user is the default user of the server
+    transport.set_user(config['CLIENT'].get('User'))
 
-        canvas.delete(line)
-        new_north_lines.append(canvas.create_rectangle(x0, y0, x1, y1, fill="black"))
+    return server_address, server_port, window_height, window_width
 
-    # Clear the old list of the thinner lines going in this direction
-    north_lines.clear()
 
-    canvas.update()
+def refill_challenge_pool(window_height, window_width):
+    """
+    Refills the challenge pool in a background thread, so that numpy is not imported before the menu is shown.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: thread (threading.Thread)
+    """
+    thread = threading.Thread(target=refill_challenge_pool_now, args=(window_height, window_width), daemon=True)
+    thread.start()
 
-    return new_east_lines, new_west_lines, new_south_lines, new_north_lines
+    return thread
 
 
-def run_test(canvas, start):
+def refill_challenge_pool_now(window_height, window_width):
     """
-    Runs the awake test.
-    :param canvas: The GUI in which the test is drawn onto.
-    :type canvas: tkinter.Canvas
-    :param start: The coordinates of the start position of the challenge.
-    :type start: np.array
-    :return: success (boolean)
+    Imports the challenge generator and refills the challenge pool.
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: None
     """
-    # Place mouse pointer over start_block
-    pyautogui.moveTo(start[0] + LINE_THICKNESS // 2, start[1] + 33 + LINE_THICKNESS // 2)
+    import challenge
 
-    success = False
+    challenge.refill_pool(window_height, window_width)
 
-    # While the mouse hasn't yet reached the goal
-    while not success:
-        canvas.update()
 
-        # Check mouse position
-        mouse_x, mouse_y = pyautogui.position()
-        mouse_y -= WINDOW_TITLE_MARGIN
+"""
+########################################################################################################################
+                                                        DAEMON
+########################################################################################################################
+"""
 
-        # Check pixel color of mouse position
-        current_pixel_color = get_pixel_color(canvas, mouse_x, mouse_y)
-
-        if current_pixel_color == "WHITE":
-            # Touching wall
-            print("You have touched the wall! Moving you back to start.")
-            pyautogui.moveTo(start[0] + LINE_THICKNESS // 2, start[1] + WINDOW_TITLE_MARGIN + LINE_THICKNESS // 2)
-            time.sleep(0.1)
-
-        # Check if in goal
-        elif current_pixel_color == "RED":
-            # Reached goal
-            print("You have reached the goal!")
-            success = True
 
-        # To avoid huge system load
-        else:
-            time.sleep(0.1)
-
-    return success
-
-
-def get_pixel_color(canvas, x, y):
-    """
-    Gets the pixel color of a certain pixel in a canvas.
-    :param canvas: The canvas in question.
-    :type canvas: tkinter.Canvas
-    :param x: The x coordinate of the pixel to check.
-    :type x: int
-    :param y: The y coordinate of the pixel to check.
-    :type y: int
-    :return: string
-    """
-    # Get a list og the canvas objects overlapping the given coordinate
-    ids = canvas.find_overlapping(x, y, x, y)
-
-    # Instantiate list which will contain the color of all the overlapping widgets
-    colors = []
-
-    if len(ids) > 0:
-        for index in ids:
-            color = canvas.itemcget(index, "fill")
-            color = color.upper()
-            if color != '':
-                colors.append(color)
-
-    # Returns a color in the following priority: Red, Green, Black, White
-    if "RED" in colors:
-        return "RED"
-    elif "GREEN" in colors:
-        return "GREEN"
-    elif "BLACK" in colors:
-        return "BLACK"
-    else:
-        return "WHITE"
+def daemon(server_address, server_port, window_height, window_width):
+    """
+    Stays resident with the awake test already drawn onto a hidden window, and polls the server for the alarm state.
+    Once the alarm goes off the window is shown right away. After the test is passed, the alarm is stopped, and the
+    next challenge is drawn onto the hidden window.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param window_height: How many pixels high the GUI should be.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI should be.
+    :type window_width: int
+    :return: None
+    """
+    # Load the awake test up front, since the daemon is meant to be ready when the alarm goes off
+    import gui
+
+    # Create the GUI once and hide it
+    window, canvas = gui.create_awake_test_gui(window_height, window_width)
+    window.withdraw()
+
+    # Draw the first test while waiting
+    challenge = gui.prepare_hidden_test(canvas, window_height, window_width)
+    print("Daemon is ready and waiting for the alarm.")
+
+    while True:
+        # Keep the hidden window responsive
+        window.update()
+
+        # Check the alarm state
+        try:
+            alarm_state = get_alarm_state(server_address, server_port)
+        except OSError as error:
+            print(f"Could not reach the server: {error}")
+            alarm_state = 0
+        except transport.UnknownUser as error:
+            print(f"Unknown user: {error}")
+            alarm_state = 0
+
+        # If the alarm is on
+        if alarm_state == 1:
+            # Show the test which is already drawn
+            window.deiconify()
+            window.geometry("+0+0")
+            canvas.update()
+
+            # Test if the user is awake
+            failed_attempts, trace = gui.pass_test(canvas, challenge)
+
+            # After having completed the test properly, stop the alarm, and then send how the user moved the mouse
+            # pointer during the test. If the alarm can't be stopped, it is still on at the next check.
+            try:
+                set_alarm_state(server_address, server_port, 0, failed_attempts)
+                upload_trace(server_address, server_port, trace)
+            except OSError as error:
+                print(f"Could not reach the server: {error}")
+            except transport.UnknownUser as error:
+                print(f"Unknown user: {error}")
+
+            # Hide the window and get the next test ready
+            window.withdraw()
+            challenge = gui.prepare_hidden_test(canvas, window_height, window_width)
+
+        time.sleep(DAEMON_POLL_SECONDS)
 
 
 """
@@ -489,62 +587,52 @@ def get_alarm_state(server_address, server_port):
     :type server_port: str
     :return: alarm_state (int)
     """
-    connection = server_connection(server_address, server_port)
-
     # Request alarm state
     command = "get_alarm_state"
-    connection.send(bytes(command, "utf-8"))
 
     # Receive and decode response
-    msg = connection.recv(1024)
+    msg = transport.request(server_address, server_port, command)
     msg_decoded = msg.decode("utf-8")
     alarm_state = int(msg_decoded)
 
-    # Close connection
-    connection.close()
-
     return alarm_state
 
 
-def server_connection(server_address, server_port):
+def set_alarm_state(server_address, server_port, new_alarm_state, failed_attempts=0):
     """
-    Creates a server connection and returns the socket.
+    Sets the value of alarm_state, which is stored in the database on the server.
     :param server_address: The IP address of the server.
     :type server_address: str
     :param server_port: The port number of the server.
     :type server_port: str
-    :return: s (socket.socket)
+    :param new_alarm_state: The requested new value of alarm_state.
+    :type new_alarm_state: int
+    :param failed_attempts: How many times the user failed the awake test, stored in the wake history.
+    :type failed_attempts: int
+    :return: None
     """
-    # Create an INET streaming socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-    # Connect to the server
-    s.connect((server_address, int(server_port)))
-
-    # Return the socket
-    return s
+    # Request changing alarm state
+    command = "set_alarm_state " + str(new_alarm_state) + " " + str(failed_attempts)
+    transport.request(server_address, server_port, command)
 
 
-def set_alarm_state(server_address, server_port, new_alarm_state):
+def upload_trace(server_address, server_port, trace):
     """
-    Sets the value of alarm_state, which is stored in the database on the server.
+    Sends the whole mouse pointer trace of an awake test to the server in one compressed message.
     :param server_address: The IP address of the server.
     :type server_address: str
     :param server_port: The port number of the server.
     :type server_port: str
-    :param new_alarm_state: The requested new value of alarm_state.
-    :type new_alarm_state: int
+    :param trace: The trace, as made by trajectory.create_trace.
+    :type trace: dict
     :return: None
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
+    import trajectory
 
-    # Request changing alarm state
-    command = "set_alarm_state " + str(new_alarm_state)
-    connection.send(bytes(command, "utf-8"))
-
-    # Close connection
-    connection.close()
+    # Send the length of the trace on the command line, followed by the trace itself
+    data = trajectory.encode_trace(trace)
+    command = "upload_trace " + str(len(data)) + "\n"
+    transport.request(server_address, server_port, bytes(command, "utf-8") + data)
 
 
 def management(server_address, server_port):
@@ -559,18 +647,24 @@ def management(server_address, server_port):
     """
     system = platform.system()
     not_done = True
+    user_preferences = None
+    preferences_revision = -1
 
     # While the user is not done changing settings
     while not_done:
-        # Clear the console
-        if system == "Windows":
-            os.system("cls")
-        else:
-            os.system("clear")
+        # Only redraw if the preferences changed on the server
+        changed_preferences = load_user_preferences_if_changed(server_address, server_port, preferences_revision)
+        if changed_preferences is not None:
+            preferences_revision, user_preferences = changed_preferences
 
-        # Display current preferences
-        user_preferences = load_user_preferences(server_address, server_port)
-        display_user_preferences(user_preferences)
+            # Clear the console
+            if system == "Windows":
+                os.system("cls")
+            else:
+                print("\033[H\033[2J", end="")
+
+            # Display current preferences
+            display_user_preferences(user_preferences)
 
         # Changing preferences
         preference_to_change = get_input("Input the number of the setting you wish to change: ", "int", 2)
@@ -603,6 +697,42 @@ def management(server_address, server_port):
 
             change_utc_offset(server_address, server_port, new_utc_offset)
 
+        # If showing the wake history
+        elif preference_to_change == 5:
+            wake_event_rollups = load_wake_event_rollups(server_address, server_port)
+            display_wake_event_rollups(wake_event_rollups)
+
+        # If changing time zone
+        elif preference_to_change == 6:
+            print("Changing time zone.")
+            new_time_zone = get_input("Please input new time zone (for example Europe/Oslo), or none to use the UTC "
+                                      "offset: ", "word", 0)
+
+            change_time_zone(server_address, server_port, new_time_zone)
+
+        # If changing recurrence
+        elif preference_to_change == 7:
+            print("Changing recurrence.")
+            new_recurrence = get_input("Please input once, daily, weekdays, weekends or days like mon,wed,fri: ",
+                                       "word", 0)
+
+            change_recurrence(server_address, server_port, new_recurrence)
+
+        # If changing skip dates
+        elif preference_to_change == 8:
+            print("Changing skip dates.")
+            new_skip_dates = get_input("Please input dates to skip like 2026-12-24,2026-12-25, or none: ", "word", 0)
+
+            change_skip_dates(server_address, server_port, new_skip_dates)
+
+        # If changing song
+        elif preference_to_change == 9:
+            print("Changing song. These are the songs on the server: " +
+                  ", ".join(load_songs(server_address, server_port)))
+            new_song = get_input("Please input the name of the song: ", "word", 0)
+
+            change_song(server_address, server_port, new_song)
+
 
 def load_user_preferences(server_address, server_port):
     """
@@ -613,26 +743,90 @@ def load_user_preferences(server_address, server_port):
     :type server_port: str
     :return: user_preferences (dict)
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
-
     # Request user preferences
     command = "get_user_preferences"
-    connection.send(bytes(command, "utf-8"))
 
     # Receive and decode response
-    msg = connection.recv(1024)
+    msg = transport.request(server_address, server_port, command)
     user_preferences = msg.decode("utf-8")
 
-    # Close connection
-    connection.close()
-
     # Convert to dictionary
     user_preferences = ast.literal_eval(user_preferences)
 
     return user_preferences
 
 
+def load_user_preferences_if_changed(server_address, server_port, preferences_revision):
+    """
+    Gets the user preferences from the server, but only if they changed since the given revision.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param preferences_revision: The revision of the user preferences the client already has.
+    :type preferences_revision: int
+    :return: None if not modified, else preferences_revision (int), user_preferences (dict)
+    """
+    # Request user preferences
+    command = "get_user_preferences_if_changed " + str(preferences_revision)
+
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    response = msg.decode("utf-8")
+
+    if response == "not_modified":
+        return None
+
+    # Convert to revision and dictionary
+    preferences_revision, user_preferences = ast.literal_eval(response)
+
+    return preferences_revision, user_preferences
+
+
+def load_wake_event_rollups(server_address, server_port):
+    """
+    Gets the daily and weekly rollups of the wake history from the server.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :return: wake_event_rollups (dict)
+    """
+    # Request wake event rollups
+    command = "get_wake_event_rollups"
+
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    wake_event_rollups = msg.decode("utf-8")
+
+    # Convert to dictionary
+    wake_event_rollups = ast.literal_eval(wake_event_rollups)
+
+    return wake_event_rollups
+
+
+def display_wake_event_rollups(wake_event_rollups):
+    """
+    Shows the daily and weekly rollups of the wake history in a readable format.
+    :param wake_event_rollups: The rollups, as returned by the server.
+    :type wake_event_rollups: dict
+    :return: None
+    """
+    print(f"{'Period':<12}{'Alarms':>8}{'Avg lag':>10}{'Max lag':>10}{'Avg dismiss':>13}{'Max dismiss':>13}"
+          f"{'Failed':>8}")
+    for period in ["daily", "weekly"]:
+        for rollup in wake_event_rollups[period]:
+            print(f"{rollup[0]:<12}{rollup[1]:>8}", end="")
+            for column_id, seconds in enumerate(rollup[2:6]):
+                width = 10 if column_id < 2 else 13
+                if seconds is None:
+                    print(f"{'-':>{width}}", end="")
+                else:
+                    print(f"{seconds:>{width - 2}.1f} s", end="")
+            print(f"{rollup[6]:>8}")
+        print()
+
+
 def display_user_preferences(user_preferences):
     """
     Shows the current user preferences in a readable format.
@@ -659,6 +853,17 @@ def display_user_preferences(user_preferences):
     else:
         utc_prefix = ""
     print("4.\tUTC offset:\t" + utc_prefix + str(user_preferences["utc_offset"]))
+    print("5.\tShow wake history")
+    if user_preferences.get("time_zone") is not None:
+        print("6.\tTime zone:\t" + user_preferences["time_zone"])
+    else:
+        print("6.\tTime zone:\tNone, using the UTC offset")
+    print("7.\tRepeat:\t\t" + str(user_preferences.get("recurrence", "once")))
+    if user_preferences.get("skip_dates") is not None:
+        print("8.\tSkip dates:\t" + user_preferences["skip_dates"].replace(",", ", "))
+    else:
+        print("8.\tSkip dates:\tNone")
+    print("9.\tSong:\t\t" + str(user_preferences.get("song", "lostwoods")))
 
 
 def change_active_state(server_address, server_port, current_active_state):
@@ -689,15 +894,9 @@ def set_active_state(server_address, server_port, new_active_state):
     :type new_active_state: int
     :return: None
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
-
     # Request changing alarm state
     command = "set_active_state " + str(new_active_state)
-    connection.send(bytes(command, "utf-8"))
-
-    # Close connection
-    connection.close()
+    transport.request(server_address, server_port, command)
 
 
 def get_input(prompt, expected_type, speed):
@@ -774,6 +973,15 @@ def is_clean_input(expected_type, value):
             is_clean = False
             reason = "Empty"
 
+    # Checks if correct word input, which has to fit in one word of a command
+    elif expected_type == "word":
+        if value == "":
+            reason = "Empty"
+        elif " " in value:
+            reason = "Contains spaces"
+        else:
+            is_clean = True
+
     return is_clean, reason
 
 
@@ -790,15 +998,9 @@ def change_wakeup_time(server_address, server_port, hour_or_minute, value):
     :type value: int
     :return: None
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
-
     # Request changing alarm state
     command = "set_wakeup_" + hour_or_minute + " " + str(value)
-    connection.send(bytes(command, "utf-8"))
-
-    # Close connection
-    connection.close()
+    transport.request(server_address, server_port, command)
 
 
 def change_wakeup_window(server_address, server_port, new_wakeup_window):
@@ -812,15 +1014,9 @@ def change_wakeup_window(server_address, server_port, new_wakeup_window):
     :type new_wakeup_window: int
     :return: None
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
-
     # Request changing alarm state
     command = "set_wakeup_window " + str(new_wakeup_window)
-    connection.send(bytes(command, "utf-8"))
-
-    # Close connection
-    connection.close()
+    transport.request(server_address, server_port, command)
 
 
 def change_utc_offset(server_address, server_port, new_utc_offset):
@@ -834,15 +1030,96 @@ def change_utc_offset(server_address, server_port, new_utc_offset):
     :type new_utc_offset: int
     :return: None
     """
-    # Connect to server
-    connection = server_connection(server_address, server_port)
-
     # Request changing alarm state
     command = "set_utc_offset " + str(new_utc_offset)
-    connection.send(bytes(command, "utf-8"))
+    transport.request(server_address, server_port, command)
+
+
+def change_time_zone(server_address, server_port, new_time_zone):
+    """
+    Sends a command to the server requesting the time zone to be changed to the new_time_zone parameter.
+    The server ignores names it doesn't know.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param new_time_zone: The new IANA time zone name, or none to use the UTC offset.
+    :type new_time_zone: str
+    :return: None
+    """
+    # Request changing time zone
+    command = "set_time_zone " + new_time_zone
+    transport.request(server_address, server_port, command)
 
-    # Close connection
-    connection.close()
+
+def change_recurrence(server_address, server_port, new_recurrence):
+    """
+    Sends a command to the server requesting the recurrence rule to be changed to the new_recurrence parameter.
+    The server ignores rules it can't understand.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param new_recurrence: The new recurrence rule, such as once, daily, weekdays, weekends or mon,wed,fri.
+    :type new_recurrence: str
+    :return: None
+    """
+    # Request changing recurrence
+    command = "set_recurrence " + new_recurrence
+    transport.request(server_address, server_port, command)
+
+
+def change_skip_dates(server_address, server_port, new_skip_dates):
+    """
+    Sends a command to the server requesting the skip dates to be changed to the new_skip_dates parameter.
+    The server ignores dates it can't understand.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param new_skip_dates: The dates in the format YYYY-MM-DD separated by commas, or none to skip nothing.
+    :type new_skip_dates: str
+    :return: None
+    """
+    # Request changing skip dates
+    command = "set_skip_dates " + new_skip_dates
+    transport.request(server_address, server_port, command)
+
+
+def load_songs(server_address, server_port):
+    """
+    Gets the names of the songs the alarm can play from the server.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :return: songs (list of str)
+    """
+    # Request the songs
+    command = "get_songs"
+
+    # Receive and decode response
+    msg = transport.request(server_address, server_port, command)
+    songs = ast.literal_eval(msg.decode("utf-8"))
+
+    return songs
+
+
+def change_song(server_address, server_port, new_song):
+    """
+    Sends a command to the server requesting the song of the alarm to be changed to the new_song parameter.
+    The server ignores songs it doesn't have.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param new_song: The name of the song.
+    :type new_song: str
+    :return: None
+    """
+    # Request changing song
+    command = "set_song " + new_song
+    transport.request(server_address, server_port, command)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,210 @@
+"""
+File: fleet.py
+
+This module sends the same request to many servers at once, for managing several alarms from one client.
+Every server gets its own connection and its own timeout, so the whole fleet takes about as long as its slowest
+server, and a server which doesn't answer only shows up as a timeout in the results.
+Requests follow the rules of transport.py: the same connect timeout, retries with backoff, where requests which change
+something are only retried if they were never sent, the same timings, and they are made for the same user. They always
+go over TCP, since the servers of a fleet are on other hosts. A server which replies busy is tried again like any
+other failed attempt.
+"""
+
+import ast
+import asyncio
+import configparser
+import time
+import transport
+
+
+def load_servers(settings_path, servers=None):
+    """
+    Returns the servers of the fleet, which are either given, listed under [FLEET] in settings.ini, or else the one
+    server under [SERVER].
+    :param settings_path: Where settings.ini is.
+    :type settings_path: str
+    :param servers: Servers as address:port separated by commas, or None to read them from settings.ini.
+    :type servers: str
+    :return: servers (list of tuple)
+    """
+    if servers is None:
+        config = configparser.ConfigParser()
+        config.read(settings_path)
+        if config.has_section("FLEET"):
+            servers = config["FLEET"]["Servers"]
+        else:
+            servers = config["SERVER"]["Address"] + ":" + config["SERVER"]["Port"]
+
+    fleet = []
+    for server in servers.replace("\n", ",").split(","):
+        if server.strip() != "":
+            address, separator, port = server.strip().rpartition(":")
+            fleet.append((address, int(port)))
+
+    return fleet
+
+
+def run_command(servers, command, timeout=None):
+    """
+    Sends the command to every server concurrently, and waits for all of them to answer or time out.
+    :param servers: The servers, as (address, port).
+    :type servers: list of tuple
+    :param command: The command to send.
+    :type command: str
+    :param timeout: How many seconds each server gets to answer each attempt, or None for the read timeout of the
+    transport.
+    :type timeout: float
+    :return: results (list of tuple), each holding server (tuple), reply (str) or None, error (str) or None,
+    seconds (float)
+    """
+    if timeout is None:
+        timeout = transport.read_timeout
+
+    async def run_all():
+        return await asyncio.gather(*[run_on_server(server, command, timeout) for server in servers])
+
+    return asyncio.run(run_all())
+
+
+async def run_on_server(server, command, timeout):
+    """
+    Sends the command to one server and reads its reply until the server closes the connection. Failed attempts are
+    tried again like transport.request does.
+    :param server: The server, as (address, port).
+    :type server: tuple
+    :param command: The command to send.
+    :type command: str
+    :param timeout: How many seconds the server gets to answer each attempt.
+    :type timeout: float
+    :return: server (tuple), reply (str) or None, error (str) or None, seconds (float)
+    """
+    command_name, repeatable, message = transport.prepare_request(command)
+
+    start = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        sent = False
+        try:
+            attempt_start = time.perf_counter()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*server),
+                                                    min(transport.connect_timeout, timeout))
+            connected = time.perf_counter()
+
+            try:
+                writer.write(message)
+                await writer.drain()
+                sent = True
+
+                reply, first_reply = await asyncio.wait_for(read_reply(reader), timeout)
+            finally:
+                writer.close()
+
+        except (asyncio.TimeoutError, OSError) as error:
+            if attempts > transport.retries or (sent and not repeatable):
+                return server, None, describe_error(error), time.perf_counter() - start
+
+            await asyncio.sleep(transport.backoff_seconds(attempts))
+            continue
+
+        # A busy server turned the request away without reading it, so it can always be tried again
+        if reply == transport.BUSY_REPLY:
+            if attempts > transport.retries:
+                return server, None, "busy", time.perf_counter() - start
+
+            await asyncio.sleep(transport.backoff_seconds(attempts))
+            continue
+
+        if transport.timings_enabled:
+            transport.record_timing(command_name, "tcp", connected - attempt_start, first_reply - connected, attempts)
+
+        if reply == transport.UNKNOWN_USER_REPLY and transport.user_name is not None:
+            return server, None, "unknown user", time.perf_counter() - start
+
+        return server, reply.decode("utf-8"), None, time.perf_counter() - start
+
+
+async def read_reply(reader):
+    """
+    Reads the reply of the server, which lasts until the connection closes.
+    :param reader: The reader of the connection.
+    :type reader: asyncio.StreamReader
+    :return: reply (bytes), first_reply (float), which is when the reply started, or the connection closed
+    """
+    reply = b""
+    chunk = await reader.read(4096)
+    first_reply = time.perf_counter()
+    while chunk:
+        reply += chunk
+        chunk = await reader.read(4096)
+
+    return reply, first_reply
+
+
+def describe_error(error):
+    """
+    Returns a short description of a failed attempt.
+    :param error: The error.
+    :type error: asyncio.TimeoutError or OSError
+    :return: description (str)
+    """
+    # Before Python 3.11, asyncio.TimeoutError is not an OSError
+    if isinstance(error, asyncio.TimeoutError):
+        return "timed out"
+
+    return transport.describe_error(error)
+
+
+def display_status_results(results):
+    """
+    Shows the status of every server in one table.
+    :param results: The results of run_command with the get_status command.
+    :type results: list of tuple
+    :return: None
+    """
+    print(f"{'Server':<24}{'Result':<20}{'Alarm':>6}{'Active':>7}{'Wakeup':>8}{'Window':>8}  {'Repeat':<10}"
+          f"{'Time zone':<20}{'Time':>9}")
+    for server, reply, error, seconds in results:
+        name = f"{server[0]}:{server[1]}"
+        if error is not None:
+            print(f"{name:<24}{error[:19]:<20}{'':>6}{'':>7}{'':>8}{'':>8}  {'':<10}{'':<20}{seconds * 1000:>7.0f}ms")
+            continue
+
+        status = ast.literal_eval(reply)
+        user_preferences = status["user_preferences"]
+        wakeup_time = f"{user_preferences['wakeup_time_hour']:02}:{user_preferences['wakeup_time_minute']:02}"
+        time_zone = user_preferences.get("time_zone") or f"UTC{user_preferences['utc_offset']:+}"
+        print(f"{name:<24}{'ok':<20}{status['alarm_state']:>6}{user_preferences['active_state']:>7}"
+              f"{wakeup_time:>8}{user_preferences['wakeup_window']:>8}  "
+              f"{str(user_preferences.get('recurrence', 'once')):<10}{time_zone:<20}{seconds * 1000:>7.0f}ms")
+
+
+def display_set_results(results):
+    """
+    Shows whether every server stored the change, in one table.
+    :param results: The results of run_command with the set_user_preferences command.
+    :type results: list of tuple
+    :return: None
+    """
+    print(f"{'Server':<24}{'Result':<48}{'Time':>9}")
+    for server, reply, error, seconds in results:
+        if error is None and reply != "ok":
+            error = "refused: " + reply.partition(" ")[2]
+        print(f"{server[0] + ':' + str(server[1]):<24}{error or 'ok':<48}{seconds * 1000:>7.0f}ms")
+
+
+def count_failures(results, command):
+    """
+    Counts the servers which didn't answer, or refused the command.
+    :param results: The results of run_command.
+    :type results: list of tuple
+    :param command: The command which was sent.
+    :type command: str
+    :return: failures (int)
+    """
+    failures = 0
+    for server, reply, error, seconds in results:
+        if error is not None or (command.startswith("set_") and reply != "ok"):
+            failures += 1
+
+    return failures
@@ -0,0 +1,216 @@
+"""
+File: gui.py
+
+This module holds the awake test GUI. It is only imported once the awake test is needed, since tkinter, numpy and
+pyautogui take a long time to import.
+Drawing and running the test are profiled when profiling is on, see common/profiling.py.
+"""
+
+import time
+import tkinter
+import numpy as np
+import pyautogui
+import profiling
+import trajectory
+from challenge import LINE_THICKNESS, DIRECTION_EAST, DIRECTION_WEST, DIRECTION_SOUTH, DIRECTION_NORTH, \
+    generate_challenge, take_challenge, test_step
+
+WINDOW_TITLE_MARGIN = 33
+
+
+"""
+########################################################################################################################
+                                                        AWAKE TEST
+########################################################################################################################
+"""
+
+
+def awake_test(window_height, window_width, seed=None):
+    """
+    Gives the user challenges until one is overcome, in which case we assume the user is awake enough to not fall back
+    to sleep.
+    :param window_height: How many pixels high the GUI should be.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI should be.
+    :type window_width: int
+    :param seed: Reproduces the challenge with this seed. If None, a pre-generated challenge is taken from the pool.
+    :type seed: int
+    :return: failed_attempts (int), trace (dict)
+    """
+    # Get a challenge before opening the GUI
+    if seed is None:
+        challenge = take_challenge(window_height, window_width)
+    else:
+        challenge = generate_challenge(seed, window_height, window_width)
+
+    # Create GUI
+    window, canvas = create_awake_test_gui(window_height, window_width)
+
+    # Create test
+    create_test(canvas, challenge)
+
+    # Run tests
+    return pass_test(canvas, challenge)
+
+
+def pass_test(canvas, challenge):
+    """
+    Runs the test drawn onto the canvas until the user passes it, while recording the mouse pointer.
+    :param canvas: The GUI in which the test is drawn onto.
+    :type canvas: tkinter.Canvas
+    :param challenge: The challenge which is drawn onto the canvas.
+    :type challenge: tuple
+    :return: failed_attempts (int), trace (dict)
+    """
+    seed, start_block, end_block, lines = challenge
+    start = np.array(start_block[:2])
+    goal = ((end_block[0] + end_block[2]) // 2, (end_block[1] + end_block[3]) // 2)
+    # Record which challenge it is, so that a replay can generate it again
+    trace = trajectory.create_trace(start, goal, seed=seed,
+                                    window_size=(int(canvas["height"]), int(canvas["width"])))
+
+    failed_attempts = 0
+    awake = tkinter.BooleanVar(canvas, False, "awake")
+    while not awake.get():
+        success, failed_run_attempts = run_test(canvas, challenge, trace)
+        failed_attempts += failed_run_attempts
+        awake.set(success)
+
+    print("Congratulations. You passed the test!")
+
+    return failed_attempts, trace
+
+
+def create_awake_test_gui(window_height, window_width):
+    """
+    Creates the GUI
+    :param window_height: How many pixels high the GUI should be.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI should be.
+    :type window_width: int
+    :return: window (tkinter.Tk), canvas (tkinter.Canvas)
+    """
+    # Sets minimum window height
+    if window_height < 36:
+        window_height = 36
+    # Sets minimum window width
+    if window_width < 36:
+        window_width = 36
+
+    # Creating the main window
+    window = tkinter.Tk()
+    window.geometry(str(window_width) + "x" + str(window_height) + "+0+0")
+    window.minsize(height=window_height, width=window_width)
+    window.title("Wakey Wakey - Awake test")
+
+    # The canvas that the cells are drawn onto
+    canvas = tkinter.Canvas(window, height=window_height, width=window_width, bg="white")
+
+    canvas.grid(row=0, column=0)
+    canvas.update()
+
+    return window, canvas
+
+
+@profiling.profiled("create_test")
+def create_test(canvas, challenge):
+    """
+    Fills the canvas with a graphical test, and a success condition.
+    :param canvas: The GUI in which the test is drawn onto.
+    :type canvas: tkinter.Canvas
+    :param challenge: The challenge to draw, as made by challenge.generate_challenge.
+    :type challenge: tuple
+    :return: start (np.array), east_lines (list of tkinter.Canvas.create_rectangle),
+    west_lines (list of tkinter.Canvas.create_rectangle), south_lines (list of tkinter.Canvas.create_rectangle),
+    north_lines (list of tkinter.Canvas.create_rectangle)
+    """
+    seed, start_block, end_block, lines = challenge
+    print(f"Challenge seed: {seed}")
+
+    # Create start and end
+    start = np.array(start_block[:2])
+    canvas.create_rectangle(*start_block, fill="green", outline="green")
+    canvas.create_rectangle(*end_block, fill="red", outline="red")
+
+    # Instantiate list for referencing lines by their direction
+    lines_by_direction = {DIRECTION_EAST: [], DIRECTION_WEST: [],
+                          DIRECTION_SOUTH: [], DIRECTION_NORTH: []}
+
+    # Draw the whole path at once
+    for direction, x0, y0, x1, y1 in lines:
+        lines_by_direction[direction].append(canvas.create_rectangle(x0, y0, x1, y1, fill="black"))
+    canvas.update()
+
+    return start, lines_by_direction[DIRECTION_EAST], \
+        lines_by_direction[DIRECTION_WEST], lines_by_direction[DIRECTION_SOUTH], \
+        lines_by_direction[DIRECTION_NORTH]
+
+
+@profiling.profiled("run_test")
+def run_test(canvas, challenge, trace):
+    """
+    Runs the awake test.
+    :param canvas: The GUI in which the test is drawn onto.
+    :type canvas: tkinter.Canvas
+    :param challenge: The challenge which is drawn onto the canvas.
+    :type challenge: tuple
+    :param trace: The trace which every mouse pointer sample is recorded into.
+    :type trace: dict
+    :return: success (boolean), failed_attempts (int)
+    """
+    start = challenge[1][:2]
+
+    # Place mouse pointer over start_block
+    pyautogui.moveTo(start[0] + LINE_THICKNESS // 2, start[1] + WINDOW_TITLE_MARGIN + LINE_THICKNESS // 2)
+
+    success = False
+    failed_attempts = 0
+
+    # While the mouse hasn't yet reached the goal
+    while not success:
+        canvas.update()
+
+        # Check mouse position
+        mouse_x, mouse_y = pyautogui.position()
+        mouse_y -= WINDOW_TITLE_MARGIN
+
+        # Check what the mouse position means for the test, and record it
+        event = test_step(challenge, mouse_x, mouse_y)
+        trajectory.record_sample(trace, time.monotonic(), mouse_x, mouse_y, event)
+
+        if event == trajectory.EVENT_WALL:
+            # Touching wall
+            print("You have touched the wall! Moving you back to start.")
+            failed_attempts += 1
+            pyautogui.moveTo(start[0] + LINE_THICKNESS // 2, start[1] + WINDOW_TITLE_MARGIN + LINE_THICKNESS // 2)
+            time.sleep(0.1)
+
+        # Check if in goal
+        elif event == trajectory.EVENT_GOAL:
+            # Reached goal
+            print("You have reached the goal!")
+            success = True
+
+        # To avoid huge system load
+        else:
+            time.sleep(0.1)
+
+    return success, failed_attempts
+
+
+def prepare_hidden_test(canvas, window_height, window_width):
+    """
+    Clears the canvas and draws a new test onto it while its window is hidden.
+    :param canvas: The GUI in which the test is drawn onto.
+    :type canvas: tkinter.Canvas
+    :param window_height: How many pixels high the GUI is.
+    :type window_height: int
+    :param window_width: How many pixels wide the GUI is.
+    :type window_width: int
+    :return: challenge (tuple)
+    """
+    canvas.delete("all")
+    challenge = take_challenge(window_height, window_width)
+    create_test(canvas, challenge)
+
+    return challenge
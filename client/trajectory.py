@@ -0,0 +1,139 @@
+"""
+File: trajectory.py
+
+This module records the mouse pointer during the awake test, and packs the recording into one compressed message for
+the server. The samples are kept in preallocated arrays used as a ring buffer, so recording never allocates.
+The format of the message is shared with the server, see common/trace_format.py.
+"""
+
+import array
+import sys
+import zlib
+import trace_format
+
+TRACE_CAPACITY = 16384
+# What happened at a sample, as in the shared format
+EVENT_MOVE = trace_format.EVENT_MOVE
+EVENT_WALL = trace_format.EVENT_WALL
+EVENT_GOAL = trace_format.EVENT_GOAL
+
+
+def create_trace(start, goal, capacity=TRACE_CAPACITY, seed=None, window_size=None):
+    """
+    Creates an empty trace. Once full, the oldest samples are overwritten.
+    :param start: The coordinates of the start position of the challenge.
+    :type start: np.array
+    :param goal: The coordinates of the center of the goal.
+    :type goal: tuple
+    :param capacity: How many samples the trace can hold.
+    :type capacity: int
+    :param seed: The seed of the challenge, so that a replay can generate it again, or None if unknown.
+    :type seed: int
+    :param window_size: The window height and width the challenge was generated for, or None if unknown.
+    :type window_size: tuple
+    :return: trace (dict)
+    """
+    return {"time": array.array("d", bytes(8 * capacity)),
+            "x": array.array("h", bytes(2 * capacity)),
+            "y": array.array("h", bytes(2 * capacity)),
+            "event": array.array("B", bytes(capacity)),
+            "count": 0,
+            "start": (int(start[0]), int(start[1])),
+            "goal": (int(goal[0]), int(goal[1])),
+            "seed": seed,
+            "window_size": window_size}
+
+
+def record_sample(trace, timestamp, x, y, event):
+    """
+    Records one pointer sample into the trace.
+    :param trace: The trace, as made by create_trace.
+    :type trace: dict
+    :param timestamp: When the sample was taken, in seconds.
+    :type timestamp: float
+    :param x: The x coordinate of the pointer.
+    :type x: int
+    :param y: The y coordinate of the pointer.
+    :type y: int
+    :param event: What happened at this sample, one of the EVENT constants.
+    :type event: int
+    :return: None
+    """
+    index = trace["count"] % len(trace["event"])
+    trace["time"][index] = timestamp
+    trace["x"][index] = max(-32768, min(32767, x))
+    trace["y"][index] = max(-32768, min(32767, y))
+    trace["event"][index] = event
+    trace["count"] += 1
+
+
+def trace_samples(trace):
+    """
+    Returns the samples which are still in the trace, oldest first.
+    :param trace: The trace, as made by create_trace.
+    :type trace: dict
+    :return: time (array.array), x (array.array), y (array.array), event (array.array)
+    """
+    capacity = len(trace["event"])
+    if trace["count"] <= capacity:
+        return tuple(trace[name][:trace["count"]] for name in ["time", "x", "y", "event"])
+
+    # The ring buffer has wrapped around, so the oldest sample is right after the newest
+    oldest = trace["count"] % capacity
+    return tuple(trace[name][oldest:] + trace[name][:oldest] for name in ["time", "x", "y", "event"])
+
+
+def encode_trace(trace):
+    """
+    Packs the trace into one compressed message. Times are stored as 32 bit floats relative to the first sample,
+    coordinates as 16 bit integers and events as bytes, all little endian.
+    :param trace: The trace, as made by create_trace.
+    :type trace: dict
+    :return: data (bytes)
+    """
+    timestamps, x, y, event = trace_samples(trace)
+
+    # Make the times relative to the first sample
+    first_timestamp = timestamps[0] if len(timestamps) > 0 else 0
+    relative_times = array.array("f", [timestamp - first_timestamp for timestamp in timestamps])
+
+    # The arrays are in the byte order of this machine
+    if sys.byteorder == "big":
+        for samples in [relative_times, x, y]:
+            samples.byteswap()
+
+    data = trace_format.pack_header(len(event), trace["start"], trace["goal"], trace["seed"], trace["window_size"])
+    data += relative_times.tobytes() + x.tobytes() + y.tobytes() + event.tobytes()
+
+    return zlib.compress(data)
+
+
+def decode_trace(data):
+    """
+    Unpacks a message made by encode_trace back into a trace, which is exactly full. Times stay relative to the first
+    sample. Every array is read from the message in one step, without going through the samples in python.
+    :param data: The compressed trace.
+    :type data: bytes
+    :return: trace (dict)
+    """
+    data = zlib.decompress(data)
+    offset, count, start, goal, seed, window_size = trace_format.unpack_header(data)
+
+    # An empty trace still holds room for one sample
+    if count == 0:
+        return create_trace(start, goal, 1, seed, window_size)
+
+    # The arrays follow each other right after the header
+    relative_times, x, y, event = array.array("f"), array.array("h"), array.array("h"), array.array("B")
+    view = memoryview(data)
+    for samples in [relative_times, x, y, event]:
+        samples.frombytes(view[offset:offset + count * samples.itemsize])
+        offset += count * samples.itemsize
+
+    # The arrays are in little endian
+    if sys.byteorder == "big":
+        for samples in [relative_times, x, y]:
+            samples.byteswap()
+
+    return {"time": array.array("d", relative_times), "x": x, "y": y, "event": event, "count": count,
+            "start": start, "goal": goal, "seed": seed, "window_size": window_size}
@@ -0,0 +1,272 @@
+"""
+File: transport.py
+
+This module sends every request of the client to the server. Connecting and waiting for replies have timeouts, so a
+slow or missing server can't hang the client, and failed attempts are retried a few times after a random backoff.
+Requests which change something are only retried if they failed before being sent, so they are never applied twice.
+If a Unix domain socket is set and the server address is a loopback address or empty, requests go through the socket
+instead of TCP, since a server elsewhere can't be reached through it.
+A server which is too busy replies busy without reading the request, so such a request is always tried again.
+Once a user is set, every request is made for that user instead of the default user of the server.
+
+With timings enabled, the connect time and round trip time of every request is printed to stderr.
+"""
+
+import ipaddress
+import os
+import random
+import socket
+import sys
+import time
+
+CONNECT_TIMEOUT_SECONDS = 2
+READ_TIMEOUT_SECONDS = 5
+RETRIES = 2
+BACKOFF_SECONDS = 0.2
+MAX_BACKOFF_SECONDS = 2
+BUSY_REPLY = b"busy"
+UNKNOWN_USER_REPLY = b"error unknown user"
+
+# Settings of the transport, which can be changed by configure
+connect_timeout = CONNECT_TIMEOUT_SECONDS
+read_timeout = READ_TIMEOUT_SECONDS
+retries = RETRIES
+unix_socket_path = None
+user_name = None
+
+# Measurements of every request, which are only kept with timings enabled
+timings_enabled = False
+timings = []
+
+
+class ServerUnreachable(ConnectionError):
+    """
+    Raised when a request could not be completed within its attempts.
+    """
+
+
+class ServerBusy(ConnectionError):
+    """
+    Raised for an attempt which the server turned away without reading it.
+    """
+
+
+class UnknownUser(LookupError):
+    """
+    Raised when the server doesn't know the user requests are made for.
+    """
+
+
+def configure(new_connect_timeout, new_read_timeout, new_retries, new_unix_socket_path=None):
+    """
+    Changes the timeouts, the amount of retries and the Unix domain socket of every request from now on.
+    :param new_connect_timeout: How many seconds connecting may take.
+    :type new_connect_timeout: float
+    :param new_read_timeout: How many seconds the server may take to reply.
+    :type new_read_timeout: float
+    :param new_retries: How many times a failed request is tried again.
+    :type new_retries: int
+    :param new_unix_socket_path: The Unix domain socket of the server, or None to only use TCP.
+    :type new_unix_socket_path: str
+    :return: None
+    """
+    global connect_timeout, read_timeout, retries, unix_socket_path
+
+    connect_timeout = new_connect_timeout
+    read_timeout = new_read_timeout
+    retries = new_retries
+    unix_socket_path = new_unix_socket_path
+
+
+def set_user(new_user_name):
+    """
+    Makes every request from now on for the given user, instead of the default user of the server.
+    :param new_user_name: The name of the user, or None for the default user.
+    :type new_user_name: str
+    :return: None
+    """
+    global user_name
+
+    user_name = new_user_name
+
+
+def enable_timings():
+    """
+    Starts measuring every request, and printing the measurements to stderr.
+    :return: None
+    """
+    global timings_enabled
+
+    timings_enabled = True
+
+
+def request(server_address, server_port, message):
+    """
+    Sends a message to the server and returns the reply, which lasts until the server closes the connection.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :param message: The command, and anything sent after it.
+    :type message: str or bytes
+    :return: reply (bytes), which is empty for commands the server doesn't answer
+    """
+    command, repeatable, message = prepare_request(message)
+
+    attempts = 0
+    while True:
+        attempts += 1
+        sent = False
+        try:
+            start = time.perf_counter()
+            connection, transport_name = connect(server_address, server_port)
+            connected = time.perf_counter()
+
+            try:
+                connection.settimeout(read_timeout)
+                connection.sendall(message)
+                sent = True
+
+                # Receive until the server closes the connection, which also tells if the server was busy
+                reply = b""
+                chunk = connection.recv(4096)
+                first_reply = time.perf_counter()
+                while chunk:
+                    reply += chunk
+                    chunk = connection.recv(4096)
+                if reply == BUSY_REPLY:
+                    raise ServerBusy(f"{server_address}:{server_port} is busy")
+                if reply == UNKNOWN_USER_REPLY and user_name is not None:
+                    raise UnknownUser(f"{server_address}:{server_port} has no user named {user_name}")
+            finally:
+                connection.close()
+
+        except ServerBusy as error:
+            if attempts > retries:
+                raise ServerUnreachable(f"{server_address}:{server_port} was busy for {attempts} attempts of "
+                                        f"{command}") from error
+
+            time.sleep(backoff_seconds(attempts))
+            continue
+
+        except OSError as error:
+            if attempts > retries or (sent and not repeatable):
+                raise ServerUnreachable(f"{server_address}:{server_port} did not complete {command} after {attempts} "
+                                        f"attempts: {describe_error(error)}") from error
+
+            time.sleep(backoff_seconds(attempts))
+            continue
+
+        if timings_enabled:
+            record_timing(command, transport_name, connected - start, first_reply - connected, attempts)
+
+        return reply
+
+
+def prepare_request(message):
+    """
+    Returns the command of a message, whether it may be tried again once it was sent, and the message as it is sent.
+    :param message: The command, and anything sent after it.
+    :type message: str or bytes
+    :return: command (str), repeatable (bool), message (bytes)
+    """
+    if isinstance(message, str):
+        message = bytes(message, "utf-8")
+    command = message.split(b"\n")[0].split(b" ")[0].decode("utf-8")
+
+    # Reading requests can always be tried again, others only if they were never sent
+    repeatable = command.startswith("get_")
+
+    # Name the user the request is for
+    if user_name is not None:
+        message = bytes(f"user={user_name} ", "utf-8") + message
+
+    return command, repeatable, message
+
+
+def is_local_address(server_address):
+    """
+    Returns whether the server address is empty or names this host, for which the Unix domain socket may be used.
+    Host names other than localhost are not looked up, and count as another host.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :return: local (bool)
+    """
+    if not server_address or server_address.lower() == "localhost":
+        return True
+
+    try:
+        return ipaddress.ip_address(server_address).is_loopback
+    except ValueError:
+        return False
+
+
+def connect(server_address, server_port):
+    """
+    Connects to the server through the Unix domain socket if it is set and exists and the server is on this host, and
+    through TCP otherwise.
+    :param server_address: The IP address of the server.
+    :type server_address: str
+    :param server_port: The port number of the server.
+    :type server_port: str
+    :return: connection (socket.socket), transport_name (str)
+    """
+    if unix_socket_path and hasattr(socket, "AF_UNIX") and is_local_address(server_address) \
+            and os.path.exists(unix_socket_path):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(connect_timeout)
+        try:
+            connection.connect(unix_socket_path)
+            return connection, "unix"
+        except OSError:
+            # The socket is left behind by a server which isn't running, so try TCP
+            connection.close()
+
+    return socket.create_connection((server_address, int(server_port)), timeout=connect_timeout), "tcp"
+
+
+def backoff_seconds(attempts):
+    """
+    Returns how long to wait before trying again, which grows with every attempt and is spread out randomly so that
+    many clients don't retry at the same time.
+    :param attempts: How many attempts have failed.
+    :type attempts: int
+    :return: seconds (float)
+    """
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+
+def describe_error(error):
+    """
+    Returns a short description of a connection error.
+    :param error: The error.
+    :type error: OSError
+    :return: description (str)
+    """
+    if isinstance(error, socket.timeout):
+        return "timed out"
+    if error.errno is not None:
+        return os.strerror(error.errno)
+
+    return str(error)
+
+
+def record_timing(command, transport_name, connect_seconds, round_trip_seconds, attempts):
+    """
+    Keeps the measurements of a request, and prints them to stderr.
+    :param command: The command of the request.
+    :type command: str
+    :param transport_name: Which transport the request went through, unix or tcp.
+    :type transport_name: str
+    :param connect_seconds: How long connecting took.
+    :type connect_seconds: float
+    :param round_trip_seconds: How long from sending until the reply started, or the connection closed.
+    :type round_trip_seconds: float
+    :param attempts: How many attempts the request took.
+    :type attempts: int
+    :return: None
+    """
+    timings.append((command, transport_name, connect_seconds, round_trip_seconds, attempts))
+
+    print(f"{command} over {transport_name}: connect {connect_seconds * 1000:.1f} ms, round trip "
+          f"{round_trip_seconds * 1000:.1f} ms, {attempts} attempts", file=sys.stderr)
@@ -0,0 +1,261 @@
+"""
+File: profiling.py
+
+This module profiles the hot paths of the program when asked to, and costs next to nothing otherwise.
+Functions marked with profiled are run under cProfile while profiling is on, and their stats are added up per name.
+Meanwhile tracemalloc records where memory is allocated. Every DUMP_INTERVAL_SECONDS, and when profiling is turned off
+or the program exits, the stats of every name are written to <directory>/<name>-<pid>.prof, which can be read with
+pstats or snakeviz, and the largest allocations to <directory>/memory-<pid>.txt.
+
+Profiling is turned on at startup by setting WAKEYWAKEY_PROFILE to a directory, or with --profile to use the default
+directory. Once share_between_processes is called, the switch is shared with every process forked afterwards, so a
+command received by one process can turn profiling on or off in all of them.
+
+cProfile, pstats and tracemalloc are only imported once profiling starts, so that this module doesn't slow down startup.
+
+The client and the server share this module, which is why it lives in common/, where both add it to their path.
+"""
+
+import atexit
+import functools
+import os
+import sys
+import threading
+import time
+import types
+
+PROFILE_ENVIRONMENT_VARIABLE = "WAKEYWAKEY_PROFILE"
+PROFILE_FLAG = "--profile"
+DUMP_INTERVAL_SECONDS = 60
+TRACEMALLOC_FRAMES = 5
+TOP_ALLOCATIONS = 25
+
+# Whether profiling is on, which is only shared with other processes after share_between_processes
+switch = types.SimpleNamespace(value=0)
+directory = None
+
+# State of the profiling of this process
+profiling_pid = None
+profiling_lock = threading.Lock()
+collected_stats = {}
+active_profiles = threading.local()
+
+
+def enable_from_command_line(default_directory):
+    """
+    Turns profiling on if WAKEYWAKEY_PROFILE is set, or if --profile was given, which is then removed from sys.argv.
+    :param default_directory: Where to write the dumps if --profile was given.
+    :type default_directory: str
+    :return: None
+    """
+    global directory
+
+    directory = default_directory
+    if PROFILE_FLAG in sys.argv[1:]:
+        sys.argv.remove(PROFILE_FLAG)
+        enable()
+    if os.environ.get(PROFILE_ENVIRONMENT_VARIABLE):
+        directory = os.environ[PROFILE_ENVIRONMENT_VARIABLE]
+        enable()
+
+
+def share_between_processes():
+    """
+    Makes the switch shared with every process forked from now on, so that any of them can turn profiling on or off
+    in all of them.
+    :return: None
+    """
+    global switch
+
+    import multiprocessing
+
+    switch = multiprocessing.RawValue("b", switch.value)
+
+
+def enable():
+    """
+    Turns profiling on in every process sharing the switch. Each process starts profiling on its next profiled call.
+    :return: None
+    """
+    switch.value = 1
+
+
+def disable():
+    """
+    Turns profiling off in every process sharing the switch. Each process writes its last dump within
+    DUMP_INTERVAL_SECONDS.
+    :return: None
+    """
+    switch.value = 0
+
+
+def is_enabled():
+    """
+    Returns whether profiling is on.
+    :return: enabled (bool)
+    """
+    return bool(switch.value)
+
+
+def profiled(name):
+    """
+    Marks a function to be profiled under the given name while profiling is on.
+    :param name: The name its stats are added up and dumped under.
+    :type name: str
+    :return: decorator (callable)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not switch.value:
+                return function(*args, **kwargs)
+
+            return run_profiled(name, function, args, kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_profiled(name, function, args, kwargs):
+    """
+    Runs a function under cProfile and adds its stats to those of its name. A profiled function called by another has
+    its time counted under its own name only, so the profile of the caller is paused meanwhile.
+    :param name: The name the stats are added to.
+    :type name: str
+    :param function: The function to run.
+    :type function: callable
+    :param args: The positional arguments of the function.
+    :type args: tuple
+    :param kwargs: The keyword arguments of the function.
+    :type kwargs: dict
+    :return: result (any), whatever the function returns
+    """
+    import cProfile
+
+    start_in_this_process()
+
+    # Pause the profile of the caller, if any
+    stack = getattr(active_profiles, "stack", None)
+    if stack is None:
+        stack = active_profiles.stack = []
+    if stack:
+        stack[-1].disable()
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Another profiler is already running, which some Python versions only allow one of per process
+        profile = None
+
+    try:
+        if profile is None:
+            return function(*args, **kwargs)
+
+        stack.append(profile)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            stack.pop()
+            add_stats(name, profile)
+    finally:
+        if stack:
+            stack[-1].enable()
+
+
+def add_stats(name, profile):
+    """
+    Adds the stats of a finished profile to those of its name.
+    :param name: The name the stats are added to.
+    :type name: str
+    :param profile: The finished profile.
+    :type profile: cProfile.Profile
+    :return: None
+    """
+    import pstats
+
+    with profiling_lock:
+        if name in collected_stats:
+            collected_stats[name].add(profile)
+        else:
+            collected_stats[name] = pstats.Stats(profile)
+
+
+def start_in_this_process():
+    """
+    Starts tracemalloc and the periodic dumps in this process, unless they already run. A process forked from one
+    which was profiling starts over with its own stats.
+    :return: None
+    """
+    global profiling_pid, collected_stats
+
+    import tracemalloc
+
+    if profiling_pid == os.getpid():
+        return
+
+    with profiling_lock:
+        if profiling_pid == os.getpid():
+            return
+
+        profiling_pid = os.getpid()
+        collected_stats = {}
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        threading.Thread(target=dump_periodically, daemon=True).start()
+
+
+def dump_periodically():
+    """
+    Dumps every DUMP_INTERVAL_SECONDS while profiling is on, then dumps once more and stops tracemalloc.
+    :return: None
+    """
+    global profiling_pid
+
+    import tracemalloc
+
+    while switch.value:
+        time.sleep(DUMP_INTERVAL_SECONDS)
+        dump()
+
+    with profiling_lock:
+        profiling_pid = None
+        tracemalloc.stop()
+
+
+def dump():
+    """
+    Writes the stats of every name, and the largest allocations, of this process.
+    :return: None
+    """
+    if profiling_pid != os.getpid():
+        return
+
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    os.makedirs(directory, exist_ok=True)
+    pid = os.getpid()
+
+    with profiling_lock:
+        for name, stats in collected_stats.items():
+            stats.dump_stats(os.path.join(directory, f"{name}-{pid}.prof"))
+
+        if not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+
+    # Sum up the allocations by line, leaving out those of the profiling itself
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, module.__file__)
+                                       for module in [tracemalloc, cProfile, pstats, sys.modules[__name__]]])
+    current, peak = tracemalloc.get_traced_memory()
+    with open(os.path.join(directory, f"memory-{pid}.txt"), "w") as memory_file:
+        memory_file.write(f"Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB\n")
+        for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+            memory_file.write(f"{statistic}\n")
+
+
+# Write whatever was collected when the program exits
+atexit.register(dump)
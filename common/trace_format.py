@@ -0,0 +1,82 @@
+"""
+File: trace_format.py
+
+This module holds the format of the mouse pointer traces the client records during the awake test and uploads to the
+server. A trace is compressed with zlib, and starts with a header holding the magic bytes, the version, the amount of
+samples, the coordinates of the start and the goal, and the seed and window size of the challenge, from which the
+challenge can be generated again. The times follow as 32 bit floats, then the x and the y coordinates as 16 bit
+integers and then the events as bytes, every array after the other and all little endian.
+Traces of version 1, from before the seed and window size were added, can still be read.
+
+The client and the server share this module, which is why it lives in common/, where both add it to their path.
+"""
+
+import struct
+
+TRACE_MAGIC = b"WWTR"
+TRACE_VERSION = 2
+# Header of every version, where the magic bytes and the version always come first
+TRACE_HEADER_FORMATS = {1: "<4sBIhhhh", 2: "<4sBIhhhhIHH"}
+TRACE_HEADER_FORMAT = TRACE_HEADER_FORMATS[TRACE_VERSION]
+VERSION_FORMAT = "<4sB"
+# Bytes of one sample, across the time, x, y and event arrays
+SAMPLE_SIZE = 4 + 2 + 2 + 1
+EVENT_MOVE = 0
+EVENT_WALL = 1
+EVENT_GOAL = 2
+
+
+def pack_header(count, start, goal, seed, window_size):
+    """
+    Packs the header of a trace.
+    :param count: How many samples follow the header.
+    :type count: int
+    :param start: The coordinates of the start position of the challenge.
+    :type start: tuple
+    :param goal: The coordinates of the center of the goal.
+    :type goal: tuple
+    :param seed: The seed of the challenge, which fits in 32 bits like in the challenge pool, or None if unknown.
+    :type seed: int
+    :param window_size: The window height and width the challenge was generated for, or None if unknown.
+    :type window_size: tuple
+    :return: header (bytes)
+    """
+    # An unknown challenge is stored as a window of 0x0
+    if seed is None or window_size is None:
+        seed, window_size = 0, (0, 0)
+
+    return struct.pack(TRACE_HEADER_FORMAT, TRACE_MAGIC, TRACE_VERSION, count, *start, *goal, seed & 0xFFFFFFFF,
+                       *window_size)
+
+
+def unpack_header(data):
+    """
+    Unpacks the header of an inflated trace, and checks that the samples it announces follow it.
+    :param data: The inflated trace.
+    :type data: bytes
+    :return: header_size (int), count (int), start (tuple), goal (tuple), seed (int) or None,
+    window_size (tuple) or None
+    """
+    if len(data) < struct.calcsize(VERSION_FORMAT):
+        raise ValueError("Trace is truncated.")
+
+    magic, version = struct.unpack_from(VERSION_FORMAT, data)
+    if magic != TRACE_MAGIC or version not in TRACE_HEADER_FORMATS:
+        raise ValueError("Unknown trace format.")
+
+    header_format = TRACE_HEADER_FORMATS[version]
+    header_size = struct.calcsize(header_format)
+    if len(data) < header_size:
+        raise ValueError("Trace is truncated.")
+
+    header = struct.unpack_from(header_format, data)
+    count, start, goal = header[2], header[3:5], header[5:7]
+    if len(data) != header_size + count * SAMPLE_SIZE:
+        raise ValueError("Trace is truncated.")
+
+    # Version 1 has no challenge, and a window of 0x0 means it is unknown
+    seed, window_size = None, None
+    if version >= 2 and header[8:10] != (0, 0):
+        seed, window_size = header[7], header[8:10]
+
+    return header_size, count, start, goal, seed, window_size
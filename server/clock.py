@@ -0,0 +1,119 @@
+"""
+File: clock.py
+
+This module is the only place the server gets the time from, and the only place it sleeps.
+By default it uses the real clock. A simulation can switch it to a simulated clock, where sleeping returns right away
+after moving the time forward, so that days of scheduling can be run in seconds.
+"""
+
+import heapq
+import itertools
+import time
+
+# State of the simulated clock, which is only used when simulated_time is not None
+simulated_time = None
+scheduled_calls = []
+scheduled_call_order = itertools.count()
+sleeps = 0
+
+
+def now():
+    """
+    Returns the current time in seconds since the epoch.
+    :return: timestamp (float)
+    """
+    if simulated_time is None:
+        return time.time()
+
+    return simulated_time
+
+
+def sleep(seconds):
+    """
+    Sleeps for the given amount of seconds, or not at all if it is negative. On the simulated clock, the time jumps
+    forward instead, and every call scheduled within the sleep is run at its own time on the way.
+    :param seconds: How long to sleep.
+    :type seconds: float
+    :return: None
+    """
+    global simulated_time, sleeps
+
+    seconds = max(seconds, 0)
+    if simulated_time is None:
+        time.sleep(seconds)
+        return
+
+    sleeps += 1
+    wakeup_time = simulated_time + seconds
+
+    # Run the scheduled calls in order
+    while len(scheduled_calls) > 0 and scheduled_calls[0][0] <= wakeup_time:
+        call_time, order, function = heapq.heappop(scheduled_calls)
+        simulated_time = max(simulated_time, call_time)
+        function()
+
+    simulated_time = wakeup_time
+
+
+def idle(seconds, seconds_until_deadline=None):
+    """
+    Sleeps between two checks of a loop which polls for something to happen. On the real clock, this simply sleeps
+    the given amount of seconds. On the simulated clock, nothing can happen before the given deadline or the next
+    scheduled call, so the time jumps straight to the earliest of them.
+    :param seconds: How long the loop normally sleeps between checks.
+    :type seconds: float
+    :param seconds_until_deadline: How long until the loop has something to do by itself, or None if never.
+    :type seconds_until_deadline: float
+    :return: None
+    """
+    if simulated_time is None:
+        sleep(seconds)
+        return
+
+    # Find the next moment anything can happen
+    candidates = []
+    if seconds_until_deadline is not None:
+        candidates.append(seconds_until_deadline)
+    if len(scheduled_calls) > 0:
+        candidates.append(scheduled_calls[0][0] - simulated_time)
+
+    if len(candidates) == 0:
+        sleep(seconds)
+    else:
+        sleep(max(seconds, min(candidates)))
+
+
+def use_simulated_clock(start_time):
+    """
+    Switches to the simulated clock, starting at the given time.
+    :param start_time: The time to start at, in seconds since the epoch.
+    :type start_time: float
+    :return: None
+    """
+    global simulated_time, scheduled_calls, sleeps
+
+    simulated_time = start_time
+    scheduled_calls = []
+    sleeps = 0
+
+
+def use_real_clock():
+    """
+    Switches back to the real clock.
+    :return: None
+    """
+    global simulated_time
+
+    simulated_time = None
+
+
+def call_at(timestamp, function):
+    """
+    Schedules a function to be called by the simulated clock once its time reaches the given timestamp.
+    :param timestamp: When to call the function, in seconds since the epoch.
+    :type timestamp: float
+    :param function: What to call, without arguments.
+    :type function: callable
+    :return: None
+    """
+    heapq.heappush(scheduled_calls, (timestamp, next(scheduled_call_order), function))
@@ -0,0 +1,264 @@
+"""
+File: http_gateway.py
+
+This module serves the state of the alarm as JSON over HTTP, for dashboards which poll it. Every route is a getter of
+the server, which is given the id of the user named by ?user=<name>, or of the default user without it, for example
+GET /status?user=alice
+
+Every response has an ETag, and a request with a matching If-None-Match is answered with 304 Not Modified and no body.
+Responses are cached for CACHE_SECONDS, and dropped at once when the server writes anything to the database, so that
+dashboards polling at the same time share one call of the getter, and never see a change late.
+
+The gateway has no authentication, so the server only starts it once http_port is set in server_settings. Every
+connection gets a thread of its own, at most MAX_CONNECTIONS at a time, and is closed once it is idle for
+CONNECTION_TIMEOUT_SECONDS, so that idle dashboards can't pile up threads.
+"""
+
+import hashlib
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import profiling
+
+CACHE_SECONDS = 1
+LISTEN_BACKLOG = 128
+MAX_CONNECTIONS = 16
+CONNECTION_TIMEOUT_SECONDS = 5
+JSON_CONTENT_TYPE = "application/json"
+BUSY_RESPONSE = (b"HTTP/1.1 503 Service Unavailable\r\nContent-Type: application/json\r\nContent-Length: 17\r\n"
+                 b"Retry-After: 1\r\nConnection: close\r\n\r\n{\"error\": \"busy\"}")
+
+# Set by serve: the getter of every path, how to find the id of a user by name, and the generation of the database,
+# which increases on every write
+routes = {}
+find_user = None
+get_generation = None
+
+# Responses by path and user id, with the generation they were made in and when they expire
+cached_responses = {}
+
+
+def serve(s, new_routes, new_find_user, new_get_generation):
+    """
+    Serves the routes on the given socket, with a thread per connection. Never returns.
+    :param s: The bound TCP socket.
+    :type s: socket.socket
+    :param new_routes: The getter of every path, which is given a user id and returns something JSON can encode.
+    :type new_routes: dict
+    :param new_find_user: Returns the id of a user by name, of the default user for None, or None if unknown.
+    :type new_find_user: callable
+    :param new_get_generation: Returns the generation of the database, which increases on every write.
+    :type new_get_generation: callable
+    :return: None
+    """
+    global routes, find_user, get_generation
+
+    routes = new_routes
+    find_user = new_find_user
+    get_generation = new_get_generation
+
+    # Serve on the socket the server bound, instead of binding a new one
+    gateway = GatewayServer(s.getsockname(), GatewayRequestHandler, bind_and_activate=False)
+    gateway.socket.close()
+    gateway.socket = s
+    gateway.server_activate()
+
+    print(f"Serving HTTP on {s.getsockname()}.")
+    gateway.serve_forever()
+
+
+class GatewayServer(http.server.ThreadingHTTPServer):
+    """
+    Serves every connection in a thread of its own while fewer than MAX_CONNECTIONS are served, and turns the others
+    away with 503 Service Unavailable.
+    """
+    request_queue_size = LISTEN_BACKLOG
+    daemon_threads = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+
+    def process_request(self, request, client_address):
+        """
+        Starts the thread of a connection, or turns it away if every slot is taken.
+        :param request: The socket of the connection.
+        :type request: socket.socket
+        :param client_address: The address of the client.
+        :type client_address: tuple
+        :return: None
+        """
+        if not self.connection_slots.acquire(blocking=False):
+            print(f"{client_address} HTTP: turned away, {MAX_CONNECTIONS} connections are being served")
+            try:
+                request.setblocking(False)
+                request.send(BUSY_RESPONSE)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+
+        super().process_request(request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        """
+        Serves a connection until it closes or times out, then frees its slot.
+        :param request: The socket of the connection.
+        :type request: socket.socket
+        :param client_address: The address of the client.
+        :type client_address: tuple
+        :return: None
+        """
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
+
+
+class GatewayRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers GET requests with the JSON of a route, or 304 Not Modified if the client already has it. Connections are
+    kept alive, so a dashboard polling often doesn't connect every time, until they are idle for
+    CONNECTION_TIMEOUT_SECONDS.
+    """
+    protocol_version = "HTTP/1.1"
+    timeout = CONNECTION_TIMEOUT_SECONDS
+
+    def do_GET(self):
+        """
+        Answers a GET request.
+        :return: None
+        """
+        handle_request(self)
+
+    def log_message(self, format, *args):
+        """
+        Prints every request like the rest of the server does, instead of to stderr.
+        :param format: The message, with a placeholder for every argument.
+        :type format: str
+        :param args: The arguments of the message.
+        :type args: any
+        :return: None
+        """
+        print(f"{self.client_address} HTTP: {format % args}")
+
+
+@profiling.profiled("http_gateway")
+def handle_request(handler):
+    """
+    Answers one GET request from the cache, or from the getter of its route.
+    :param handler: The handler of the request.
+    :type handler: GatewayRequestHandler
+    :return: None
+    """
+    url = urllib.parse.urlsplit(handler.path)
+    if url.path not in routes:
+        send_json(handler, 404, {"error": "not found"})
+        return
+
+    # The default user, unless another one is named
+    user_name = urllib.parse.parse_qs(url.query).get("user", [None])[0]
+    user_id = find_user(user_name)
+    if user_id is None:
+        send_json(handler, 404, {"error": "unknown user"})
+        return
+
+    try:
+        etag, body = cached_response(url.path, user_id)
+    except Exception as error:
+        print(f"Could not answer {handler.path}: {error!r}")
+        send_json(handler, 500, {"error": "internal error"})
+        return
+
+    # The client has this response already
+    if matches_etag(handler.headers.get("If-None-Match"), etag):
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+        return
+
+    send_body(handler, 200, body, etag)
+
+
+def cached_response(path, user_id):
+    """
+    Returns the ETag and body of a route for a user, from the cache unless it expired or the database was written to
+    since. Requests arriving at once may each make the response when it isn't cached, which is only wasted work.
+    :param path: The path of the route.
+    :type path: str
+    :param user_id: Whose response to return.
+    :type user_id: int
+    :return: etag (str), body (bytes)
+    """
+    # The generation is read before the getter runs, so a write in between makes the next request call it again
+    generation = get_generation()
+    now = time.monotonic()
+
+    cached = cached_responses.get((path, user_id))
+    if cached is not None and cached[0] == generation and cached[1] > now:
+        return cached[2], cached[3]
+
+    body = bytes(json.dumps(routes[path](user_id), sort_keys=True), "utf-8")
+    etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+    cached_responses[(path, user_id)] = (generation, now + CACHE_SECONDS, etag, body)
+
+    return etag, body
+
+
+def matches_etag(if_none_match, etag):
+    """
+    Tests if an If-None-Match header names the given ETag, or any ETag.
+    :param if_none_match: The value of the header, or None if it wasn't sent.
+    :type if_none_match: str
+    :param etag: The ETag of the response, in quotes.
+    :type etag: str
+    :return: matches (bool)
+    """
+    if if_none_match is None:
+        return False
+
+    # Weak validators are as good as strong ones for a GET
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+def send_json(handler, status, content):
+    """
+    Sends something encoded as JSON, without an ETag.
+    :param handler: The handler of the request.
+    :type handler: GatewayRequestHandler
+    :param status: The HTTP status code.
+    :type status: int
+    :param content: What to encode.
+    :type content: any
+    :return: None
+    """
+    send_body(handler, status, bytes(json.dumps(content), "utf-8"), None)
+
+
+def send_body(handler, status, body, etag):
+    """
+    Sends a JSON body with its length, so the connection can be kept alive.
+    :param handler: The handler of the request.
+    :type handler: GatewayRequestHandler
+    :param status: The HTTP status code.
+    :type status: int
+    :param body: The JSON.
+    :type body: bytes
+    :param etag: The ETag of the body, or None.
+    :type etag: str
+    :return: None
+    """
+    handler.send_response(status)
+    handler.send_header("Content-Type", JSON_CONTENT_TYPE)
+    handler.send_header("Content-Length", str(len(body)))
+    if etag is not None:
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", "no-cache")
+    handler.end_headers()
+    handler.wfile.write(body)
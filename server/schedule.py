@@ -0,0 +1,131 @@
+"""
+File: schedule.py
+
+This module handles the recurrence rules of the alarm, which decide on which days it goes off.
+A rule is either 'once', which goes off the next time the wakeup time comes and then turns itself off, or a set of
+weekdays, such as 'daily', 'weekdays', 'weekends' or a list of days like 'mon,wed,fri'. Single dates can be skipped.
+
+A rule is compiled once into a table holding, for every weekday, how many days there are until the next day the rule
+goes off. Together with the skip dates as day numbers, finding the next day is a lookup in that table.
+"""
+
+import datetime
+
+RULE_ONCE = "once"
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+NAMED_RULES = {"daily": 0b1111111, "weekdays": 0b0011111, "weekends": 0b1100000}
+SECONDS_IN_A_DAY = 86400
+# Day 0, 1970-01-01, was a thursday
+EPOCH_WEEKDAY = 3
+
+# Compiled rules, by recurrence and skip dates
+compiled_rules = {}
+
+
+def compile_rule(recurrence, skip_dates):
+    """
+    Returns the compiled rule, and compiles it first if it hasn't been yet.
+    :param recurrence: The recurrence rule, which isn't 'once'.
+    :type recurrence: str
+    :param skip_dates: Dates to skip, in the format YYYY-MM-DD separated by commas, or None.
+    :type skip_dates: str
+    :return: days_until_enabled (tuple of int), skip_day_numbers (frozenset of int)
+    """
+    compiled_rule = compiled_rules.get((recurrence, skip_dates))
+    if compiled_rule is None:
+        days = weekday_bitmap(recurrence)
+
+        # For every weekday, count the days until the rule goes off, including that same day
+        days_until_enabled = tuple(next(offset for offset in range(7) if days & 1 << (weekday + offset) % 7)
+                                   for weekday in range(7))
+
+        compiled_rule = days_until_enabled, frozenset(parse_skip_dates(skip_dates))
+        compiled_rules[(recurrence, skip_dates)] = compiled_rule
+
+    return compiled_rule
+
+
+def weekday_bitmap(recurrence):
+    """
+    Turns a recurrence rule into a bitmap of the weekdays it goes off on, where bit 0 is monday.
+    :param recurrence: The recurrence rule, which isn't 'once'.
+    :type recurrence: str
+    :return: days (int)
+    """
+    if recurrence in NAMED_RULES:
+        return NAMED_RULES[recurrence]
+
+    days = 0
+    for day_name in recurrence.split(","):
+        if day_name not in DAY_NAMES:
+            raise ValueError(f"Unknown day: {day_name}")
+        days |= 1 << DAY_NAMES.index(day_name)
+
+    return days
+
+
+def parse_skip_dates(skip_dates):
+    """
+    Turns the skip dates into day numbers, counted in days since 1970-01-01.
+    :param skip_dates: Dates to skip, in the format YYYY-MM-DD separated by commas, or None.
+    :type skip_dates: str
+    :return: skip_day_numbers (list of int)
+    """
+    if skip_dates is None:
+        return []
+
+    epoch = datetime.date(1970, 1, 1)
+
+    return [(datetime.date.fromisoformat(skip_date) - epoch).days for skip_date in skip_dates.split(",")]
+
+
+def is_valid_rule(recurrence):
+    """
+    Tests if the given recurrence rule can be compiled.
+    :param recurrence: The recurrence rule.
+    :type recurrence: str
+    :return: is_valid (bool)
+    """
+    if recurrence == RULE_ONCE:
+        return True
+
+    try:
+        return weekday_bitmap(recurrence) != 0
+    except ValueError:
+        return False
+
+
+def is_valid_skip_dates(skip_dates):
+    """
+    Tests if the given skip dates can be parsed.
+    :param skip_dates: Dates to skip, in the format YYYY-MM-DD separated by commas.
+    :type skip_dates: str
+    :return: is_valid (bool)
+    """
+    try:
+        parse_skip_dates(skip_dates)
+        return True
+    except ValueError:
+        return False
+
+
+def days_until_fire(recurrence, skip_dates, day_number):
+    """
+    Returns how many days there are from the given local day until the next day the rule goes off, which is 0 if it
+    goes off that same day.
+    :param recurrence: The recurrence rule, which isn't 'once'.
+    :type recurrence: str
+    :param skip_dates: Dates to skip, in the format YYYY-MM-DD separated by commas, or None.
+    :type skip_dates: str
+    :param day_number: The local day, counted in days since 1970-01-01.
+    :type day_number: int
+    :return: days (int)
+    """
+    days_until_enabled, skip_day_numbers = compile_rule(recurrence, skip_dates)
+
+    fire_day_number = day_number + days_until_enabled[(day_number + EPOCH_WEEKDAY) % 7]
+    while fire_day_number in skip_day_numbers:
+        fire_day_number += 1
+        fire_day_number += days_until_enabled[(fire_day_number + EPOCH_WEEKDAY) % 7]
+
+    return fire_day_number - day_number
@@ -3,20 +3,102 @@ File: server.py
 
 This program receives settings from the client (including wakeup time).
 It also starts the alarm on the given wakeup time, and waits for an awake signal from the client before stopping it.
+
+With --profile, or WAKEYWAKEY_PROFILE set to a directory, the main loop, the communication and the alarm mode are
+profiled, see common/profiling.py. The set_profiling command turns it on or off while the server runs.
 """
 
 import sqlite3
 import multiprocessing
 import socket
-import arrow
 import time
-import gpiozero
+import os
+import queue
+import re
+import selectors
+import threading
+import concurrent.futures
+import struct
+import sys
+import zlib
+import clock
+import schedule
+import server_setup
+import songs
+import time_zones
+
+# Shared with the client
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common"))
+import profiling  # noqa: E402
+import trace_metrics  # noqa: E402
 
 DATABASE_PATH = "server/db"
+DEFAULT_USER_ID = server_setup.DEFAULT_USER_ID
+USER_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,32}")
+# Commands for another user than the default one start with user=<name>
+USER_PREFIX = b"user="
+# Columns of user_preferences which aren't preferences themselves
+USER_PREFERENCES_HIDDEN_COLUMNS = ["id", "user_id", "preferences_revision", "preferences_changed_time"]
+PROFILE_DIRECTORY = "server/profiles"
 SECONDS_IN_A_DAY = 86400
+ROLLUP_DAYS = 14
+ROLLUP_WEEKS = 8
 MAIN_LOOP_DELAY_SECONDS = 5
+LISTEN_BACKLOG = 128
+# The admission limits below hold for each communication worker, which keeps its own slots and counts, so with
+# several workers the server serves up to that many times MAX_CONNECTIONS, and a client whose connections the kernel
+# spreads over every worker gets up to that many times RATE_LIMIT_PER_SECOND
+MAX_CONNECTIONS = 16
+# Extra connections only clients on this host may use, so idle connections from the network can't fill every slot
+RESERVED_LOCAL_CONNECTIONS = 4
+CLIENT_TIMEOUT_SECONDS = 5
+# Connections one client may have served at once, so that a host within its rate limit can't hold every slot with idle
+# connections
+MAX_CONNECTIONS_PER_CLIENT = 4
+RATE_LIMIT_PER_SECOND = 10
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_MAX_CLIENTS = 1024
+# Clients on this host are never rate limited, so that a flood from the network can't keep the alarm from being
+# turned off, and they may use more connections than MAX_CONNECTIONS_PER_CLIENT
+RATE_LIMIT_EXEMPT_HOSTS = ["127.0.0.1", "::1", "local client"]
+BUSY_REPLY = b"busy"
+ADMISSION_COUNTERS = ["accepted", "rate_limited", "over_client_capacity", "over_capacity"]
 BUZZER_PIN = 17
-SONG_LOSTWOODS = ["A3", "SILENT", "A4", "SILENT", "A5", "SILENT", "SILENT"]
+# How much of the song is played between two checks of whether the user is awake
+ALARM_CHECK_SECONDS = 1
+# A countdown whose alarm should have gone off longer ago than this when the server restarts is given up
+RESTORE_GRACE_SECONDS = 15 * 60
+GROUP_COMMIT_WINDOW_SECONDS = 0.01
+GROUP_COMMIT_MAX_WRITES = 100
+# Lowest and highest value of the integer user preferences which can be set by set_user_preferences
+USER_PREFERENCE_RANGES = {"active_state": (0, 1), "wakeup_time_hour": (0, 23), "wakeup_time_minute": (0, 59),
+                          "wakeup_window": (0, 1440), "utc_offset": (-12, 14)}
+
+# State of the database writer of this process
+db_writer_pid = None
+db_queue = None
+db_last_write = None
+db_writer_lock = threading.Lock()
+
+# How many connections were admitted and turned away, shared by the communication workers once initialize made it
+admission_counters = None
+
+# Connections being served per client by this communication worker, and the lock of the threads serving them
+client_connections = {}
+client_connections_lock = threading.Lock()
+
+# Preferences and ids of the users this process has read, with the generation they were read in. Whenever any
+# process changes them, it increases the generation, shared by every process forked after initialize made it, once
+# the change is committed, which makes every process read them again.
+preferences_generation = None
+user_preferences_cache = {}
+users_cache = (None, {})
+
+# Generation of the whole database, which every process increases on every commit, shared like the one above
+write_generation = None
+
+# Name, duration in seconds and milestone of every phase of the startup, in the order they ran
+startup_phases = []
 
 
 def main():
@@ -26,27 +108,82 @@ def main():
     the remaining amount of seconds before it eventually sounds the alarm. In that case, the alarm continues until
     the alarm_state in the database is set to 0 (which can normally only be done by completing the awake_test
     through the client.
+    An alarm which was counting down or ringing when the server stopped is gone on with first.
     :return: None
     """
+    # Profile the hot paths if asked to, where any process of the server can turn it on or off later
+    profiling.enable_from_command_line(PROFILE_DIRECTORY)
+    profiling.share_between_processes()
+
     # Initialization
-    buzzer = initialize()
+    buzzer, in_flight_alarm = initialize()
+
+    # Go on with the alarm the server stopped in the middle of
+    if in_flight_alarm is not None:
+        resume_alarm(in_flight_alarm, buzzer)
 
     # Main loop
+    main_loop(buzzer)
+
+
+def main_loop(buzzer):
+    """
+    Checks every MAIN_LOOP_DELAY_SECONDS if the current time is within the wakeup window, and if so, goes into alarm
+    mode. Never returns.
+    :param buzzer: The buzzer which sounds the alarm.
+    :type buzzer: gpiozero.TonalBuzzer
+    :return: None
+    """
+    seconds_until_wakeup_window = None
     while True:
         # Loop delay
-        time.sleep(MAIN_LOOP_DELAY_SECONDS)
+        clock.idle(MAIN_LOOP_DELAY_SECONDS, seconds_until_wakeup_window)
 
-        # If active
-        if get_active_state():
-            # Check if within wakeup window
-            seconds_left = seconds_until_wakeup_time()
-            print(f"Time until wakeup: {readable_time(seconds_left)}.")
+        seconds_until_wakeup_window = check_wakeup_window(buzzer)
 
-            # If within wakeup window
-            if seconds_left <= get_wakeup_window() * 60:
-                print("Entered wakeup window.")
-                # Go into alarm mode
-                alarm_mode(seconds_left, buzzer)
+
+@profiling.profiled("main_loop")
+def check_wakeup_window(buzzer):
+    """
+    Goes into alarm mode if the alarm of any user is active and the current time is within their wakeup window.
+    There is one buzzer, so it waits for the alarm which goes off first, even if that is of another user whose window
+    opens later. The alarms which go off while it is busy are sounded one after the other once it is dismissed.
+    :param buzzer: The buzzer which sounds the alarm.
+    :type buzzer: gpiozero.TonalBuzzer
+    :return: seconds_until_wakeup_window (int), or None if nobody is active
+    """
+    # Find when the alarm of every active user goes off, and how long until the first wakeup window opens
+    now = clock.now()
+    fire_times = {}
+    seconds_until_wakeup_window = None
+    for user_id in get_users().values():
+        if get_active_state(user_id):
+            seconds_left = seconds_until_wakeup_time(user_id)
+            fire_times[user_id] = now + seconds_left
+            user_seconds_until_wakeup_window = seconds_left - get_wakeup_window(user_id) * 60
+            if seconds_until_wakeup_window is None or user_seconds_until_wakeup_window < seconds_until_wakeup_window:
+                seconds_until_wakeup_window = user_seconds_until_wakeup_window
+
+    # If nobody is active
+    if seconds_until_wakeup_window is None:
+        return None
+
+    user_id = min(fire_times, key=fire_times.get)
+    seconds_left = fire_times.pop(user_id) - now
+    print(f"Time until wakeup: {readable_time(seconds_left)}.")
+
+    # If within wakeup window
+    if seconds_until_wakeup_window <= 0:
+        print("Entered wakeup window.")
+        # Go into alarm mode
+        alarm_mode(seconds_left, buzzer, user_id)
+
+        # Then sound the alarms which went off meanwhile, and check again soon, since the wakeup window of another
+        # user may be open already
+        sound_passed_alarms(fire_times, buzzer)
+        return 0
+
+    return seconds_until_wakeup_window
 
 
 """
@@ -58,64 +195,252 @@ def main():
 
 def initialize():
     """
-    Loads settings and sets up TCP communication.
-    :return: buzzer (gpiozero.TonalBuzzer)
+    Loads settings and sets up communication over TCP, and over a Unix domain socket for clients on the same host.
+    The alarm state is reset, unless an alarm was counting down or ringing when the server stopped, and so are the
+    alarms set to go off once whose time came while the server was stopped. Recurring alarms stay active.
+    It is staged so that the communication workers answer as early as possible: the buzzer is set up and the caches
+    are warmed only once they are forked, while they already answer. Prints how long every phase took.
+    :return: buzzer (gpiozero.TonalBuzzer), in_flight_alarm (tuple), or None if there is no alarm to go on with
     """
-    # Reset states
-    set_active_state(0)
-    set_alarm_state(0)
+    global admission_counters, preferences_generation, write_generation
+
+    # Time every phase, starting with the interpreter and the imports which came before this function
+    startup_phases.clear()
+    imports_seconds = process_age()
+    if imports_seconds is not None:
+        startup_phases.append(("interpreter and imports", imports_seconds, None))
+    phase_start = time.perf_counter()
+
+    # Make sure the database has every table and column this version needs
+    server_setup.upgrade_database()
+
+    # Generations of the cached preferences and of the whole database, which every process writing increases
+    preferences_generation = multiprocessing.Value("q", 0)
+    write_generation = multiprocessing.Value("q", 0)
+
+    # Find the alarm which was counting down or ringing when the server stopped
+    in_flight_alarm = load_in_flight_alarm()
+
+    # Turn off the alarms set to go off once which missed their time, except that alarm
+    for user_id in get_users().values():
+        if (in_flight_alarm is None or user_id != in_flight_alarm[0]) and once_alarm_missed(user_id):
+            print(f"The alarm of user {user_id} was set to go off once while the server was stopped, turning it off.")
+            set_active_state(0, user_id)
+    if in_flight_alarm is None:
+        set_alarm_state(0)
+        set_in_flight_alarm(None, None, None)
+    phase_start = startup_phase("database", phase_start)
+
+    # Load settings
+    bind_address, bind_port, wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates = \
+        load_settings("all")
+
+    # Create server sockets, one per communication worker where the platform lets them share the port, and otherwise
+    # one which all workers accept from
+    communication_workers = max(1, db_get(["communication_workers"], "server_settings", "", None)[0][0])
+    if communication_workers > 1 and hasattr(socket, "SO_REUSEPORT"):
+        tcp_sockets = [reuse_port_socket(bind_address, bind_port) for _ in range(communication_workers)]
+    else:
+        tcp_sockets = [tcp_server_socket(bind_address, bind_port)] * communication_workers
+
+    # Create the Unix domain socket, if one is set and the platform has them, which all workers accept from
+    unix_sockets = []
+    unix_socket_path = db_get(["unix_socket_path"], "server_settings", "", None)[0][0]
+    if unix_socket_path and hasattr(socket, "AF_UNIX"):
+        unix_sockets.append(unix_server_socket(unix_socket_path))
+
+    # Queue connections from now on, while the communication workers are still starting
+    for listening_socket in set(tcp_sockets + unix_sockets):
+        listening_socket.listen(LISTEN_BACKLOG)
+    phase_start = startup_phase("sockets", phase_start, "queuing connections")
+
+    # Counters every communication worker adds to
+    admission_counters = multiprocessing.Array("q", len(ADMISSION_COUNTERS))
+
+    # Make sure the reset states are written before forking
+    db_wait_for_writes()
+
+    # Start the management processes for communication with client
+    for tcp_socket in tcp_sockets:
+        management_process = multiprocessing.Process(target=communication, args=[tcp_socket] + unix_sockets)
+        management_process.start()
+    phase_start = startup_phase("communication workers", phase_start, "answering commands")
+
+    # Start the HTTP gateway for dashboards, if a port is set
+    http_port = db_get(["http_port"], "server_settings", "", None)[0][0]
+    if http_port:
+        http_socket = tcp_server_socket(bind_address, http_port)
+        gateway_process = multiprocessing.Process(target=serve_http, args=(http_socket,))
+        gateway_process.start()
+        phase_start = startup_phase("http gateway", phase_start)
 
     # Instantiate buzzers
-    buzzer = gpiozero.TonalBuzzer(BUZZER_PIN)
+    buzzer = create_buzzer()
+    phase_start = startup_phase("buzzer", phase_start)
 
-    # Load settings
-    bind_address, bind_port, wakeup_time_hour, wakeup_time_minute, utc_offset = load_settings("all")
+    for user_id in get_users().values():
+        # Compute the daylight saving time changes of the time zone of every user before they are needed
+        time_zone = load_settings("minimal", user_id)[3]
+        if time_zone is not None:
+            time_zones.utc_offset_at(time_zone, clock.now())
+
+        # Compile the song of the alarm of every user before it is needed
+        load_alarm_song(user_id)
+    startup_phase("warm-up", phase_start, "ready")
+
+    print_startup_report()
+
+    return buzzer, in_flight_alarm
+
+
+def create_buzzer():
+    """
+    Sets up the pin of the buzzer. gpiozero is only imported here, so that the communication workers are forked
+    without it and answer while it is still loading.
+    :return: buzzer (gpiozero.TonalBuzzer)
+    """
+    import gpiozero
+
+    return gpiozero.TonalBuzzer(BUZZER_PIN)
 
-    # Create server socket
+
+def serve_http(http_socket):
+    """
+    Serves the HTTP gateway for dashboards on the given socket. Never returns. The gateway, and http.server with it,
+    is only imported here, in its own process, so that it doesn't slow down the startup of the server.
+    :param http_socket: The bound TCP socket of the gateway.
+    :type http_socket: socket.socket
+    :return: None
+    """
+    import http_gateway
+
+    http_gateway.serve(http_socket, http_routes(), get_user_id, get_write_generation)
+
+
+def startup_phase(name, phase_start, milestone=None):
+    """
+    Records how long a phase of the startup took, and what the server does from then on, if anything new.
+    :param name: The name of the phase.
+    :type name: str
+    :param phase_start: When the phase started, as returned by time.perf_counter.
+    :type phase_start: float
+    :param milestone: What the server does once the phase is over, or None.
+    :type milestone: str
+    :return: phase_end (float), which is when the next phase starts
+    """
+    phase_end = time.perf_counter()
+    startup_phases.append((name, phase_end - phase_start, milestone))
+
+    return phase_end
+
+
+def process_age():
+    """
+    Returns how long ago this process started, which covers starting the interpreter and importing the modules.
+    It is read from /proc, in clock ticks, so on platforms without it there is no telling.
+    :return: seconds (float), or None if it isn't known
+    """
+    try:
+        with open("/proc/self/stat") as stat:
+            # The fields after the name of the program, which may hold spaces itself, where the start time is the 20th
+            start_ticks = int(stat.read().rsplit(")", 1)[1].split()[19])
+        return time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, AttributeError, ValueError, IndexError):
+        return None
+
+
+def print_startup_report():
+    """
+    Prints how long every phase of the startup took, and how long after the start the server did what.
+    :return: None
+    """
+    print("Startup:")
+    elapsed = 0
+    for name, seconds, milestone in startup_phases:
+        elapsed += seconds
+        print(f"\t{name:<26}{seconds * 1000:8.1f} ms" + (f"\t{milestone} after {elapsed * 1000:.1f} ms"
+                                                         if milestone is not None else ""))
+
+
+def tcp_server_socket(bind_address, bind_port):
+    """
+    Creates a TCP socket which can be bound again right after a restart, while connections of the earlier run are
+    still closing.
+    :param bind_address: The address to bind to.
+    :type bind_address: str
+    :param bind_port: The port to bind to.
+    :type bind_port: int
+    :return: s (socket.socket)
+    """
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     s.bind((bind_address, bind_port))
 
-    # Start the management process for communication with client
-    management_process = multiprocessing.Process(target=communication, args=(s,))
-    management_process.start()
+    return s
 
-    return buzzer
 
+def reuse_port_socket(bind_address, bind_port):
+    """
+    Creates a TCP socket which shares its port with the other sockets of the communication workers. The kernel spreads
+    the incoming connections between them.
+    :param bind_address: The address to bind to.
+    :type bind_address: str
+    :param bind_port: The port to bind to.
+    :type bind_port: int
+    :return: s (socket.socket)
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    s.bind((bind_address, bind_port))
+
+    return s
 
-def load_settings(degree):
+
+def unix_server_socket(unix_socket_path):
+    """
+    Creates a Unix domain socket at the given path, replacing one left behind by an earlier run.
+    :param unix_socket_path: Where to create the socket.
+    :type unix_socket_path: str
+    :return: s (socket.socket)
+    """
+    if os.path.exists(unix_socket_path):
+        os.remove(unix_socket_path)
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.bind(unix_socket_path)
+
+    return s
+
+
+def load_settings(degree, user_id=DEFAULT_USER_ID):
     """
-    Loads settings from the database.
+    Loads settings, where the user preferences come from the cache of this process and only the server settings from
+    the database.
     :param degree: Determines which settings to return.
     :type degree: str
+    :param user_id: Whose preferences to return.
+    :type user_id: int
     :return: depends on the degree
     """
-    # Instantiate database connection
-    db = sqlite3.connect(DATABASE_PATH)
-    cursor = db.cursor()
-
-    # Get server settings
-    sql_query = """SELECT address, port FROM server_settings"""
-    cursor.execute(sql_query)
-    row0 = cursor.fetchone()
-    server_address = row0[0]
-    server_port = row0[1]
-
     # Get user preferences
-    sql_query = """SELECT wakeup_time_hour, wakeup_time_minute, utc_offset FROM user_preferences"""
-    cursor.execute(sql_query)
-    row0 = cursor.fetchone()
-    wakeup_time_hour = row0[0]
-    wakeup_time_minute = row0[1]
-    utc_offset = row0[2]
-
-    # Close database connection
-    db.close()
+    user_preferences = cached_user_preferences(user_id)[0]
+    wakeup_time_hour = user_preferences["wakeup_time_hour"]
+    wakeup_time_minute = user_preferences["wakeup_time_minute"]
+    utc_offset = user_preferences["utc_offset"]
+    time_zone = user_preferences["time_zone"]
+    recurrence = user_preferences["recurrence"]
+    skip_dates = user_preferences["skip_dates"]
 
     # Return information
     if degree == "minimal":
-        return wakeup_time_hour, wakeup_time_minute, utc_offset
+        return wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates
     else:
-        return server_address, server_port, wakeup_time_hour, wakeup_time_minute, utc_offset
+        # Get server settings
+        server_address, server_port = db_get(["address", "port"], "server_settings", "", None)[0]
+
+        return server_address, server_port, wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, \
+            skip_dates
 
 
 """
@@ -125,93 +450,440 @@ def load_settings(degree):
 """
 
 
-def communication(s):
+def communication(s, *more_sockets):
     """
     Listens for commands from the client and executes them.
+    Before any work is done for a connection, it is turned away with a busy reply if its client has used up its
+    share of RATE_LIMIT_PER_SECOND, if it already has MAX_CONNECTIONS_PER_CLIENT connections being served, or if
+    MAX_CONNECTIONS connections are already being served. Clients on this host are never limited per client, and may
+    still use RESERVED_LOCAL_CONNECTIONS more connections.
+    Every communication worker runs this with its own slots, token buckets and connection counts, so the limits hold
+    per worker.
     :param s: The TCP socket.
     :type s: socket.socket
+    :param more_sockets: Other sockets to listen on as well, such as a Unix domain socket.
+    :type more_sockets: socket.socket
     :return: None
     """
     # Listen for connections
-    s.listen(5)
+    listener = selectors.DefaultSelector()
+    for listening_socket in (s,) + more_sockets:
+        listening_socket.listen(LISTEN_BACKLOG)
+        listener.register(listening_socket, selectors.EVENT_READ)
+
+    # Connections are served by a pool of threads, at most MAX_CONNECTIONS at a time plus the reserved local ones
+    connection_pool = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_CONNECTIONS + RESERVED_LOCAL_CONNECTIONS)
+    connection_slots = threading.BoundedSemaphore(MAX_CONNECTIONS)
+    local_connection_slots = threading.BoundedSemaphore(RESERVED_LOCAL_CONNECTIONS)
+    token_buckets = {}
+
     while True:
-        # Accept any connection
-        client_socket, client_address = s.accept()
-        print(f"Connection from {client_address} has been established!")
+        # Accept any connection, from whichever socket has one
+        ready_socket = listener.select()[0][0].fileobj
+        client_socket, client_address = ready_socket.accept()
+
+        # Clients on a Unix domain socket have no address
+        if not client_address:
+            client_address = "local client"
+
+        # Turn away clients which send too many requests
+        client_host = client_address if isinstance(client_address, str) else client_address[0]
+        exempt = client_host in RATE_LIMIT_EXEMPT_HOSTS
+        if not exempt and not take_token(token_buckets, client_host):
+            shed_connection(client_socket, "rate_limited")
+            continue
+
+        # Turn away clients which already have their share of the connections
+        if not exempt and not take_client_connection(client_host):
+            shed_connection(client_socket, "over_client_capacity")
+            continue
+
+        # Turn away clients while too many connections are being served, where local clients have spare slots
+        if connection_slots.acquire(blocking=False):
+            slots = connection_slots
+        elif exempt and local_connection_slots.acquire(blocking=False):
+            slots = local_connection_slots
+        else:
+            if not exempt:
+                release_client_connection(client_host)
+            shed_connection(client_socket, "over_capacity")
+            continue
 
-        # Receive message and decode it
-        msg = client_socket.recv(1024)
-        command = msg.decode("utf-8").split(" ")
+        count_admission("accepted")
+        connection_pool.submit(serve_connection, client_socket, client_address, slots, None if exempt else client_host)
 
-        # Alarm state requested
-        if command[0] == "get_alarm_state":
-            # Verbose
-            print(f"{client_address} requested the alarm state.")
 
-            # Get the alarm state
-            alarm_state = get_alarm_state()
+@profiling.profiled("communication")
+def serve_connection(client_socket, client_address, connection_slots, client_host):
+    """
+    Serves one connection, then closes it and frees its slots, even if the command was malformed.
+    :param client_socket: The socket of the client.
+    :type client_socket: socket.socket
+    :param client_address: The address of the client.
+    :type client_address: tuple or str
+    :param connection_slots: The slots the connection was given one of.
+    :type connection_slots: threading.BoundedSemaphore
+    :param client_host: The client whose share of the connections it was counted in, or None if it wasn't.
+    :type client_host: str
+    :return: None
+    """
+    try:
+        client_socket.settimeout(CLIENT_TIMEOUT_SECONDS)
+        handle_connection(client_socket, client_address)
+    except (OSError, ValueError, IndexError, sqlite3.Error) as error:
+        print(f"{client_address} sent a request which could not be served: {error!r}")
+    finally:
+        client_socket.close()
+        connection_slots.release()
+        if client_host is not None:
+            release_client_connection(client_host)
 
-            # Reply with the alarm state
-            client_socket.send(bytes(str(alarm_state), "utf-8"))
 
-        # Change alarm state requested
-        elif command[0] == "set_alarm_state":
-            # Verbose
-            print(f"{client_address} requests alarm state to be {command[1]}.")
+def handle_connection(client_socket, client_address):
+    """
+    Receives one command from the client and executes it. Changes are committed before the connection is closed, so
+    that the next request of the client sees them, whichever communication worker serves it.
+    :param client_socket: The socket of the client.
+    :type client_socket: socket.socket
+    :param client_address: The address of the client.
+    :type client_address: tuple or str
+    :return: None
+    """
+    print(f"Connection from {client_address} has been established!")
+
+    # Receive message
+    msg = client_socket.recv(1024)
+
+    # Commands for another user than the default one start by naming them
+    user_id = DEFAULT_USER_ID
+    if msg.startswith(USER_PREFIX):
+        user_name, separator, msg = msg[len(USER_PREFIX):].partition(b" ")
+        user_id = get_users().get(user_name.decode("utf-8", "replace"))
+        if user_id is None:
+            print(f"{client_address} named the unknown user {user_name!r}.")
+            client_socket.send(bytes("error unknown user", "utf-8"))
+            return
+
+    # Trace upload, which is binary after the command line
+    if msg.startswith(b"upload_trace "):
+        receive_trace(client_socket, client_address, msg, user_id)
+        return
+
+    # Decode it
+    command = msg.decode("utf-8").split(" ")
+
+    # Alarm state requested
+    if command[0] == "get_alarm_state":
+        # Verbose
+        print(f"{client_address} requested the alarm state.")
+
+        # Get the alarm state, as far as the alarm is theirs
+        alarm_state = get_user_alarm_state(user_id)
+
+        # Reply with the alarm state
+        client_socket.send(bytes(str(alarm_state), "utf-8"))
+
+    # Change alarm state requested
+    elif command[0] == "set_alarm_state":
+        # Verbose
+        print(f"{client_address} requests alarm state to be {command[1]}.")
+
+        # Only the user whose alarm it is can turn it off
+        alarm_user_id = get_alarm_user_id()
+        if int(command[1]) == 0 and alarm_user_id is not None and alarm_user_id != user_id:
+            print(f"{client_address} tried to turn off the alarm of another user.")
+            client_socket.send(bytes("error not your alarm", "utf-8"))
+            return
+
+        # Set new alarm state
+        set_alarm_state(int(command[1])).result()
+
+        # Turning the alarm off means the user passed the awake test
+        if int(command[1]) == 0:
+            failed_attempts = int(command[2]) if len(command) > 2 else 0
+            record_wake_event_dismissed(clock.now(), failed_attempts, user_id).result()
+
+    # Set active state
+    elif command[0] == "set_active_state":
+        # Verbose
+        print(f"{client_address} requests active state to be {command[1]}.")
+
+        # Set new active_state
+        set_active_state(int(command[1]), user_id).result()
+
+    elif command[0] == "set_wakeup_hour":
+        # Verbose
+        print(f"{client_address} requests wakeup hour to be {command[1]}.")
+
+        # Set new wakeup hour
+        set_wakeup_hour(int(command[1]), user_id).result()
+
+    elif command[0] == "set_wakeup_minute":
+        # Verbose
+        print(f"{client_address} requests wakeup minute to be {command[1]}.")
+
+        # Set new wakeup hour
+        set_wakeup_minute(int(command[1]), user_id).result()
+
+    elif command[0] == "set_wakeup_window":
+        # Verbose
+        print(f"{client_address} requests wakeup window to be {command[1]}.")
+
+        # Set new wakeup window
+        set_wakeup_window(int(command[1]), user_id).result()
+
+    elif command[0] == "set_utc_offset":
+        # Verbose
+        print(f"{client_address} requests UTC offset to be {command[1]}.")
+
+        # Set new wakeup window
+        set_utc_offset(int(command[1]), user_id).result()
+
+    elif command[0] == "set_time_zone":
+        # Verbose
+        print(f"{client_address} requests time zone to be {command[1]}.")
+
+        # Set new time zone, where 'none' goes back to the UTC offset
+        if command[1] == "none":
+            set_time_zone(None, user_id).result()
+        elif time_zones.is_valid_time_zone(command[1]):
+            set_time_zone(command[1], user_id).result()
+        else:
+            print(f"{command[1]} is not a known time zone.")
 
-            # Set new alarm state
-            set_alarm_state(int(command[1]))
+    elif command[0] == "set_recurrence":
+        # Verbose
+        print(f"{client_address} requests recurrence to be {command[1]}.")
 
-        # Set active state
-        elif command[0] == "set_active_state":
-            # Verbose
-            print(f"{client_address} requests active state to be {command[1]}.")
+        # Set new recurrence rule
+        if schedule.is_valid_rule(command[1]):
+            set_recurrence(command[1], user_id).result()
+        else:
+            print(f"{command[1]} is not a valid recurrence rule.")
 
-            # Set new active_state
-            set_active_state(int(command[1]))
+    elif command[0] == "set_skip_dates":
+        # Verbose
+        print(f"{client_address} requests skip dates to be {command[1]}.")
 
-        elif command[0] == "set_wakeup_hour":
-            # Verbose
-            print(f"{client_address} requests wakeup hour to be {command[1]}.")
+        # Set new skip dates, where 'none' skips nothing
+        if command[1] == "none":
+            set_skip_dates(None, user_id).result()
+        elif schedule.is_valid_skip_dates(command[1]):
+            set_skip_dates(command[1], user_id).result()
+        else:
+            print(f"{command[1]} are not valid skip dates.")
 
-            # Set new wakeup hour
-            set_wakeup_hour(int(command[1]))
+    elif command[0] == "set_song":
+        # Verbose
+        print(f"{client_address} requests song to be {command[1]}.")
 
-        elif command[0] == "set_wakeup_minute":
-            # Verbose
-            print(f"{client_address} requests wakeup minute to be {command[1]}.")
+        # Set new song, if it exists and can be compiled
+        if songs.is_valid_song(command[1]):
+            set_song(command[1], user_id).result()
+        else:
+            print(f"{command[1]} is not a song which can be played.")
 
-            # Set new wakeup hour
-            set_wakeup_minute(int(command[1]))
+    elif command[0] == "get_songs":
+        # Verbose
+        print(f"{client_address} requested the songs.")
 
-        elif command[0] == "set_wakeup_window":
-            # Verbose
-            print(f"{client_address} requests wakeup window to be {command[1]}.")
+        # Reply with the names of every song
+        client_socket.sendall(bytes(str(songs.list_songs()), "utf-8"))
 
-            # Set new wakeup window
-            set_wakeup_window(int(command[1]))
+    elif command[0] == "set_user_preferences":
+        # Verbose
+        print(f"{client_address} requests user preferences {' '.join(command[1:])}.")
 
-        elif command[0] == "set_utc_offset":
-            # Verbose
-            print(f"{client_address} requests UTC offset to be {command[1]}.")
+        # Set every new preference at once, and reply when they are stored
+        try:
+            changes = parse_user_preference_changes(command[1:])
+        except ValueError as error:
+            client_socket.send(bytes(f"error {error}", "utf-8"))
+        else:
+            set_user_preferences(changes, user_id).result()
+            client_socket.send(bytes("ok", "utf-8"))
+
+    elif command[0] == "add_user":
+        # Verbose
+        print(f"{client_address} requests a new user {command[1]}.")
+
+        # Add the user with the preferences of a new user, and reply when they are stored
+        try:
+            add_user(command[1]).result()
+        except (ValueError, sqlite3.IntegrityError) as error:
+            client_socket.send(bytes(f"error {error}", "utf-8"))
+        else:
+            client_socket.send(bytes("ok", "utf-8"))
 
-            # Set new wakeup window
-            set_utc_offset(int(command[1]))
+    elif command[0] == "get_users":
+        # Verbose
+        print(f"{client_address} requested the users.")
 
-        elif command[0] == "get_user_preferences":
+        # Reply with the names of every user
+        client_socket.sendall(bytes(str(sorted(get_users())), "utf-8"))
+
+    elif command[0] == "set_profiling":
+        # Verbose
+        print(f"{client_address} requests profiling to be {command[1]}.")
+
+        # Turn profiling on or off in every process of the server
+        if int(command[1]) == 1:
+            profiling.enable()
+        else:
+            profiling.disable()
+        client_socket.send(bytes("ok", "utf-8"))
+
+    elif command[0] == "get_status":
+        # Verbose
+        print(f"{client_address} requested the status.")
+
+        # Reply with the alarm state and the user preferences
+        status = get_status(user_id)
+        client_socket.sendall(bytes(str(status), "utf-8"))
+
+    elif command[0] == "get_user_preferences":
+        # Verbose
+        print(f"{client_address} requested user_preferences.")
+
+        # Get the user preferences
+        user_preferences = get_user_preferences(user_id)
+
+        # Reply with the user preferences
+        client_socket.send(bytes(str(user_preferences), "utf-8"))
+
+    elif command[0] == "get_wake_event_rollups":
+        # Verbose
+        print(f"{client_address} requested wake event rollups.")
+
+        # Reply with the daily and weekly rollups
+        wake_event_rollups = get_wake_event_rollups(user_id)
+        client_socket.sendall(bytes(str(wake_event_rollups), "utf-8"))
+
+    elif command[0] == "get_user_preferences_if_changed":
+        # Only send the user preferences if they changed since the revision the client has
+        preferences_revision = get_preferences_revision(user_id)
+        if preferences_revision == int(command[1]):
+            client_socket.send(bytes("not_modified", "utf-8"))
+        else:
             # Verbose
-            print(f"{client_address} requested user_preferences.")
+            print(f"{client_address} requested user_preferences newer than revision {command[1]}.")
+
+            # Reply with the revision and the user preferences
+            user_preferences = get_user_preferences(user_id)
+            client_socket.send(bytes(str((preferences_revision, user_preferences)), "utf-8"))
+
+
+def take_token(token_buckets, client_host):
+    """
+    Takes a token from the bucket of the client, which refills at RATE_LIMIT_PER_SECOND up to RATE_LIMIT_BURST tokens.
+    :param token_buckets: The tokens and last refill time of every client.
+    :type token_buckets: dict
+    :param client_host: The address of the client.
+    :type client_host: str
+    :return: taken (bool), False if the bucket is empty
+    """
+    now = time.monotonic()
+
+    # Forget clients whose buckets are full again, so that the buckets don't pile up
+    if len(token_buckets) > RATE_LIMIT_MAX_CLIENTS:
+        for host in [host for host, (tokens, refilled) in token_buckets.items()
+                     if tokens + (now - refilled) * RATE_LIMIT_PER_SECOND >= RATE_LIMIT_BURST]:
+            del token_buckets[host]
+
+    tokens, refilled = token_buckets.get(client_host, (RATE_LIMIT_BURST, now))
+    tokens = min(RATE_LIMIT_BURST, tokens + (now - refilled) * RATE_LIMIT_PER_SECOND)
+
+    if tokens < 1:
+        token_buckets[client_host] = (tokens, now)
+        return False
+
+    token_buckets[client_host] = (tokens - 1, now)
+    return True
+
+
+def take_client_connection(client_host):
+    """
+    Counts a connection of the client, unless it already has MAX_CONNECTIONS_PER_CLIENT connections being served.
+    :param client_host: The address of the client.
+    :type client_host: str
+    :return: taken (bool), False if the client has no connections left
+    """
+    with client_connections_lock:
+        connections = client_connections.get(client_host, 0)
+        if connections >= MAX_CONNECTIONS_PER_CLIENT:
+            return False
+
+        client_connections[client_host] = connections + 1
+        return True
+
 
-            # Get the user preferences
-            user_preferences = get_user_preferences()
+def release_client_connection(client_host):
+    """
+    Stops counting a connection of the client, and forgets clients without connections, so that they don't pile up.
+    :param client_host: The address of the client.
+    :type client_host: str
+    :return: None
+    """
+    with client_connections_lock:
+        if client_connections[client_host] > 1:
+            client_connections[client_host] -= 1
+        else:
+            del client_connections[client_host]
 
-            # Reply with the user preferences
-            client_socket.send(bytes(str(user_preferences), "utf-8"))
 
-        # Close the socket
+def shed_connection(client_socket, reason):
+    """
+    Turns a connection away with a busy reply, without reading the request, and counts why.
+    :param client_socket: The socket of the client.
+    :type client_socket: socket.socket
+    :param reason: Which admission counter to increase.
+    :type reason: str
+    :return: None
+    """
+    count_admission(reason)
+
+    try:
+        client_socket.setblocking(False)
+        client_socket.send(BUSY_REPLY)
+        client_socket.shutdown(socket.SHUT_WR)
+
+        # Throw away a request which already arrived, so that closing doesn't reset the connection before the client
+        # reads the reply
+        client_socket.recv(1024)
+    except OSError:
+        pass
+    finally:
         client_socket.close()
 
 
+def count_admission(reason):
+    """
+    Increases an admission counter, which is shared by every communication worker started by initialize.
+    :param reason: One of ADMISSION_COUNTERS.
+    :type reason: str
+    :return: None
+    """
+    global admission_counters
+
+    if admission_counters is None:
+        admission_counters = multiprocessing.Array("q", len(ADMISSION_COUNTERS))
+
+    with admission_counters.get_lock():
+        admission_counters[ADMISSION_COUNTERS.index(reason)] += 1
+
+
+def get_admission_counters():
+    """
+    Returns how many connections were accepted, and how many were turned away for each reason.
+    :return: admission_counters (dict)
+    """
+    if admission_counters is None:
+        return dict.fromkeys(ADMISSION_COUNTERS, 0)
+
+    with admission_counters.get_lock():
+        return dict(zip(ADMISSION_COUNTERS, admission_counters))
+
+
 def db_get(columns, table, column_condition_name, column_condition_value):
     """
     Gets the columns from the given table, of the given rows, from the database.
@@ -225,6 +897,9 @@ def db_get(columns, table, column_condition_name, column_condition_value):
     :type column_condition_value: any
     :return: output (list of list)
     """
+    # Make sure earlier writes are visible
+    db_wait_for_writes()
+
     # Instantiate database connection
     db = sqlite3.connect(DATABASE_PATH)
     cursor = db.cursor()
@@ -260,7 +935,7 @@ def db_get(columns, table, column_condition_name, column_condition_value):
 
 def db_set(column, table, column_condition_name, column_condition_value, new_value):
     """
-    Updates a column within the database.
+    Updates a column within the database, through the database writer.
     :param column: Which database column to update.
     :type column: str
     :param table: Which table to update.
@@ -271,85 +946,509 @@ def db_set(column, table, column_condition_name, column_condition_value, new_val
     :type column_condition_value: any
     :param new_value: What to update the column with.
     :type new_value: any
-    :return: None
+    :return: future (concurrent.futures.Future)
     """
-    # Instantiate database connection
-    db = sqlite3.connect(DATABASE_PATH)
-    cursor = db.cursor()
-
     # Create SQL query
     sql_query = "UPDATE " + table + " SET " + column + " = ?"
 
-    # Executing query
+    # Queue query
     if column_condition_name != "":
         sql_query += " WHERE " + column_condition_name + " = ?"
-        cursor.execute(sql_query, (new_value, column_condition_value))
+        return db_write([(sql_query, (new_value, column_condition_value))])
     else:
-        cursor.execute(sql_query, (new_value,))
-    db.commit()
+        return db_write([(sql_query, (new_value,))])
+
+
+def db_set_user_preference(column, new_value, user_id):
+    """
+    Updates a column of the preferences of a user, and increases their preferences revision and sets when they changed
+    in the same statement.
+    :param column: Which user_preferences column to update.
+    :type column: str
+    :param new_value: What to update the column with.
+    :type new_value: any
+    :param user_id: Whose preferences to update.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    sql_query = "UPDATE user_preferences SET " + column + " = ?, preferences_revision = preferences_revision + 1, " \
+                "preferences_changed_time = ? WHERE user_id = ?"
+
+    return db_write([(sql_query, (new_value, clock.now(), user_id))], after_commit=next_preferences_generation)
+
+
+def db_get_user_preferences(user_id):
+    """
+    Reads the preferences of a user from the database, through the user_id index.
+    :param user_id: Whose preferences to read.
+    :type user_id: int
+    :return: user_preferences (dict), preferences_revision (int)
+    """
+    # Make sure earlier writes are visible
+    db_wait_for_writes()
+
+    # Instantiate database connection
+    db = sqlite3.connect(DATABASE_PATH)
+    cursor = db.cursor()
+
+    cursor.execute("SELECT * FROM user_preferences WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    columns = [description[0] for description in cursor.description]
 
     # Close database connection
     db.close()
 
+    if row is None:
+        raise ValueError(f"User {user_id} has no preferences")
+
+    user_preferences = dict(zip(columns, row))
+    preferences_revision = user_preferences["preferences_revision"]
+    for column in USER_PREFERENCES_HIDDEN_COLUMNS:
+        del user_preferences[column]
+
+    return user_preferences, preferences_revision
+
+
+"""
+########################################################################################################################
+                                                        DATABASE WRITER
+########################################################################################################################
+"""
+
+
+def db_write(statements, after_commit=None):
+    """
+    Queues statements for the database writer of this process. The statements are executed in the same transaction.
+    Writes which arrive within GROUP_COMMIT_WINDOW_SECONDS of each other are committed together.
+    A write without statements ends the window early.
+    :param statements: SQL queries and their parameters.
+    :type statements: list of tuple
+    :param after_commit: Called by the writer once the statements are committed, before the future is done.
+    :type after_commit: callable
+    :return: future (concurrent.futures.Future)
+    """
+    global db_last_write
+
+    future = WriteFuture()
+    db_writer_queue().put((statements, future, after_commit))
+    db_last_write = future
+
+    return future
+
+
+def db_wait_for_writes():
+    """
+    Waits until every write queued by this process so far has been committed, so that reads see them.
+    :return: None
+    """
+    if db_last_write is not None and db_writer_pid == os.getpid() and not db_last_write.done():
+        # Waiting for it makes the writer commit right away instead of waiting out the window
+        db_last_write.exception()
+
+
+class WriteFuture(concurrent.futures.Future):
+    """
+    The future of a write. Whoever waits for it makes the writer commit right away instead of waiting out the group
+    commit window, since no other write gains anything from them waiting.
+    """
+
+    def result(self, timeout=None):
+        """
+        Waits until the write is committed.
+        :param timeout: How many seconds to wait at most, or None to wait until it is committed.
+        :type timeout: float
+        :return: None
+        """
+        self.flush()
+
+        return super().result(timeout)
+
+    def exception(self, timeout=None):
+        """
+        Waits until the write is committed or failed.
+        :param timeout: How many seconds to wait at most, or None to wait until it is committed or failed.
+        :type timeout: float
+        :return: exception (Exception), or None if it was committed
+        """
+        self.flush()
+
+        return super().exception(timeout)
+
+    def flush(self):
+        """
+        Ends the group commit window early, unless the write is done already or belongs to the writer of another
+        process.
+        :return: None
+        """
+        if not self.done() and db_writer_pid == os.getpid():
+            db_queue.put(([], concurrent.futures.Future(), None))
+
+
+def db_writer_queue():
+    """
+    Returns the queue of the database writer of this process, and starts the writer if it isn't running.
+    A process started by multiprocessing inherits the queue but not the thread, so it gets its own writer.
+    :return: queue (queue.Queue)
+    """
+    global db_writer_pid, db_queue
+
+    # Several connections may be served at once, and only one of them may start the writer
+    with db_writer_lock:
+        if db_writer_pid != os.getpid():
+            db_queue = queue.Queue()
+            threading.Thread(target=db_writer, args=(db_queue,), daemon=True).start()
+            db_writer_pid = os.getpid()
+
+    return db_queue
+
+
+def db_writer(write_queue):
+    """
+    The only thread in this process that writes to the database. Takes writes from the queue, waits a short moment
+    for more writes to arrive, then commits all of them in one transaction and completes their futures.
+    :param write_queue: The queue of writes, as made by db_write.
+    :type write_queue: queue.Queue
+    :return: None
+    """
+    # Instantiate database connection
+    db = sqlite3.connect(DATABASE_PATH)
+
+    while True:
+        # Wait for a write, then gather every write which arrives within the window
+        batch = [write_queue.get()]
+        deadline = time.monotonic() + GROUP_COMMIT_WINDOW_SECONDS
+        while len(batch[-1][0]) > 0 and len(batch) < GROUP_COMMIT_MAX_WRITES:
+            try:
+                batch.append(write_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+
+        try:
+            db_commit_batch(db, batch)
+
+        # Never let the writer stop, since every write queued after this one would then be waited for forever
+        except Exception as error:
+            for statements, future, after_commit in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+def db_commit_batch(db, batch):
+    """
+    Commits the whole batch at once, and completes the future of every write in it.
+    If anything in the batch fails, the writes are committed one by one so that only the bad one fails.
+    :param db: The database connection of the writer.
+    :type db: sqlite3.Connection
+    :param batch: Writes as made by db_write.
+    :type batch: list of tuple
+    :return: None
+    """
+    try:
+        db_execute_batch(db, batch)
+    except Exception:
+        db_rollback(db)
+        for write in batch:
+            try:
+                db_execute_batch(db, [write])
+            except Exception as error:
+                db_rollback(db)
+                write[1].set_exception(error)
+            else:
+                db_complete_writes([write])
+    else:
+        db_complete_writes(batch)
+
+
+def db_execute_batch(db, batch):
+    """
+    Executes the statements of every write in the batch, then commits.
+    :param db: The database connection of the writer.
+    :type db: sqlite3.Connection
+    :param batch: Writes as made by db_write.
+    :type batch: list of tuple
+    :return: None
+    """
+    cursor = db.cursor()
+    for statements, future, after_commit in batch:
+        for sql_query, parameters in statements:
+            cursor.execute(sql_query, parameters)
+    db.commit()
+
+
+def db_rollback(db):
+    """
+    Rolls back what the writer didn't commit, where a connection which can't even roll back is left as it is.
+    :param db: The database connection of the writer.
+    :type db: sqlite3.Connection
+    :return: None
+    """
+    try:
+        db.rollback()
+    except sqlite3.Error as error:
+        print(f"Could not roll back a failed write: {error!r}")
+
+
+def db_complete_writes(writes):
+    """
+    Completes the futures of committed writes, once every after_commit of them ran. A write whose after_commit fails
+    fails with its exception, without being executed again, since it is committed already.
+    :param writes: Committed writes as made by db_write.
+    :type writes: list of tuple
+    :return: None
+    """
+    errors = []
+    for statements, future, after_commit in writes:
+        try:
+            if after_commit is not None:
+                after_commit()
+            errors.append(None)
+        except Exception as error:
+            errors.append(error)
+
+    # Drop every response the HTTP gateway cached, unless the writes were only there to end the window early
+    if any(statements for statements, future, after_commit in writes):
+        try:
+            next_write_generation()
+        except Exception as error:
+            errors = [error if write_error is None else write_error for write_error in errors]
+
+    for (statements, future, after_commit), error in zip(writes, errors):
+        if error is None:
+            future.set_result(None)
+        else:
+            future.set_exception(error)
+
 
 def set_alarm_state(new_alarm_state):
     """
     Sets the alarm state, which is stored in the database, to the parameter new_alarm_state.
     :param new_alarm_state: The new alarm state.
     :type new_alarm_state: int
-    :return: None
+    :return: future (concurrent.futures.Future)
     """
-    db_set("alarm_state", "server_settings", "id", 1, new_alarm_state)
+    return db_set("alarm_state", "server_settings", "id", 1, new_alarm_state)
 
 
-def set_active_state(new_active_state):
+def set_active_state(new_active_state, user_id=DEFAULT_USER_ID):
     """
     Sets the active state, which is stored in the database, to the parameter new_active_state.
     :param new_active_state: The new alarm state.
     :type new_active_state: int
-    :return: None
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
     """
-    db_set("active_state", "user_preferences", "id", 1, new_active_state)
+    return db_set_user_preference("active_state", new_active_state, user_id)
 
 
-def set_wakeup_hour(new_wakeup_hour):
+def set_wakeup_hour(new_wakeup_hour, user_id=DEFAULT_USER_ID):
     """
     Sets the wakeup hour to the parameter new_wakeup_hour.
     :param new_wakeup_hour: The new wakeup hour.
     :type new_wakeup_hour: int
-    :return: None
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
     """
-    db_set("wakeup_time_hour", "user_preferences", "id", 1, new_wakeup_hour)
+    return db_set_user_preference("wakeup_time_hour", new_wakeup_hour, user_id)
 
 
-def set_wakeup_minute(new_wakeup_minute):
+def set_wakeup_minute(new_wakeup_minute, user_id=DEFAULT_USER_ID):
     """
     Sets the wakeup minute to the parameter new_wakeup_minute.
     :param new_wakeup_minute: The new wakeup minute.
     :type new_wakeup_minute: int
-    :return: None
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
     """
-    db_set("wakeup_time_minute", "user_preferences", "id", 1, new_wakeup_minute)
+    return db_set_user_preference("wakeup_time_minute", new_wakeup_minute, user_id)
 
 
-def set_wakeup_window(new_wakeup_window):
+def set_wakeup_window(new_wakeup_window, user_id=DEFAULT_USER_ID):
     """
     Sets the wakeup window to the parameter new_wakeup_window.
     :param new_wakeup_window: The new wakeup window in minutes.
     :type new_wakeup_window: int
-    :return: None
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
     """
-    db_set("wakeup_window", "user_preferences", "id", 1, new_wakeup_window)
+    return db_set_user_preference("wakeup_window", new_wakeup_window, user_id)
 
 
-def set_utc_offset(new_utc_offset):
+def set_utc_offset(new_utc_offset, user_id=DEFAULT_USER_ID):
     """
     Sets the UTC offset to the parameter new_utc_offset.
     :param new_utc_offset: The new UTC offset.
     :type new_utc_offset: int
-    :return: None
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    return db_set_user_preference("utc_offset", new_utc_offset, user_id)
+
+
+def set_time_zone(new_time_zone, user_id=DEFAULT_USER_ID):
+    """
+    Sets the time zone to the parameter new_time_zone. Once set, it is used instead of the UTC offset.
+    :param new_time_zone: The new IANA time zone name, or None to use the UTC offset.
+    :type new_time_zone: str
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    return db_set_user_preference("time_zone", new_time_zone, user_id)
+
+
+def set_user_preferences(changes, user_id=DEFAULT_USER_ID):
+    """
+    Updates several preferences of a user in one statement, which increases their preferences revision once, and sets
+    when they changed.
+    :param changes: The new value of every user_preferences column to update.
+    :type changes: dict
+    :param user_id: Whose preferences to update.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    sql_query = "UPDATE user_preferences SET " + "".join(column + " = ?, " for column in changes) + \
+        "preferences_revision = preferences_revision + 1, preferences_changed_time = ? WHERE user_id = ?"
+
+    return db_write([(sql_query, tuple(changes.values()) + (clock.now(), user_id))],
+                    after_commit=next_preferences_generation)
+
+
+def parse_user_preference_changes(assignments):
+    """
+    Parses and checks the arguments of set_user_preferences, which look like wakeup_time_hour=6.
+    The time zone and skip dates can be set to none.
+    :param assignments: The arguments of the command.
+    :type assignments: list of str
+    :return: changes (dict)
+    """
+    changes = {}
+    for assignment in assignments:
+        column, separator, value = assignment.partition("=")
+
+        if column in USER_PREFERENCE_RANGES:
+            lowest, highest = USER_PREFERENCE_RANGES[column]
+            if not value.lstrip("-").isdigit():
+                raise ValueError(f"{column} must be a whole number")
+            new_value = int(value)
+            if not lowest <= new_value <= highest:
+                raise ValueError(f"{column} must be from {lowest} to {highest}")
+        elif column in ("time_zone", "skip_dates") and value == "none":
+            new_value = None
+        elif column == "time_zone" and time_zones.is_valid_time_zone(value):
+            new_value = value
+        elif column == "recurrence" and schedule.is_valid_rule(value):
+            new_value = value
+        elif column == "skip_dates" and schedule.is_valid_skip_dates(value):
+            new_value = value
+        elif column == "song" and songs.is_valid_song(value):
+            new_value = value
+        elif column in ("time_zone", "recurrence", "skip_dates", "song"):
+            raise ValueError(f"{value} is not a valid {column}")
+        else:
+            raise ValueError(f"Unknown preference: {column}")
+
+        changes[column] = new_value
+
+    if len(changes) == 0:
+        raise ValueError("No preferences given")
+
+    return changes
+
+
+def set_recurrence(new_recurrence, user_id=DEFAULT_USER_ID):
+    """
+    Sets the recurrence rule to the parameter new_recurrence.
+    :param new_recurrence: The new recurrence rule, such as once, daily, weekdays, weekends or mon,wed,fri.
+    :type new_recurrence: str
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    return db_set_user_preference("recurrence", new_recurrence, user_id)
+
+
+def set_song(new_song, user_id=DEFAULT_USER_ID):
+    """
+    Sets the song the alarm plays to the parameter new_song.
+    :param new_song: The name of a song in server/songs.
+    :type new_song: str
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    return db_set_user_preference("song", new_song, user_id)
+
+
+def set_skip_dates(new_skip_dates, user_id=DEFAULT_USER_ID):
+    """
+    Sets the dates the alarm should not go off to the parameter new_skip_dates.
+    :param new_skip_dates: The dates in the format YYYY-MM-DD separated by commas, or None.
+    :type new_skip_dates: str
+    :param user_id: Whose preference to set.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    return db_set_user_preference("skip_dates", new_skip_dates, user_id)
+
+
+def set_in_flight_alarm(user_id, scheduled_time, event_date):
     """
-    db_set("utc_offset", "user_preferences", "id", 1, new_utc_offset)
+    Remembers the alarm which is counting down or ringing, so that a restart goes on with it.
+    :param user_id: Whose alarm it is, or None once there is no alarm.
+    :type user_id: int
+    :param scheduled_time: When the alarm goes off, in seconds since the epoch, or None.
+    :type scheduled_time: float
+    :param event_date: The local date of the scheduled time, in the format YYYY-MM-DD, or None.
+    :type event_date: str
+    :return: future (concurrent.futures.Future)
+    """
+    sql_query = "UPDATE server_settings SET alarm_user_id = ?, alarm_scheduled_time = ?, alarm_event_date = ?"
+
+    return db_write([(sql_query, (user_id, scheduled_time, event_date))])
+
+
+def load_in_flight_alarm():
+    """
+    Returns the alarm which was counting down or ringing when the server stopped. A ringing alarm goes on until it is
+    dismissed, and a countdown unless its alarm should have gone off more than RESTORE_GRACE_SECONDS ago.
+    :return: user_id (int), scheduled_time (float), event_date (str), ringing (bool), or None if there is none
+    """
+    columns = ["alarm_state", "alarm_user_id", "alarm_scheduled_time", "alarm_event_date"]
+    alarm_state, user_id, scheduled_time, event_date = db_get(columns, "server_settings", "", None)[0]
+
+    if scheduled_time is None or user_id not in get_users().values():
+        return None
+    if alarm_state != 1 and clock.now() - scheduled_time > RESTORE_GRACE_SECONDS:
+        print("The alarm the server stopped in the middle of is too long past to go on with.")
+        return None
+
+    return user_id, scheduled_time, event_date, alarm_state == 1
+
+
+def once_alarm_missed(user_id):
+    """
+    Tests if the user has an active alarm set to go off once, whose time came since their preferences last changed.
+    Since it would have turned itself off had the server been running, that time came while the server was stopped.
+    An alarm whose preferences changed before that was recorded counts as missed.
+    :param user_id: Whose alarm to test.
+    :type user_id: int
+    :return: missed (bool)
+    """
+    wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates = \
+        load_settings("minimal", user_id)
+    if not get_active_state(user_id) or recurrence != schedule.RULE_ONCE:
+        return False
+
+    changed_time = db_get(["preferences_changed_time"], "user_preferences", "user_id", user_id)[0][0]
+    if changed_time is None:
+        return True
+
+    return fire_time_after(changed_time, wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone) < clock.now()
 
 
 def get_alarm_state():
@@ -362,56 +1461,369 @@ def get_alarm_state():
     return alarm_state
 
 
-def get_active_state():
+def get_alarm_user_id():
     """
-    Returns the active state, which is stored in the database.
+    Returns whose alarm is counting down or ringing.
+    :return: user_id (int), or None if no alarm is
+    """
+    alarm_user_id = db_get(["alarm_user_id"], "server_settings", "", None)[0][0]
+
+    return alarm_user_id
+
+
+def get_user_alarm_state(user_id=DEFAULT_USER_ID):
+    """
+    Returns the alarm state as a user sees it, which is 0 while the alarm of another user rings, so that only the
+    client of the user whose alarm it is starts the awake test.
+    :param user_id: Who asks.
+    :type user_id: int
+    :return: alarm_state (int)
+    """
+    alarm_state, alarm_user_id = db_get(["alarm_state", "alarm_user_id"], "server_settings", "", None)[0]
+    if alarm_user_id is not None and alarm_user_id != user_id:
+        return 0
+
+    return alarm_state
+
+
+def get_active_state(user_id=DEFAULT_USER_ID):
+    """
+    Returns the active state of a user.
+    :param user_id: Whose active state to return.
+    :type user_id: int
     :return: active_state (int)
     """
-    active_state = db_get(["active_state"], "user_preferences", "", None)[0][0]
+    active_state = cached_user_preferences(user_id)[0]["active_state"]
 
     return active_state
 
 
-def get_wakeup_window():
+def get_wakeup_window(user_id=DEFAULT_USER_ID):
     """
-    Returns the wakeup window, which is stored in the database.
+    Returns the wakeup window of a user.
+    :param user_id: Whose wakeup window to return.
+    :type user_id: int
     :return: wakeup_window (int)
     """
-    wakeup_window = db_get(["wakeup_window"], "user_preferences", "", None)[0][0]
+    wakeup_window = cached_user_preferences(user_id)[0]["wakeup_window"]
 
     return wakeup_window
 
 
-def get_user_preferences():
+def get_preferences_revision(user_id=DEFAULT_USER_ID):
+    """
+    Returns the revision of the preferences of a user, which increases every time they change.
+    :param user_id: Whose revision to return.
+    :type user_id: int
+    :return: preferences_revision (int)
+    """
+    preferences_revision = cached_user_preferences(user_id)[1]
+
+    return preferences_revision
+
+
+def get_user_preferences(user_id=DEFAULT_USER_ID):
     """
-    Starts by grabbing the SQL for the user_preferences table from the sqlite_master table.
-    Then parses it in order to extract only the column names, excluding the column named 'id'.
-    Then grabs the values of the first row in the user_preferences table
-    for each column except for the column named 'id'.
-    Combines these two lists into a dictionary and returns said dictionary.
+    Returns every preference of a user by column name, which the caller may change without changing the cache.
+    :param user_id: Whose preferences to return.
+    :type user_id: int
     :return: user_preferences (dict)
     """
-    # Instantiate database connection
-    user_preferences_sql = db_get(["sql"], "sqlite_master", "tbl_name", "user_preferences")[0]
-    user_preferences_sql_parsed = str(user_preferences_sql[0]).replace("\n    ", " ")
-    user_preferences_sql_parsed = user_preferences_sql_parsed.split(", ")
-    del user_preferences_sql_parsed[0]
-    user_preferences_column_names = []
-    for i in range(len(user_preferences_sql_parsed)):
-        column_name = user_preferences_sql_parsed[i].split(" ")[0]
-        user_preferences_column_names.append(column_name)
-
-    # Get user preferences values
-    user_preferences_values = db_get(["*"], "user_preferences", "", None)[0]
-    user_preferences_values_list = list(user_preferences_values)
-    del user_preferences_values_list[0]
-
-    # Convert to dictionary
-    user_preferences = dict(zip(user_preferences_column_names, user_preferences_values_list))
+    user_preferences = dict(cached_user_preferences(user_id)[0])
 
     return user_preferences
 
 
+def cached_user_preferences(user_id):
+    """
+    Returns the preferences of a user from the cache of this process. They are only read from the database, through
+    the user_id index, when they aren't cached yet or any process changed preferences since they were read.
+    The returned dictionary is the cached one, so it must not be changed.
+    :param user_id: Whose preferences to return.
+    :type user_id: int
+    :return: user_preferences (dict), preferences_revision (int)
+    """
+    # Make sure earlier writes are committed, and so counted in the generation
+    db_wait_for_writes()
+
+    # The generation is read before the preferences, so a change committed in between makes the next call read again
+    generation = get_preferences_generation()
+    cached = user_preferences_cache.get(user_id)
+    if cached is None or cached[0] != generation:
+        user_preferences, preferences_revision = db_get_user_preferences(user_id)
+        cached = user_preferences_cache[user_id] = (generation, user_preferences, preferences_revision)
+
+    return cached[1], cached[2]
+
+
+def get_users():
+    """
+    Returns the id of every user by name, from the cache of this process, which is read again from the database when
+    any process changed preferences or users since it was read.
+    The returned dictionary is the cached one, so it must not be changed.
+    :return: users (dict)
+    """
+    global users_cache
+
+    # Make sure earlier writes are committed, and so counted in the generation
+    db_wait_for_writes()
+
+    generation = get_preferences_generation()
+    if users_cache[0] != generation:
+        users_cache = (generation, dict(db_get(["name", "id"], "users", "", None)))
+
+    return users_cache[1]
+
+
+def add_user(name):
+    """
+    Adds a user with the preferences of a new user.
+    :param name: The name of the user, of up to 32 letters, digits, underscores and dashes.
+    :type name: str
+    :return: future (concurrent.futures.Future)
+    """
+    if USER_NAME_PATTERN.fullmatch(name) is None:
+        raise ValueError(f"{name} is not a valid user name")
+    if name in get_users():
+        raise ValueError(f"{name} already exists")
+
+    columns = list(server_setup.NEW_USER_PREFERENCES)
+    sql_query = "INSERT INTO user_preferences(user_id, " + ", ".join(columns) + ") SELECT id" + ", ?" * len(columns) \
+        + " FROM users WHERE name = ?"
+
+    return db_write([("INSERT INTO users(name) VALUES(?)", (name,)),
+                     (sql_query, tuple(server_setup.NEW_USER_PREFERENCES.values()) + (name,))],
+                    after_commit=next_preferences_generation)
+
+
+def get_preferences_generation():
+    """
+    Returns the generation of the cached preferences and users, which increases every time any process changes them.
+    :return: generation (int)
+    """
+    global preferences_generation
+
+    if preferences_generation is None:
+        preferences_generation = multiprocessing.Value("q", 0)
+
+    return preferences_generation.value
+
+
+def get_user_id(user_name):
+    """
+    Returns the id of a user by name.
+    :param user_name: The name of the user, or None for the default user.
+    :type user_name: str
+    :return: user_id (int), or None if there is no such user
+    """
+    if user_name is None:
+        return DEFAULT_USER_ID
+
+    return get_users().get(user_name)
+
+
+def next_preferences_generation():
+    """
+    Increases the generation of the cached preferences and users, which makes every process read them again.
+    Called by the database writer once a change of them is committed.
+    :return: None
+    """
+    global preferences_generation
+
+    if preferences_generation is None:
+        preferences_generation = multiprocessing.Value("q", 0)
+
+    with preferences_generation.get_lock():
+        preferences_generation.value += 1
+
+
+def get_write_generation():
+    """
+    Returns the generation of the whole database, which increases every time any process commits a write.
+    :return: generation (int)
+    """
+    global write_generation
+
+    if write_generation is None:
+        write_generation = multiprocessing.Value("q", 0)
+
+    return write_generation.value
+
+
+def next_write_generation():
+    """
+    Increases the generation of the whole database. Called by the database writer after every commit.
+    :return: None
+    """
+    global write_generation
+
+    if write_generation is None:
+        write_generation = multiprocessing.Value("q", 0)
+
+    with write_generation.get_lock():
+        write_generation.value += 1
+
+
+def get_status(user_id=DEFAULT_USER_ID):
+    """
+    Returns everything a script needs to know about the alarm of a user in one reply.
+    :param user_id: Whose preferences to include.
+    :type user_id: int
+    :return: status (dict)
+    """
+    status = {"alarm_state": get_user_alarm_state(user_id), "preferences_revision": get_preferences_revision(user_id),
+              "user_preferences": get_user_preferences(user_id), "seconds_until_wakeup_time": None,
+              "admission_counters": get_admission_counters(), "profiling": profiling.is_enabled()}
+
+    if status["user_preferences"]["active_state"] == 1:
+        status["seconds_until_wakeup_time"] = seconds_until_wakeup_time(user_id)
+
+    return status
+
+
+def http_routes():
+    """
+    Returns the getter of every path the HTTP gateway serves, each of which is given the id of a user.
+    :return: routes (dict)
+    """
+    return {"/status": get_status, "/user_preferences": get_user_preferences,
+            "/users": lambda user_id: sorted(get_users()),
+            "/wake_event_rollups": get_wake_event_rollups}
+
+
+"""
+########################################################################################################################
+                                                        WAKE EVENTS
+########################################################################################################################
+"""
+
+
+def record_wake_event_fired(scheduled_time, fired_time, event_date, user_id=DEFAULT_USER_ID):
+    """
+    Appends a wake event to the history once the alarm has gone off.
+    :param scheduled_time: When the alarm should have gone off, in seconds since the epoch.
+    :type scheduled_time: float
+    :param fired_time: When the alarm actually went off, in seconds since the epoch.
+    :type fired_time: float
+    :param event_date: The local date of the scheduled time, in the format YYYY-MM-DD.
+    :type event_date: str
+    :param user_id: Whose alarm it was.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    sql_query = """INSERT INTO wake_events(user_id, event_date, scheduled_time, fired_time) VALUES(?, ?, ?, ?)"""
+
+    return db_write([(sql_query, (user_id, event_date, scheduled_time, fired_time))])
+
+
+def record_wake_event_dismissed(dismissed_time, failed_attempts, user_id=DEFAULT_USER_ID):
+    """
+    Completes the latest wake event of the user, if it has not yet been dismissed.
+    :param dismissed_time: When the user passed the awake test, in seconds since the epoch.
+    :type dismissed_time: float
+    :param failed_attempts: How many times the user failed the awake test before passing it.
+    :type failed_attempts: int
+    :param user_id: Who passed it.
+    :type user_id: int
+    :return: future (concurrent.futures.Future)
+    """
+    sql_query = """UPDATE wake_events SET dismissed_time = ?, failed_attempts = ?
+    WHERE id = (SELECT MAX(id) FROM wake_events WHERE user_id = ?) AND dismissed_time IS NULL"""
+
+    return db_write([(sql_query, (dismissed_time, failed_attempts, user_id))])
+
+
+def receive_trace(client_socket, client_address, msg, user_id=DEFAULT_USER_ID):
+    """
+    Receives the rest of a trace upload, computes its metrics and stores both with the latest wake event of the user.
+    The upload starts with the command line 'upload_trace <length>', followed by the compressed trace.
+    :param client_socket: The socket of the client.
+    :type client_socket: socket.socket
+    :param client_address: The address of the client.
+    :type client_address: tuple
+    :param msg: What has been received so far.
+    :type msg: bytes
+    :param user_id: Who uploads it.
+    :type user_id: int
+    :return: None
+    """
+    # Parse the command line
+    command_line, separator, data = msg.partition(b"\n")
+    length = int(command_line.split(b" ")[1])
+    if length > trace_metrics.MAX_TRACE_BYTES:
+        print(f"{client_address} tried to upload a trace of {length} bytes, which is too large.")
+        return
+
+    # Receive the rest of the trace
+    while len(data) < length:
+        chunk = client_socket.recv(min(length - len(data), 65536))
+        if not chunk:
+            print(f"{client_address} closed the connection before the whole trace was received.")
+            return
+        data += chunk
+
+    # Compute the metrics
+    try:
+        metrics = trace_metrics.compute_metrics(*trace_metrics.decode_trace(data))
+    except (ValueError, struct.error, zlib.error) as error:
+        print(f"{client_address} uploaded an invalid trace: {error}")
+        return
+
+    # Verbose
+    print(f"{client_address} uploaded a trace: {metrics}")
+
+    sql_query = """INSERT INTO wake_traces(wake_event_id, trace, samples, duration, wall_hits, mean_speed, max_speed,
+    hesitation_seconds, path_efficiency) VALUES((SELECT MAX(id) FROM wake_events WHERE user_id = ?), ?, ?, ?, ?, ?, ?,
+    ?, ?)"""
+    db_write([(sql_query, (user_id, data, metrics["samples"], metrics["duration"], metrics["wall_hits"],
+                           metrics["mean_speed"], metrics["max_speed"], metrics["hesitation_seconds"],
+                           metrics["path_efficiency"]))])
+
+
+def get_wake_event_rollups(user_id=DEFAULT_USER_ID):
+    """
+    Returns daily rollups of the last ROLLUP_DAYS days and weekly rollups of the last ROLLUP_WEEKS weeks of the alarms
+    of a user, in their local dates.
+    Each rollup holds the period, the amount of alarms, the average and worst fire lag, the average and worst time to
+    dismiss in seconds, and the total amount of failed attempts. Everything is computed by the database, and only
+    reads the rows of the user within the period through the user_id and event_date index.
+    :param user_id: Whose alarms to roll up.
+    :type user_id: int
+    :return: wake_event_rollups (dict)
+    """
+    # The first local date of each rollup
+    wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates = \
+        load_settings("minimal", user_id)
+    now = clock.now()
+    offset = utc_offset_in_seconds(utc_offset, time_zone, now)
+    first_day = format_local_time(now - ROLLUP_DAYS * SECONDS_IN_A_DAY, offset, "%Y-%m-%d")
+    first_week_day = format_local_time(now - ROLLUP_WEEKS * 7 * SECONDS_IN_A_DAY, offset, "%Y-%m-%d")
+
+    # Instantiate database connection
+    db = sqlite3.connect(DATABASE_PATH)
+    cursor = db.cursor()
+
+    rollup_columns = """COUNT(*), AVG(fired_time - scheduled_time), MAX(fired_time - scheduled_time),
+    AVG(dismissed_time - fired_time), MAX(dismissed_time - fired_time), SUM(failed_attempts)"""
+
+    # Daily rollups
+    sql_query = "SELECT event_date, " + rollup_columns + """ FROM wake_events
+    WHERE user_id = ? AND event_date > ? GROUP BY event_date ORDER BY event_date"""
+    cursor.execute(sql_query, (user_id, first_day))
+    daily = cursor.fetchall()
+
+    # Weekly rollups
+    sql_query = "SELECT strftime('%Y-W%W', event_date) AS week, " + rollup_columns + """ FROM wake_events
+    WHERE user_id = ? AND event_date > ? GROUP BY week ORDER BY week"""
+    cursor.execute(sql_query, (user_id, first_week_day))
+    weekly = cursor.fetchall()
+
+    # Close database connection
+    db.close()
+
+    return {"daily": daily, "weekly": weekly}
+
+
 """
 ########################################################################################################################
                                                         TIME MANAGEMENT
@@ -487,28 +1899,75 @@ def seconds_to_minutes(seconds):
     return minutes, remainder_seconds
 
 
-def seconds_until_wakeup_time():
+def seconds_until_wakeup_time(user_id=DEFAULT_USER_ID):
     """
-    Returns how many seconds are left until wakeup time.
+    Returns how many seconds are left until the wakeup time of a user. With the 'once' recurrence rule, that is the
+    next time the wakeup time comes. Otherwise it is the wakeup time on the next day the rule goes off.
+    :param user_id: Whose wakeup time to use.
+    :type user_id: int
     :return: time_left (int)
     """
     # Get newest settings
-    wakeup_time_hour, wakeup_time_minute, utc_offset = load_settings("minimal")
+    wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates = \
+        load_settings("minimal", user_id)
+    now = clock.now()
 
-    # Then get the wakeup timestamp
-    wakeup_timestamp_in_seconds = convert_to_seconds(0, wakeup_time_hour, wakeup_time_minute, 0)
+    # Follow the daylight saving time changes of the time zone, if one is set
+    if time_zone is not None:
+        seconds_left = int(time_zones.next_fire_time(time_zone, wakeup_time_hour, wakeup_time_minute, now) - now)
+
+    else:
+        # Then get the wakeup timestamp
+        wakeup_timestamp_in_seconds = convert_to_seconds(0, wakeup_time_hour, wakeup_time_minute, 0)
 
-    # Time left until wakeup time
-    seconds_left = wakeup_timestamp_in_seconds - current_time_in_seconds(utc_offset)
+        # Time left until wakeup time
+        seconds_left = wakeup_timestamp_in_seconds - current_time_in_seconds(utc_offset)
 
-    # In the case that time_left is negative (meaning that the alarm has already gone off this day)
-    if seconds_left < 0:
-        # Add a day
-        seconds_left += SECONDS_IN_A_DAY
+        # In the case that time_left is negative (meaning that the alarm has already gone off this day)
+        if seconds_left < 0:
+            # Add a day
+            seconds_left += SECONDS_IN_A_DAY
+
+    # Move on to the next day the recurrence rule goes off on
+    if recurrence != schedule.RULE_ONCE:
+        fire_time = now + seconds_left
+        day_number = int(fire_time + utc_offset_in_seconds(utc_offset, time_zone, fire_time)) // SECONDS_IN_A_DAY
+        days = schedule.days_until_fire(recurrence, skip_dates, day_number)
+
+        if days > 0 and time_zone is not None:
+            local_fire_time = convert_to_seconds(day_number + days, wakeup_time_hour, wakeup_time_minute, 0)
+            seconds_left = int(time_zones.local_to_utc(time_zone, local_fire_time) - now)
+        elif days > 0:
+            seconds_left += days * SECONDS_IN_A_DAY
 
     return seconds_left
 
 
+def fire_time_after(timestamp, wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone):
+    """
+    Returns the first moment from the given one on at which the local wall clock shows the wakeup time, which is when
+    an alarm set to go off once, set at that moment, goes off.
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: float
+    :param wakeup_time_hour: The local wakeup hour.
+    :type wakeup_time_hour: int
+    :param wakeup_time_minute: The local wakeup minute.
+    :type wakeup_time_minute: int
+    :param utc_offset: The amount of hours ahead of UTC.
+    :type utc_offset: int
+    :param time_zone: An IANA time zone name, or None to use the UTC offset.
+    :type time_zone: str
+    :return: fire_time (float)
+    """
+    if time_zone is not None:
+        return time_zones.next_fire_time(time_zone, wakeup_time_hour, wakeup_time_minute, timestamp)
+
+    local_seconds = int(timestamp + convert_to_seconds(0, utc_offset, 0, 0)) % SECONDS_IN_A_DAY
+    seconds_left = (convert_to_seconds(0, wakeup_time_hour, wakeup_time_minute, 0) - local_seconds) % SECONDS_IN_A_DAY
+
+    return int(timestamp) + seconds_left
+
+
 def current_time_in_seconds(utc_offset):
     """
     Gets the current hour and minute and returns the total of that in minutes.
@@ -548,23 +2007,50 @@ def convert_to_seconds(days, hour, minutes, seconds):
     return ((days * 24 + hour) * 60 + minutes) * 60 + seconds
 
 
+def utc_offset_in_seconds(utc_offset, time_zone, timestamp):
+    """
+    Returns how many seconds ahead of UTC the local time is at the given moment. This comes from the time zone if one
+    is set, and from the UTC offset otherwise.
+    :param utc_offset: The amount of hours ahead of UTC.
+    :type utc_offset: int
+    :param time_zone: An IANA time zone name, or None.
+    :type time_zone: str
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: float
+    :return: offset (int)
+    """
+    if time_zone is None:
+        return convert_to_seconds(0, utc_offset, 0, 0)
+
+    return time_zones.utc_offset_at(time_zone, timestamp)
+
+
 def get_local_time(utc_offset):
     """
     Gets the current UTC time, shifts it according to the parameter utc_offset, then returns it in the format HH:mm:ss.
     :param utc_offset: The amount of hours ahead of UTC.
     :type utc_offset: int
-    :return: local_time_parsed (arrow)
+    :return: local_time_parsed (str)
     """
-    # get the current UTC time
-    utc = arrow.utcnow()
+    # Get the current UTC time, apply the UTC offset and format it
+    local_time_parsed = format_local_time(clock.now(), utc_offset * 3600, "%H:%M:%S")
 
-    # Apply UTC offset
-    local_time = utc.shift(hours=utc_offset)
+    return local_time_parsed
 
-    # Format it
-    local_time_parsed = local_time.format("HH:mm:ss")
 
-    return local_time_parsed
+def format_local_time(timestamp, utc_offset_seconds, time_format):
+    """
+    Formats a moment in the local time of the given UTC offset. It is done with the time module rather than arrow, so
+    that the server doesn't have to import arrow.
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: float
+    :param utc_offset_seconds: The amount of seconds ahead of UTC.
+    :type utc_offset_seconds: int
+    :param time_format: The format, as understood by time.strftime.
+    :type time_format: str
+    :return: local_time (str)
+    """
+    return time.strftime(time_format, time.gmtime(timestamp + utc_offset_seconds))
 
 
 """
@@ -574,40 +2060,145 @@ def get_local_time(utc_offset):
 """
 
 
-def alarm_mode(countdown, buzzer):
+def load_alarm_song(user_id=DEFAULT_USER_ID):
+    """
+    Returns the compiled song the user chose for the alarm, or the default song if it can't be loaded, since the
+    alarm has to sound either way.
+    :param user_id: Whose song to return.
+    :type user_id: int
+    :return: frequencies (array.array), durations (array.array)
+    """
+    song = cached_user_preferences(user_id)[0]["song"]
+    try:
+        return songs.load_song(song)
+    except (OSError, ValueError) as error:
+        print(f"Could not load the song {song}, playing {songs.DEFAULT_SONG} instead: {error!r}")
+        return songs.load_song(songs.DEFAULT_SONG)
+
+
+def alarm_mode(countdown, buzzer, user_id=DEFAULT_USER_ID):
     """
     Waits out the remaining amount of time until actual wakeup time, then sets the alarm_state in the database to 1.
     Then sounds the alarm while alarm_state in the database is still 1.
-    :param countdown: The remaining time until actual wakeup time, in minutes.
+    :param countdown: The remaining time until actual wakeup time, in seconds, which is negative for an alarm which
+    went off already.
     :type countdown: int
     :param buzzer: The pin for the buzzer
     :type buzzer: gpiozero.TonalBuzzer
+    :param user_id: Whose alarm it is.
+    :type user_id: int
+    :return: None
+    """
+    # Remember when the alarm is meant to go off
+    scheduled_time = clock.now() + countdown
+    wakeup_time_hour, wakeup_time_minute, utc_offset, time_zone, recurrence, skip_dates = \
+        load_settings("minimal", user_id)
+    event_date = format_local_time(scheduled_time, utc_offset_in_seconds(utc_offset, time_zone, scheduled_time),
+                                   "%Y-%m-%d")
+
+    # Remember it in the database too, so that a restart goes on with it
+    set_in_flight_alarm(user_id, scheduled_time, event_date)
+
+    sound_alarm(scheduled_time, event_date, buzzer, user_id, False)
+
+
+def sound_passed_alarms(fire_times, buzzer):
+    """
+    Sounds the alarms which went off while the buzzer was busy with another one, oldest first, and again for those
+    which go off while it is busy with these. Their users are found from when their alarms were going to go off, since
+    the next time an alarm goes off has already moved on to the following day by then.
+    :param fire_times: When the alarm of every other active user was going to go off, by user id.
+    :type fire_times: dict
+    :param buzzer: The pin for the buzzer
+    :type buzzer: gpiozero.TonalBuzzer
     :return: None
     """
-    # Wait until actual wakeup time
-    print("Waiting for " + str(countdown) + " seconds...")
-    time.sleep(countdown)
+    while True:
+        passed_alarms = [(fire_time, user_id) for user_id, fire_time in fire_times.items()
+                         if fire_time <= clock.now() and get_active_state(user_id)]
+        if len(passed_alarms) == 0:
+            return
 
-    print("Actual wakeup time reached.")
+        fire_time, user_id = min(passed_alarms)
+        del fire_times[user_id]
+        print(f"The alarm of user {user_id} went off while the buzzer was busy.")
+        alarm_mode(fire_time - clock.now(), buzzer, user_id)
 
-    # Sound the alarm
-    set_alarm_state(1)
+
+def resume_alarm(in_flight_alarm, buzzer):
+    """
+    Goes on with the alarm which was counting down or ringing when the server stopped. A countdown which is already
+    over sounds the alarm at once.
+    :param in_flight_alarm: The alarm, as returned by load_in_flight_alarm.
+    :type in_flight_alarm: tuple
+    :param buzzer: The pin for the buzzer
+    :type buzzer: gpiozero.TonalBuzzer
+    :return: None
+    """
+    user_id, scheduled_time, event_date, ringing = in_flight_alarm
+    if ringing:
+        print("Going on ringing the alarm after the restart.")
+    else:
+        print("Going on counting down to the alarm after the restart.")
+
+    sound_alarm(scheduled_time, event_date, buzzer, user_id, ringing)
+
+
+@profiling.profiled("alarm_mode")
+def sound_alarm(scheduled_time, event_date, buzzer, user_id, ringing):
+    """
+    Waits until the scheduled time, then sets the alarm_state in the database to 1, unless the alarm is already
+    ringing. Then sounds the alarm while alarm_state in the database is still 1.
+    :param scheduled_time: When the alarm goes off, in seconds since the epoch.
+    :type scheduled_time: float
+    :param event_date: The local date of the scheduled time, in the format YYYY-MM-DD.
+    :type event_date: str
+    :param buzzer: The pin for the buzzer
+    :type buzzer: gpiozero.TonalBuzzer
+    :param user_id: Whose alarm it is.
+    :type user_id: int
+    :param ringing: Whether the alarm went off already, before the server restarted.
+    :type ringing: bool
+    :return: None
+    """
+    recurrence = load_settings("minimal", user_id)[4]
+
+    # Wait until actual wakeup time, which already passed if the server restarted after it
+    if not ringing:
+        countdown = max(scheduled_time - clock.now(), 0)
+        print(f"Waiting for {countdown:.0f} seconds...")
+        clock.sleep(countdown)
+
+        print("Actual wakeup time reached.")
+
+    # Sound the alarm, going on with the song where it left off after every check
+    frequencies, durations = load_alarm_song(user_id)
+    note = 0
+    if not ringing:
+        set_alarm_state(1)
+        record_wake_event_fired(scheduled_time, clock.now(), event_date, user_id)
     while get_alarm_state() == 1:
         print("Still not awake...")
-        for note in SONG_LOSTWOODS:
-            if note != "SILENT":
-                buzzer.play(note)
-            time.sleep(0.2)
+        played_seconds = 0
+        while played_seconds < ALARM_CHECK_SECONDS:
+            if frequencies[note] != 0:
+                buzzer.play(frequencies[note])
+            clock.sleep(durations[note])
             buzzer.stop()
 
+            played_seconds += durations[note]
+            note = (note + 1) % len(frequencies)
+
     print("User is awake!")
 
-    # Make sure the buzzers turns off
+    # Make sure the buzzers turns off, and forget the alarm first, so a restart in between never sounds it again
+    set_in_flight_alarm(None, None, None)
     set_alarm_state(0)
     buzzer.stop()
 
-    # Deactivate active_state
-    set_active_state(0)
+    # Deactivate active_state, unless the alarm recurs
+    if recurrence == schedule.RULE_ONCE:
+        set_active_state(0, user_id)
 
 
 if __name__ == '__main__':
@@ -8,12 +8,18 @@ import sqlite3
 import os
 
 DATABASE_PATH = "server/db"
+# The user every command is for unless it names another, who owns the preferences from before there were users
+DEFAULT_USER_ID = 1
+DEFAULT_USER_NAME = "default"
+# Preferences of a new user, before any are changed
+NEW_USER_PREFERENCES = {"wakeup_time_hour": 16, "wakeup_time_minute": 0, "utc_offset": 2, "wakeup_window": 2,
+                        "active_state": 0}
 
 
 def main():
     """
-    In the case that a database already exists, ask the user if it's really okay to reset it. If no, then do nothing
-    and exit. If yes, delete the existing database and create a new one.
+    In the case that a database already exists, ask the user if it's really okay to reset it. If no, then only
+    upgrade the existing database. If yes, delete the existing database and create a new one.
     :return: None
     """
     reset = False
@@ -32,6 +38,10 @@ def main():
             # Create a new one
             create_database()
 
+        # Otherwise bring the existing database up to date
+        else:
+            upgrade_database()
+
     # A database does not exist
     else:
         create_database()
@@ -63,7 +73,7 @@ def create_database():
     sql_query = """INSERT INTO user_preferences(wakeup_time_hour, wakeup_time_minute, utc_offset, wakeup_window,
     active_state)
     VALUES(?, ?, ?, ?, ?)"""
-    data = 16, 00, 2, 2, 0
+    data = tuple(NEW_USER_PREFERENCES.values())
     cursor.execute(sql_query, data)
 
     # Save changes to database
@@ -72,6 +82,114 @@ def create_database():
     # Close database
     db.close()
 
+    # Add everything which came after the original tables
+    upgrade_database()
+
+
+def upgrade_database():
+    """
+    Brings an existing database up to date by adding the tables and columns it is missing.
+    Safe to run any number of times.
+    :return: None
+    """
+    # Establish database connection
+    db = sqlite3.connect(DATABASE_PATH)
+    cursor = db.cursor()
+
+    # Revision of the user preferences, increased on every change
+    add_column(cursor, "server_settings", "preferences_revision", "INTEGER NOT NULL DEFAULT 0")
+
+    # How many processes serve the commands of the clients
+    add_column(cursor, "server_settings", "communication_workers", "INTEGER NOT NULL DEFAULT 1")
+
+    # Let readers carry on while a communication worker or the main loop writes
+    cursor.execute("PRAGMA journal_mode=WAL")
+
+    # Unix domain socket the server listens on besides TCP, for clients on the same host, or NULL for only TCP
+    add_column(cursor, "server_settings", "unix_socket_path", "TEXT DEFAULT 'server/wakeywakey.sock'")
+
+    # The alarm which is counting down or ringing, so that a restart goes on with it, or NULL for none
+    add_column(cursor, "server_settings", "alarm_user_id", "INTEGER")
+    add_column(cursor, "server_settings", "alarm_scheduled_time", "REAL")
+    add_column(cursor, "server_settings", "alarm_event_date", "TEXT")
+
+    # Port of the HTTP gateway dashboards poll, or NULL for no gateway. It answers anyone who can reach it, without
+    # authentication, so it is off until a port is set, for example UPDATE server_settings SET http_port = 49501
+    add_column(cursor, "server_settings", "http_port", "INTEGER")
+
+    # IANA time zone of the user, which replaces utc_offset once set
+    add_column(cursor, "user_preferences", "time_zone", "TEXT")
+
+    # Recurrence rule of the alarm (once, daily, weekdays, weekends or days like mon,wed,fri), and dates to skip
+    add_column(cursor, "user_preferences", "recurrence", "TEXT NOT NULL DEFAULT 'once'")
+    add_column(cursor, "user_preferences", "skip_dates", "TEXT")
+
+    # Name of the song in server/songs the alarm plays
+    add_column(cursor, "user_preferences", "song", "TEXT NOT NULL DEFAULT 'lostwoods'")
+
+    # Everyone sharing the server, where the default user owns the preferences from before there were users
+    sql_query = """CREATE TABLE IF NOT EXISTS users(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)"""
+    cursor.execute(sql_query)
+    cursor.execute("INSERT OR IGNORE INTO users(id, name) VALUES(?, ?)", (DEFAULT_USER_ID, DEFAULT_USER_NAME))
+
+    # One row of preferences per user, found through the user_id index, with its own revision
+    add_column(cursor, "user_preferences", "user_id", "INTEGER")
+    cursor.execute("UPDATE user_preferences SET user_id = ? WHERE user_id IS NULL AND id = 1", (DEFAULT_USER_ID,))
+    add_column(cursor, "user_preferences", "preferences_revision", "INTEGER NOT NULL DEFAULT 0")
+    # The default user goes on from the revision all preferences shared before, so clients never see it go back
+    sql_query = """UPDATE user_preferences SET preferences_revision = (SELECT preferences_revision FROM server_settings)
+    WHERE user_id = ? AND preferences_revision = 0"""
+    cursor.execute(sql_query, (DEFAULT_USER_ID,))
+    sql_query = """CREATE UNIQUE INDEX IF NOT EXISTS user_preferences_user_id ON user_preferences(user_id)"""
+    cursor.execute(sql_query)
+    # When the preferences of the user last changed, in seconds since the epoch, which tells a restart whether an alarm
+    # set to go off once has already had its time, or NULL if they haven't changed since this column was added
+    add_column(cursor, "user_preferences", "preferences_changed_time", "REAL")
+
+    # History of every alarm, with times in seconds since the epoch, and the local date of the scheduled time
+    sql_query = """CREATE TABLE IF NOT EXISTS wake_events(id INTEGER PRIMARY KEY, event_date TEXT NOT NULL,
+    scheduled_time REAL NOT NULL, fired_time REAL, dismissed_time REAL, failed_attempts INTEGER NOT NULL DEFAULT 0)"""
+    cursor.execute(sql_query)
+    # Whose alarm it was, found through an index which replaces the one on event_date alone, where the history from
+    # before there were users belongs to the default user
+    add_column(cursor, "wake_events", "user_id", "INTEGER")
+    cursor.execute("UPDATE wake_events SET user_id = ? WHERE user_id IS NULL", (DEFAULT_USER_ID,))
+    cursor.execute("DROP INDEX IF EXISTS wake_events_event_date")
+    sql_query = """CREATE INDEX IF NOT EXISTS wake_events_user_id_event_date ON wake_events(user_id, event_date)"""
+    cursor.execute(sql_query)
+
+    # Mouse pointer traces of the awake tests, compressed as sent by the client, with the metrics computed from them
+    sql_query = """CREATE TABLE IF NOT EXISTS wake_traces(id INTEGER PRIMARY KEY, wake_event_id INTEGER, trace BLOB,
+    samples INTEGER, duration REAL, wall_hits INTEGER, mean_speed REAL, max_speed REAL, hesitation_seconds REAL,
+    path_efficiency REAL)"""
+    cursor.execute(sql_query)
+
+    # Save changes to database
+    db.commit()
+
+    # Close database
+    db.close()
+
+
+def add_column(cursor, table, column, column_type):
+    """
+    Adds a column to a table, unless the table already has it.
+    :param cursor: A cursor of the database connection.
+    :type cursor: sqlite3.Cursor
+    :param table: Which table to add the column to.
+    :type table: str
+    :param column: The name of the new column.
+    :type column: str
+    :param column_type: The type and constraints of the new column.
+    :type column_type: str
+    :return: None
+    """
+    cursor.execute("PRAGMA table_info(" + table + ")")
+    existing_columns = [row[1] for row in cursor.fetchall()]
+
+    if column not in existing_columns:
+        cursor.execute("ALTER TABLE " + table + " ADD COLUMN " + column + " " + column_type)
+
 
 if __name__ == '__main__':
     main()
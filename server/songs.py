@@ -0,0 +1,225 @@
+"""
+File: songs.py
+
+This module loads the melodies the alarm plays from RTTTL files in server/songs, which look like
+lostwoods:d=4,o=4,b=300:a3,p,a4,p,a5,p,p
+where d, o and b are the default duration, octave and beats per minute, followed by the notes. Every note is a letter
+from a to g, or p for a pause, with an optional duration before it, and an optional sharp, dot and octave after it.
+
+A song is compiled once into an array of frequencies, where a pause is 0, and an array of durations in seconds, so
+that playing it parses nothing. Compiled songs are kept in memory, and in server/songs/cache, so that a song is only
+compiled again once its file changes.
+"""
+
+import array
+import os
+import re
+import struct
+
+SONGS_DIRECTORY = "server/songs"
+SONG_EXTENSION = ".rtttl"
+CACHE_DIRECTORY = "server/songs/cache"
+CACHE_MAGIC = b"WWSG"
+CACHE_VERSION = 1
+# Magic, version, modification time and size of the song file, and the amount of notes
+CACHE_HEADER_FORMAT = "<4sBqqI"
+DEFAULT_SONG = "lostwoods"
+DEFAULT_DURATION = 4
+DEFAULT_OCTAVE = 6
+DEFAULT_BEATS_PER_MINUTE = 63
+DURATIONS = [1, 2, 4, 8, 16, 32]
+# Semitones from A in the same octave
+NOTE_SEMITONES = {"c": -9, "c#": -8, "d": -7, "d#": -6, "e": -5, "f": -4, "f#": -3, "g": -2, "g#": -1, "a": 0,
+                  "a#": 1, "b": 2, "h": 2}
+NOTE_PATTERN = re.compile(r"(\d*)([a-hp]#?)(\.?)(\d?)(\.?)")
+# Range of gpiozero.TonalBuzzer with its default mid tone of A4 and one octave, which notes are moved into by octaves
+LOWEST_FREQUENCY = 220.0
+HIGHEST_FREQUENCY = 880.0
+
+# Compiled songs by name, with the modification time and size of their file
+compiled_songs = {}
+
+
+def list_songs():
+    """
+    Returns the names of every song in the songs directory.
+    :return: names (list of str)
+    """
+    return sorted(file_name[:-len(SONG_EXTENSION)] for file_name in os.listdir(SONGS_DIRECTORY)
+                  if file_name.endswith(SONG_EXTENSION))
+
+
+def is_valid_song(name):
+    """
+    Tests if a song with the given name exists and can be compiled.
+    :param name: The name of the song.
+    :type name: str
+    :return: is_valid (bool)
+    """
+    if name not in list_songs():
+        return False
+
+    try:
+        load_song(name)
+    except ValueError:
+        return False
+
+    return True
+
+
+def load_song(name):
+    """
+    Returns a compiled song, from memory if it was loaded before, else from the cache on disk, else by compiling it.
+    :param name: The name of the song.
+    :type name: str
+    :return: frequencies (array.array), durations (array.array)
+    """
+    song_path = os.path.join(SONGS_DIRECTORY, name + SONG_EXTENSION)
+    song_stat = os.stat(song_path)
+    song_version = (song_stat.st_mtime_ns, song_stat.st_size)
+
+    # Compiled earlier by this process
+    if name in compiled_songs and compiled_songs[name][0] == song_version:
+        return compiled_songs[name][1:]
+
+    # Compiled earlier by any process
+    cache_path = os.path.join(CACHE_DIRECTORY, name + ".bin")
+    song = read_cache(cache_path, song_version)
+
+    # Not compiled since the song changed
+    if song is None:
+        with open(song_path) as song_file:
+            song = compile_rtttl(song_file.read())
+        write_cache(cache_path, song_version, *song)
+
+    compiled_songs[name] = (song_version,) + song
+
+    return song
+
+
+def compile_rtttl(text):
+    """
+    Compiles an RTTTL melody into arrays of frequencies and durations.
+    :param text: The melody, like name:d=4,o=5,b=120:c,e,g,2c6
+    :type text: str
+    :return: frequencies (array.array), durations (array.array)
+    """
+    sections = "".join(text.split()).lower().split(":")
+    if len(sections) != 3:
+        raise ValueError("A song must have a name, defaults and notes separated by colons")
+
+    # Read the defaults
+    defaults = {"d": DEFAULT_DURATION, "o": DEFAULT_OCTAVE, "b": DEFAULT_BEATS_PER_MINUTE}
+    for default in filter(None, sections[1].split(",")):
+        key, separator, value = default.partition("=")
+        if key not in defaults or not value.isdigit():
+            raise ValueError(f"Unknown default: {default}")
+        defaults[key] = int(value)
+    if defaults["d"] not in DURATIONS or defaults["b"] == 0:
+        raise ValueError("Invalid default duration or beats per minute")
+
+    # A whole note lasts four beats
+    whole_note_seconds = 4 * 60 / defaults["b"]
+
+    frequencies = array.array("d")
+    durations = array.array("d")
+    for note in sections[2].split(","):
+        match = NOTE_PATTERN.fullmatch(note)
+        if match is None:
+            raise ValueError(f"Invalid note: {note}")
+        duration, pitch, dot, octave, dot_after_octave = match.groups()
+
+        duration = int(duration) if duration else defaults["d"]
+        if duration not in DURATIONS:
+            raise ValueError(f"Invalid duration of note: {note}")
+        seconds = whole_note_seconds / duration
+        if dot or dot_after_octave:
+            seconds *= 1.5
+
+        if pitch == "p":
+            frequency = 0.0
+        elif pitch not in NOTE_SEMITONES:
+            raise ValueError(f"Invalid note: {note}")
+        else:
+            octave = int(octave) if octave else defaults["o"]
+            frequency = fit_to_buzzer(440.0 * 2 ** (NOTE_SEMITONES[pitch] / 12 + octave - 4))
+
+        frequencies.append(frequency)
+        durations.append(seconds)
+
+    return frequencies, durations
+
+
+def fit_to_buzzer(frequency):
+    """
+    Moves a frequency by whole octaves until the buzzer can play it.
+    :param frequency: The frequency in Hz.
+    :type frequency: float
+    :return: frequency (float)
+    """
+    while frequency < LOWEST_FREQUENCY:
+        frequency *= 2
+    while frequency > HIGHEST_FREQUENCY:
+        frequency /= 2
+
+    return frequency
+
+
+def read_cache(cache_path, song_version):
+    """
+    Reads a compiled song from the cache, unless it is missing or was compiled from another version of the song.
+    :param cache_path: The path of the cached song.
+    :type cache_path: str
+    :param song_version: The modification time and size of the song file.
+    :type song_version: tuple
+    :return: frequencies (array.array), durations (array.array), or None
+    """
+    try:
+        with open(cache_path, "rb") as cache_file:
+            data = cache_file.read()
+    except OSError:
+        return None
+
+    header_size = struct.calcsize(CACHE_HEADER_FORMAT)
+    if len(data) < header_size:
+        return None
+    magic, version, modification_time, size, count = struct.unpack_from(CACHE_HEADER_FORMAT, data)
+    if magic != CACHE_MAGIC or version != CACHE_VERSION or (modification_time, size) != song_version:
+        return None
+
+    frequencies = array.array("d")
+    durations = array.array("d")
+    array_size = count * frequencies.itemsize
+    if len(data) != header_size + 2 * array_size:
+        return None
+    frequencies.frombytes(data[header_size:header_size + array_size])
+    durations.frombytes(data[header_size + array_size:])
+
+    return frequencies, durations
+
+
+def write_cache(cache_path, song_version, frequencies, durations):
+    """
+    Writes a compiled song to the cache. The file is replaced at once, so a reader never sees half of it.
+    :param cache_path: The path of the cached song.
+    :type cache_path: str
+    :param song_version: The modification time and size of the song file.
+    :type song_version: tuple
+    :param frequencies: The frequencies of the notes.
+    :type frequencies: array.array
+    :param durations: The durations of the notes.
+    :type durations: array.array
+    :return: None
+    """
+    header = struct.pack(CACHE_HEADER_FORMAT, CACHE_MAGIC, CACHE_VERSION, song_version[0], song_version[1],
+                         len(frequencies))
+
+    # The cache is only there to save time, so a song which can't be cached is simply compiled again next time
+    try:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        temporary_path = f"{cache_path}.{os.getpid()}"
+        with open(temporary_path, "wb") as cache_file:
+            cache_file.write(header + frequencies.tobytes() + durations.tobytes())
+        os.replace(temporary_path, cache_path)
+    except OSError as error:
+        print(f"Could not cache the song at {cache_path}: {error!r}")
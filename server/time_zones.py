@@ -0,0 +1,195 @@
+"""
+File: time_zones.py
+
+This module turns IANA time zone names (such as Europe/Oslo) into UTC offsets and alarm times, while following the
+daylight saving time changes of the zone.
+The transitions of a zone are computed once into a table of UTC timestamps and offsets in seconds, and cached. After
+that, finding the offset at any moment is a binary search over integers, rather than a full time zone conversion.
+"""
+
+import bisect
+import datetime
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:
+    # Python 3.8 does not have zoneinfo, but dateutil comes with arrow
+    ZoneInfo = None
+    from dateutil import tz
+
+SECONDS_IN_A_DAY = 86400
+TABLE_YEARS_BEFORE = 1
+TABLE_YEARS_AFTER = 10
+
+# Cached transition tables, by time zone name
+transition_tables = {}
+
+
+def is_valid_time_zone(time_zone):
+    """
+    Tests if the given name is a time zone this machine knows about.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :return: is_valid (bool)
+    """
+    try:
+        return load_time_zone(time_zone) is not None
+    except (ValueError, OSError):
+        return False
+
+
+def load_time_zone(time_zone):
+    """
+    Loads the tzinfo of the given time zone name.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :return: tzinfo (datetime.tzinfo), or None if unknown
+    """
+    if ZoneInfo is not None:
+        try:
+            return ZoneInfo(time_zone)
+        except ZoneInfoNotFoundError:
+            return None
+
+    return tz.gettz(time_zone)
+
+
+def transition_table(time_zone, timestamp):
+    """
+    Returns the cached transition table of the time zone, and builds it first if it doesn't cover the timestamp.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :param timestamp: A moment the table must cover, in seconds since the epoch.
+    :type timestamp: float
+    :return: transition_times (list of int), offsets (list of int)
+    """
+    table = transition_tables.get(time_zone)
+    if table is None or not table[0] <= timestamp < table[1]:
+        year = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).year
+        table = build_transition_table(time_zone, year - TABLE_YEARS_BEFORE, year + TABLE_YEARS_AFTER)
+        transition_tables[time_zone] = table
+
+    return table[2], table[3]
+
+
+def build_transition_table(time_zone, first_year, last_year):
+    """
+    Finds every change of UTC offset in the time zone from the start of first_year to the end of last_year.
+    The offsets are checked once a day, and every change is then narrowed down to the exact second.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :param first_year: The first year the table covers.
+    :type first_year: int
+    :param last_year: The last year the table covers.
+    :type last_year: int
+    :return: start (int), end (int), transition_times (list of int), offsets (list of int)
+    """
+    tzinfo = load_time_zone(time_zone)
+    if tzinfo is None:
+        raise ValueError(f"Unknown time zone: {time_zone}")
+
+    start = int(datetime.datetime(first_year, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+    end = int(datetime.datetime(last_year + 1, 1, 1, tzinfo=datetime.timezone.utc).timestamp())
+
+    # The offset in effect at the start of the table
+    transition_times = [start]
+    offsets = [offset_of(tzinfo, start)]
+
+    for day in range(start + SECONDS_IN_A_DAY, end + SECONDS_IN_A_DAY, SECONDS_IN_A_DAY):
+        offset = offset_of(tzinfo, day)
+        if offset == offsets[-1]:
+            continue
+
+        # Narrow the change down to the first second with the new offset
+        low = day - SECONDS_IN_A_DAY
+        high = day
+        while high - low > 1:
+            middle = (low + high) // 2
+            if offset_of(tzinfo, middle) == offsets[-1]:
+                low = middle
+            else:
+                high = middle
+        transition_times.append(high)
+        offsets.append(offset)
+
+    return start, end, transition_times, offsets
+
+
+def offset_of(tzinfo, timestamp):
+    """
+    Asks the tzinfo for its UTC offset at the given moment.
+    :param tzinfo: The time zone.
+    :type tzinfo: datetime.tzinfo
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: int
+    :return: offset (int) in seconds
+    """
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).astimezone(tzinfo)
+
+    return int(moment.utcoffset().total_seconds())
+
+
+def utc_offset_at(time_zone, timestamp):
+    """
+    Returns the UTC offset of the time zone at the given moment, from the cached transition table.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :param timestamp: The moment, in seconds since the epoch.
+    :type timestamp: float
+    :return: offset (int) in seconds
+    """
+    transition_times, offsets = transition_table(time_zone, timestamp)
+
+    return offsets[bisect.bisect_right(transition_times, timestamp) - 1]
+
+
+def local_to_utc(time_zone, local_timestamp):
+    """
+    Turns a local wall clock time, counted in seconds as if it were UTC, into a real UTC timestamp.
+    Like zoneinfo with fold=0, a wall clock time which happens twice resolves to the first time, and one which is
+    skipped by a daylight saving time change resolves using the offset from before the change.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :param local_timestamp: The wall clock time.
+    :type local_timestamp: int
+    :return: timestamp (int)
+    """
+    # Guess with the offset from a day earlier, which is the offset from before any change close by
+    offset_before = utc_offset_at(time_zone, local_timestamp - SECONDS_IN_A_DAY)
+    timestamp = local_timestamp - offset_before
+    if utc_offset_at(time_zone, timestamp) == offset_before:
+        return timestamp
+
+    # Otherwise the offset changed in between
+    offset_after = utc_offset_at(time_zone, timestamp)
+    if utc_offset_at(time_zone, local_timestamp - offset_after) == offset_after:
+        return local_timestamp - offset_after
+
+    # The wall clock time was skipped
+    return timestamp
+
+
+def next_fire_time(time_zone, hour, minute, now):
+    """
+    Returns the next moment, from now on, at which the local wall clock in the time zone shows hour:minute.
+    :param time_zone: An IANA time zone name.
+    :type time_zone: str
+    :param hour: The local hour.
+    :type hour: int
+    :param minute: The local minute.
+    :type minute: int
+    :param now: The current time, in seconds since the epoch.
+    :type now: float
+    :return: timestamp (int)
+    """
+    # Today at hour:minute, on the local wall clock
+    local_now = int(now) + utc_offset_at(time_zone, now)
+    local_fire_time = local_now - local_now % SECONDS_IN_A_DAY + (hour * 60 + minute) * 60
+
+    fire_time = local_to_utc(time_zone, local_fire_time)
+
+    # If that has already passed, then tomorrow
+    if fire_time < int(now):
+        fire_time = local_to_utc(time_zone, local_fire_time + SECONDS_IN_A_DAY)
+
+    return fire_time
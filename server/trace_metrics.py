@@ -0,0 +1,98 @@
+"""
+File: trace_metrics.py
+
+This module unpacks the mouse pointer traces uploaded by the client after an awake test, and computes how the user
+moved with vectorized numpy code. numpy is only imported once a trace arrives, so it doesn't slow down server startup.
+The format of the traces is shared with the client, see common/trace_format.py.
+"""
+
+import zlib
+import trace_format
+from trace_format import EVENT_WALL
+
+MAX_TRACE_BYTES = 4 * 1024 * 1024
+HESITATION_SPEED = 20
+
+
+def decode_trace(data):
+    """
+    Unpacks a compressed trace into numpy arrays.
+    :param data: The trace, as made by trajectory.encode_trace on the client.
+    :type data: bytes
+    :return: start (tuple), goal (tuple), time (np.ndarray), x (np.ndarray), y (np.ndarray), event (np.ndarray)
+    """
+    import numpy as np
+
+    # Never inflate more than a trace can be
+    decompressor = zlib.decompressobj()
+    data = decompressor.decompress(data, MAX_TRACE_BYTES)
+    if decompressor.unconsumed_tail:
+        raise ValueError("Trace is too large.")
+
+    offset, count, start, goal, seed, window_size = trace_format.unpack_header(data)
+
+    # The arrays follow each other right after the header
+    timestamps = np.frombuffer(data, dtype="<f4", count=count, offset=offset).astype(np.float64)
+    offset += count * 4
+    x = np.frombuffer(data, dtype="<i2", count=count, offset=offset).astype(np.float64)
+    offset += count * 2
+    y = np.frombuffer(data, dtype="<i2", count=count, offset=offset).astype(np.float64)
+    offset += count * 2
+    event = np.frombuffer(data, dtype="u1", count=count, offset=offset)
+
+    return start, goal, timestamps, x, y, event
+
+
+def compute_metrics(start, goal, timestamps, x, y, event):
+    """
+    Computes how the user moved during the awake test, without looping over the samples in python.
+    Movement right after touching a wall is left out, since the pointer was moved back to start by the client.
+    :param start: The coordinates of the start position of the challenge.
+    :type start: tuple
+    :param goal: The coordinates of the center of the goal.
+    :type goal: tuple
+    :param timestamps: When each sample was taken, in seconds since the first one.
+    :type timestamps: np.ndarray
+    :param x: The x coordinate of each sample.
+    :type x: np.ndarray
+    :param y: The y coordinate of each sample.
+    :type y: np.ndarray
+    :param event: What happened at each sample.
+    :type event: np.ndarray
+    :return: metrics (dict)
+    """
+    import numpy as np
+
+    metrics = {"samples": int(len(event)),
+               "duration": float(timestamps[-1] - timestamps[0]) if len(event) > 0 else 0.0,
+               "wall_hits": int(np.count_nonzero(event == EVENT_WALL)),
+               "mean_speed": 0.0,
+               "max_speed": 0.0,
+               "hesitation_seconds": 0.0,
+               "path_efficiency": 0.0}
+    if len(event) < 2:
+        return metrics
+
+    # Distance and time between each pair of samples
+    dt = np.diff(timestamps)
+    distance = np.hypot(np.diff(x), np.diff(y))
+    valid = (event[:-1] != EVENT_WALL) & (dt > 0)
+    if not np.any(valid):
+        return metrics
+
+    speed = distance[valid] / dt[valid]
+    metrics["mean_speed"] = float(distance[valid].sum() / dt[valid].sum())
+    metrics["max_speed"] = float(speed.max())
+
+    # Time spent (almost) standing still
+    metrics["hesitation_seconds"] = float(dt[valid][speed < HESITATION_SPEED].sum())
+
+    # How direct the last attempt was, from the last wall hit (or the beginning) to the end
+    wall_hits = np.flatnonzero(event == EVENT_WALL)
+    last_attempt = wall_hits[-1] + 1 if len(wall_hits) > 0 else 0
+    path_length = distance[last_attempt:].sum()
+    direct_length = np.hypot(goal[0] - start[0], goal[1] - start[1])
+    if path_length > 0:
+        metrics["path_efficiency"] = float(min(direct_length / path_length, 1.0))
+
+    return metrics